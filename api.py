@@ -0,0 +1,557 @@
+"""Headless HTTP API for the Study AI tools.
+
+Run with `uvicorn api:app`. It serves the same tools as the Streamlit app from the same
+process-independent state: the document library, the embedding/OCR/generation/answer
+caches under STUDY_AI_CACHE_DIR, so work done through either front end is reused by the
+other. Long work (OCR, indexing, map-reduce summaries, whole-document flashcards and
+practice questions) runs on the background job runner and is polled through /jobs.
+"""
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import List, Optional
+
+from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+
+import study_tools
+import telemetry
+from chat_memory import ChatMemory
+from context_packer import tool_budget
+from corpus import estimate_tokens
+from document_library import DEFAULT_LIBRARY, get_document_library
+from generation_cache import is_error_output, llm_identity
+from jobs import DONE as JOB_DONE, get_job_runner
+from llm_streaming import CompletionStream, invoke_completion
+from ocr import get_ocr_backend, ocr_backend_names
+from vector_registry import get_vector_registry
+
+# --- API configuration ---
+API_CLIENT_CONCURRENCY = int(os.getenv("STUDY_AI_API_CLIENT_CONCURRENCY", "4"))  # Requests one client may have in flight
+API_TIMEOUT_S = float(os.getenv("STUDY_AI_API_TIMEOUT_S", "120"))  # Per synchronous request, streaming included
+CLIENT_ID_HEADER = "X-Client-Id"
+
+TOOLS = ("practice_questions", "explanation", "flashcards", "summary", "mindmap")
+_STREAM_END = object()
+
+app = FastAPI(title="Study AI API")
+
+
+class ClientLimiter:
+    """Caps the requests in flight per client, so one client can't take every worker thread."""
+
+    def __init__(self, limit=API_CLIENT_CONCURRENCY):
+        self.limit = limit
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, client_id):
+        with self._lock:
+            if self._active.get(client_id, 0) >= self.limit:
+                raise HTTPException(429, f"Too many concurrent requests (limit {self.limit} per client).")
+            self._active[client_id] = self._active.get(client_id, 0) + 1
+
+    def release(self, client_id):
+        with self._lock:
+            remaining = self._active.get(client_id, 1) - 1
+            if remaining > 0:
+                self._active[client_id] = remaining
+            else:
+                self._active.pop(client_id, None)
+
+
+limiter = ClientLimiter()
+
+
+class ClientSlot:
+    """One request's place in the ClientLimiter, released when the last party using it lets go.
+
+    Besides the request handler, a response stream or a worker thread still running after a
+    504 can hold it (`hold()`), so a client can't pile up background work past its limit.
+    """
+
+    def __init__(self, client_id):
+        limiter.acquire(client_id)
+        self.client_id = client_id
+        self._holders = 1
+        self._lock = threading.Lock()
+
+    def hold(self):
+        with self._lock:
+            self._holders += 1
+
+    def release(self):
+        with self._lock:
+            self._holders -= 1
+            last = self._holders == 0
+        if last:
+            limiter.release(self.client_id)
+
+
+def client_id(request):
+    return request.headers.get(CLIENT_ID_HEADER) or (request.client.host if request.client else "anonymous")
+
+
+@lru_cache(maxsize=1)
+def get_api_key():
+    api_key = os.getenv("GOOGLE_API_KEY_GEMINI")
+    if not api_key:
+        raise HTTPException(503, "API Key (GOOGLE_API_KEY_GEMINI) not set on the server.")
+    return api_key
+
+
+@lru_cache(maxsize=1)
+def get_models():
+    """The LangChain clients, built once per process on first use."""
+    return study_tools.create_study_models(get_api_key())
+
+
+@lru_cache(maxsize=1)
+def get_genai():
+    return study_tools.create_genai(get_api_key())
+
+
+async def run_with_timeout(fn, *args, slot=None, **kwargs):
+    """Runs blocking tool code off the event loop; gives up (504) after API_TIMEOUT_S.
+
+    The worker thread is not interrupted: its result is dropped, but anything it caches
+    still serves the next request. It holds the request's ClientSlot, if given, until it
+    actually finishes.
+    """
+    def run_holding_slot():
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            slot.release()
+
+    if slot is not None:
+        slot.hold()
+        target = run_holding_slot
+    else:
+        target = functools.partial(fn, *args, **kwargs)
+    try:
+        return await asyncio.wait_for(run_in_threadpool(target), timeout=API_TIMEOUT_S)
+    except asyncio.TimeoutError:
+        raise HTTPException(504, f"Timed out after {API_TIMEOUT_S:.0f}s. Long work is better submitted as a job.")
+
+
+def selection_corpus(library_name, doc_ids):
+    """The DocumentCorpus of the selected documents (its content hash keys the output caches)."""
+    with opened_selection(library_name, doc_ids) as handle:
+        return handle.corpus
+
+
+@contextmanager
+def opened_selection(library_name, doc_ids):
+    """A shared index on the selected documents, released when the request is done with it."""
+    library = get_document_library()
+    known = {doc["doc_id"] for doc in library.list_documents(library_name)}
+    missing = [doc_id for doc_id in doc_ids if doc_id not in known]
+    if not doc_ids or missing:
+        raise HTTPException(404, f"Documents not in library '{library_name}': {', '.join(missing) or '(none selected)'}")
+    handle = study_tools.open_study_selection(library, library_name, doc_ids, get_models()["embeddings_studybuddy"])
+    try:
+        yield handle
+    finally:
+        handle.release()
+
+
+def ndjson_stream(chunks, slot, on_finish=None):
+    """Streams text chunks as NDJSON lines, ending with {"done": true, ...}; stops at the request deadline.
+
+    Each chunk is awaited in a worker thread with the time left until the deadline, so a
+    model that hangs before its first token (or between two) is timed out too. Holds the
+    request's ClientSlot until the stream ends, or until a chunk still being produced when
+    it ended arrives.
+    """
+    deadline = time.monotonic() + API_TIMEOUT_S
+    slot.hold()
+    iterator = iter(chunks)
+
+    def release_when_done(future):
+        if not future.cancelled():
+            future.exception()  # Retrieved, so a late failure isn't logged as never retrieved
+        slot.release()
+
+    async def lines():
+        text = ""
+        pending = None
+        try:
+            while True:
+                pending = asyncio.ensure_future(run_in_threadpool(next, iterator, _STREAM_END))
+                try:
+                    chunk = await asyncio.wait_for(asyncio.shield(pending), timeout=max(0, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    yield json.dumps({"error": f"Timed out after {API_TIMEOUT_S:.0f}s."}) + "\n"
+                    return
+                if chunk is _STREAM_END:
+                    break
+                text += chunk
+                yield json.dumps({"delta": chunk}) + "\n"
+            final = await run_in_threadpool(on_finish, text) if on_finish else {}
+            yield json.dumps(dict(final, done=True, text=text)) + "\n"
+        finally:
+            if pending is not None and not pending.done():
+                pending.add_done_callback(release_when_done)  # The model call is still running
+            else:
+                slot.release()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+def serialize_job(job):
+    payload = {
+        "id": job.id, "kind": job.kind, "status": job.status, "progress": job.fraction,
+        "message": job.message, "error": job.error,
+    }
+    if job.status == JOB_DONE:
+        payload["result"] = job.result
+    return payload
+
+
+# =============================================
+# Health and jobs
+# =============================================
+
+@app.get("/health")
+def health():
+    return {
+        "status": "ok", "jobs": get_job_runner().stats(), "indexes": get_vector_registry().stats(),
+        "stages": telemetry.stage_summary(),
+    }
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = get_job_runner().get(job_id)
+    if job is None:
+        raise HTTPException(404, "Unknown or expired job.")
+    return serialize_job(job)
+
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    if get_job_runner().get(job_id) is None:
+        raise HTTPException(404, "Unknown or expired job.")
+    get_job_runner().cancel(job_id)
+    return serialize_job(get_job_runner().get(job_id))
+
+
+# =============================================
+# OCR and the document library
+# =============================================
+
+def run_ocr_job(job, genai, pdf_bytes, pdf_name, mime_type, parallel, backend):
+    return study_tools.run_ocr(genai, pdf_bytes, pdf_name, mime_type, parallel=parallel, progress=job.report, backend=backend)
+
+
+def check_ocr_backend(backend):
+    if backend not in ocr_backend_names():
+        raise HTTPException(422, f"Unknown or unavailable OCR backend '{backend}'. Available: {', '.join(ocr_backend_names())}.")
+
+
+def submit_ocr(pdf_bytes, pdf_name, mime_type, parallel, backend):
+    job_id = get_job_runner().submit(
+        "ocr", ("ocr", hashlib.md5(pdf_bytes).hexdigest(), parallel, backend), run_ocr_job,
+        get_genai(), pdf_bytes, pdf_name, mime_type, parallel, backend
+    )
+    return {"job_id": job_id}
+
+
+@app.post("/ocr", status_code=202)
+async def start_ocr(file: UploadFile = File(...), parallel: bool = Form(True), backend: str = Form("gemini")):
+    check_ocr_backend(backend)
+    pdf_bytes = await file.read()
+    # Hashing a large PDF and building the client are blocking: keep them off the event loop
+    return await run_with_timeout(
+        submit_ocr, pdf_bytes, file.filename or "document.pdf", file.content_type or "application/pdf", parallel, backend
+    )
+
+
+def index_document_job(job, *args, **kwargs):
+    return study_tools.index_document(*args, progress=job.report, **kwargs)
+
+
+@app.get("/documents")
+def list_documents(library: str = DEFAULT_LIBRARY):
+    return {"library": library, "documents": get_document_library().list_documents(library)}
+
+
+def submit_document(upload, text, name, doc_id, library, ocr_backend):
+    """Starts indexing an upload ((bytes, content type, file name)) or, without one, pasted `text`."""
+    library_store = get_document_library()
+    edited_content_hash = None
+    if upload is not None:
+        file_bytes, file_type, file_name = upload
+        pasted_text = None
+        content_hash = hashlib.md5(file_bytes).hexdigest()
+        doc_name = name or file_name or "Uploaded file"
+        doc_id = content_hash
+    else:
+        file_bytes, file_type, pasted_text = None, None, text
+        content_hash = hashlib.md5(text.encode("utf-8")).hexdigest()
+        doc_name = name or f"Pasted Text ({time.strftime('%Y-%m-%d %H:%M')})"
+        if doc_id:
+            edited_content_hash = content_hash # Only changed chunks are embedded again
+        else:
+            doc_id = f"pasted-{uuid.uuid4().hex[:16]}"
+
+    if edited_content_hash is None and library_store.has_document(library, doc_id):
+        return JSONResponse({"doc_id": doc_id, "job_id": None}, status_code=200)
+    # Each edit is numbered when submitted and replaces the previous edit's job: only the newest text is written
+    edit_sequence = library_store.next_edit_sequence() if edited_content_hash else None
+    job_id = get_job_runner().submit(
+        "ingest", ("ingest", library, doc_id, edited_content_hash, edit_sequence), index_document_job,
+        library_store, library, doc_id, doc_name, file_bytes, file_type, pasted_text,
+        get_models()["embeddings_studybuddy"], edited_content_hash=edited_content_hash,
+        ocr_client=get_ocr_backend(ocr_backend, get_genai()) if file_type == "application/pdf" else None,
+        edit_sequence=edit_sequence,
+        reuse_result=False,  # A finished ingestion may have been undone since (document removed): index again
+        supersede=("edit", doc_id) if edited_content_hash else None
+    )
+    if edited_content_hash:
+        # Selections containing the old text are rebuilt on next use
+        get_vector_registry().invalidate(lambda key: doc_id in key[1])
+    return {"doc_id": doc_id, "job_id": job_id}
+
+
+@app.post("/documents", status_code=202)
+async def add_document(
+    file: Optional[UploadFile] = File(None),
+    text: Optional[str] = Form(None),
+    name: Optional[str] = Form(None),
+    doc_id: Optional[str] = Form(None),
+    library: str = Form(DEFAULT_LIBRARY),
+    ocr_backend: str = Form("gemini"),
+):
+    """Indexes an upload or pasted text. Passing the `doc_id` of earlier pasted text re-indexes it in place.
+
+    Scanned pages of an uploaded PDF are OCRed with `ocr_backend`.
+    """
+    check_ocr_backend(ocr_backend)
+    if file is not None:
+        upload = (await file.read(), file.content_type, file.filename)
+    elif text and text.strip():
+        upload = None
+    else:
+        raise HTTPException(422, "Send a file or non-empty text.")
+    # Hashing, the library's SQLite catalog and the first model build are blocking: run them in a worker
+    return await run_with_timeout(submit_document, upload, text, name, doc_id, library, ocr_backend)
+
+
+@app.delete("/documents/{doc_id}")
+def remove_document(doc_id: str, library: str = DEFAULT_LIBRARY):
+    study_tools.forget_document(get_document_library(), library, doc_id)
+    return {"removed": doc_id}
+
+
+# =============================================
+# Chat
+# =============================================
+
+class ChatMessage(BaseModel):
+    role: str
+    content: str
+
+
+class ChatRequest(BaseModel):
+    question: str
+    documents: List[str]
+    library: str = DEFAULT_LIBRARY
+    history: List[ChatMessage] = []  # The API is stateless: clients send the conversation so far
+    stream: bool = False
+
+
+def serialize_sources(docs):
+    return [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in docs]
+
+
+def prepare_chat(body):
+    """Returns (document hash, cached entry or None, similarity, LLM, prompt, retrieved docs, history stats)."""
+    models = get_models()
+    with opened_selection(body.library, body.documents) as handle:
+        document_hash = handle.corpus.content_hash
+        if not body.history:
+            entry, similarity = study_tools.lookup_first_answer(document_hash, body.question, models["embeddings_studybuddy"])
+            if entry is not None:
+                return document_hash, entry, similarity, None, None, None, None
+        history_text, history_stats = ChatMemory().prompt_history([message.model_dump() for message in body.history])
+        retrieved_docs, _ = study_tools.retrieve_for_question(handle, body.question)
+    prompt = study_tools.build_chat_prompt(body.question, retrieved_docs, history_text)
+    telemetry.record("chat.prompt_tokens", estimate_tokens(prompt))
+    return document_hash, None, None, models["llm_qna"], prompt, retrieved_docs, history_stats
+
+
+def finish_chat(body, document_hash, answer, retrieved_docs):
+    if not body.history:
+        study_tools.remember_first_answer(document_hash, body.question, answer, retrieved_docs, get_models()["embeddings_studybuddy"])
+    return {"sources": serialize_sources(retrieved_docs)}
+
+
+@app.post("/chat")
+async def chat(body: ChatRequest, request: Request):
+    """Answers a question about the selected documents, optionally streamed as NDJSON."""
+    slot = ClientSlot(client_id(request))
+    try:
+        document_hash, entry, similarity, llm, prompt, retrieved_docs, history_stats = await run_with_timeout(prepare_chat, body, slot=slot)
+        if entry is not None:
+            return {"answer": entry["answer"], "sources": entry["sources"], "cached_from": {"question": entry["question"], "similarity": similarity}}
+        if body.stream:
+            completion = CompletionStream(llm, prompt, "chat", on_error=lambda e: f"Sorry, an error occurred: {e}")
+            return ndjson_stream(completion, slot, on_finish=lambda text: finish_chat(body, document_hash, text, retrieved_docs))
+        answer = await run_with_timeout(invoke_completion, llm, prompt, "chat", slot=slot)
+        result = await run_with_timeout(finish_chat, body, document_hash, answer, retrieved_docs, slot=slot)
+        return dict(result, answer=answer, history=history_stats)
+    finally:
+        slot.release()
+
+
+# =============================================
+# Tools
+# =============================================
+
+class ToolRequest(BaseModel):
+    documents: List[str]
+    library: str = DEFAULT_LIBRARY
+    regenerate: bool = False  # Ignore the cached result
+    stream: bool = False
+    subject: str = "General"  # practice_questions
+    style_guide: str = ""  # practice_questions: example "question>>answer" lines
+    style: str = "Normal"  # explanation: "Normal" or "Brainrot"
+    length: str = "Medium"  # summary: "Short", "Medium" or "Detailed"
+    whole_document: bool = False  # flashcards, practice_questions: one prompt per section, merged (runs as a job)
+
+
+def tool_llm_and_options(tool, body):
+    """The LLM a tool runs on and the options that key its cached output (same as the app's)."""
+    models = get_models()
+    if body.whole_document and tool not in study_tools.SECTIONED_ITEM_TOOLS:
+        raise HTTPException(422, f"whole_document is only supported by {', '.join(study_tools.SECTIONED_ITEM_TOOLS)}")
+    if tool == "practice_questions":
+        return models["llm_studybuddy"], {
+            "subject": body.subject, "style_guide_hash": hashlib.md5(body.style_guide.encode("utf-8")).hexdigest(),
+            **study_tools.item_coverage_options(body.whole_document)
+        }
+    if tool == "flashcards":
+        return models["llm_studybuddy"], study_tools.item_coverage_options(body.whole_document)
+    if tool == "explanation":
+        return models["llm_studybuddy2"], {"style": body.style}
+    if tool == "summary":
+        if body.length not in study_tools.SUMMARY_LENGTH_INSTRUCTIONS:
+            raise HTTPException(422, f"length must be one of {', '.join(study_tools.SUMMARY_LENGTH_INSTRUCTIONS)}")
+        return models["llm_studybuddy"], {"length": body.length}
+    return models["llm_studybuddy"], {}
+
+
+def tool_completion(tool, body, llm, document_text, stream):
+    if tool == "practice_questions":
+        return study_tools.generate_practice_questions_with_guidance(body.subject, document_text, body.style_guide, llm, stream=stream)
+    if tool == "explanation":
+        return study_tools.generate_custom_explanation(document_text, body.style, llm, stream=stream)
+    if tool == "flashcards":
+        return study_tools.generate_flashcards(document_text, llm, stream=stream)
+    prompt = study_tools.summary_prompt(document_text, body.length)
+    if stream:
+        return CompletionStream(llm, prompt, "summary", on_error=lambda e: f"Error generating summary: {e}")
+    return invoke_completion(llm, prompt, "summary")
+
+
+def prepare_tool(tool, body):
+    """The blocking part of a tool request before any model call: selection, cache lookup and context packing.
+
+    Returns (corpus, LLM, options, cache key, cached text or None, whether it needs a map-reduce
+    summary, packed document text); the text is only packed when the tool runs as one prompt.
+    """
+    corpus = selection_corpus(body.library, body.documents)
+    llm, options = tool_llm_and_options(tool, body)
+    cache_key = study_tools.tool_cache_key(corpus.content_hash, tool, llm, token_budget=tool_budget(tool), **options)
+    cached = study_tools.cached_tool_output(cache_key, body.regenerate)
+    long_summary = not cached and tool == "summary" and study_tools.needs_map_reduce_summary(corpus)
+    document_text = None
+    if not cached and not long_summary and not body.whole_document:
+        document_text = study_tools.packed_tool_context(corpus, tool).text
+    return corpus, llm, options, cache_key, cached, long_summary, document_text
+
+
+def run_mindmap(body):
+    corpus = selection_corpus(body.library, body.documents)
+    mindmap = study_tools.generate_mindmap(study_tools.packed_tool_context(corpus, "mindmap").text, get_models()["llm_studybuddy"])
+    if mindmap.get("error"):
+        raise HTTPException(502, mindmap["error"])
+    names = [mindmap["central_topic"]] + mindmap["topics"]
+    return {
+        "central_topic": mindmap["central_topic"],
+        "keywords": mindmap["topics"],
+        "edges": [{"from": names[source], "to": names[target], "label": label} for source, target, label in mindmap["edges"]],
+        "canvas": mindmap["canvas"],
+    }
+
+
+def run_long_summary_job(job, llm, corpus, length, cache_key):
+    """Background job: map-reduce over the sections, then the final summary prompt."""
+    sections = study_tools.summarize_sections(llm, corpus, progress=job.report)
+    job.report(message="Writing the summary...")
+    text = invoke_completion(llm, study_tools.summary_prompt(sections["context"], length, study_tools.SECTION_SUMMARIES_NOTE), "summary")
+    study_tools.remember_tool_output(cache_key, text, llm)
+    return {"text": text, "section_count": sections["section_count"]}
+
+
+def run_sectioned_items_job(job, llm, corpus, tool, options, cache_key):
+    """Background job: flashcards or practice questions from every section, merged without near-duplicates."""
+    result = study_tools.generate_items_by_section(llm, corpus, tool, progress=job.report, **options)
+    study_tools.remember_tool_output(cache_key, result["text"], llm)
+    return result
+
+
+@app.post("/tools/{tool}")
+async def run_tool(tool: str, body: ToolRequest, request: Request):
+    """Runs a study tool on the selected documents. Results are cached per content, tool and options."""
+    if tool not in TOOLS:
+        raise HTTPException(404, f"Unknown tool '{tool}'. Available: {', '.join(TOOLS)}")
+    slot = ClientSlot(client_id(request))
+    try:
+        if tool == "mindmap":
+            return await run_with_timeout(run_mindmap, body, slot=slot)
+
+        corpus, llm, options, cache_key, cached, long_summary, document_text = await run_with_timeout(prepare_tool, tool, body, slot=slot)
+        if cached:
+            return {"text": cached, "cached": True}
+        if long_summary:
+            # Too long for one prompt: sections are summarized in parallel in a background job
+            job_id = get_job_runner().submit(
+                "summary", ("api_summary", corpus.content_hash, llm_identity(llm), body.length, study_tools.regeneration_nonce(body.regenerate)),
+                run_long_summary_job, llm, corpus, body.length, cache_key
+            )
+            return JSONResponse({"job_id": job_id}, status_code=202)
+        if body.whole_document:
+            # One prompt per section, run in parallel in a background job
+            options = {"subject_name": body.subject, "example_qa_style_guide": body.style_guide} if tool == "practice_questions" else {}
+            options["regenerate"] = body.regenerate
+            job_id = get_job_runner().submit(
+                tool, ("api_item_sections", cache_key, study_tools.regeneration_nonce(body.regenerate)),
+                run_sectioned_items_job, llm, corpus, tool, options, cache_key
+            )
+            return JSONResponse({"job_id": job_id}, status_code=202)
+
+        if body.stream:
+            completion = tool_completion(tool, body, llm, document_text, stream=True)
+            return ndjson_stream(
+                completion, slot,
+                on_finish=lambda text: study_tools.remember_tool_output(cache_key, text, llm) or {"cached": False}
+            )
+        text = await run_with_timeout(tool_completion, tool, body, llm, document_text, False, slot=slot)
+        if is_error_output(text):
+            raise HTTPException(502, text)
+        await run_with_timeout(study_tools.remember_tool_output, cache_key, text, llm, slot=slot)
+        return {"text": text, "cached": False}
+    finally:
+        slot.release()
@@ -0,0 +1,188 @@
+"""Deterministic local stand-ins for the Gemini clients, with configurable latency.
+
+They expose the parts of the LangChain and google.generativeai interfaces the app uses,
+so benchmarks exercise the real code paths without network calls or API quota. Outputs
+depend only on the input, so two runs do the same work.
+"""
+import hashlib
+import math
+import random
+import re
+import threading
+import time
+
+from ocr import PAGE_BREAK
+
+WORDS = (
+    "cell energy membrane protein reaction equation force motion charge field history treaty empire trade "
+    "climate river mountain population culture economy theory evidence model system structure function "
+    "process cycle growth balance pressure volume density velocity acid base salt element compound"
+).split()
+
+
+def _rng(text):
+    return random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+
+
+def fake_text(seed, words):
+    """`words` pseudo-random words, always the same for the same seed."""
+    rng = _rng(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+class CallCounter:
+    def __init__(self):
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def increment(self):
+        with self._lock:
+            self.calls += 1
+
+
+class FakeLLM:
+    """Stands in for LangChain's GoogleGenerativeAI: `invoke` and `stream` return text derived from the prompt.
+
+    `latency_s` is the time to the first token; the rest of the answer arrives at
+    `tokens_per_s` (word-sized tokens).
+    """
+
+    def __init__(self, model="fake-llm", temperature=0.7, latency_s=0.5, tokens_per_s=200.0, answer_words=150):
+        self.model = model
+        self.temperature = temperature
+        self.latency_s = latency_s
+        self.tokens_per_s = tokens_per_s
+        self.answer_words = answer_words
+        self.counter = CallCounter()
+
+    def _answer(self, prompt):
+        return fake_text(prompt, self.answer_words)
+
+    def invoke(self, prompt, **kwargs):
+        self.counter.increment()
+        answer = self._answer(prompt)
+        time.sleep(self.latency_s + (self.answer_words / self.tokens_per_s if self.tokens_per_s else 0))
+        return answer
+
+    def stream(self, prompt):
+        self.counter.increment()
+        time.sleep(self.latency_s)
+        delay = 1 / self.tokens_per_s if self.tokens_per_s else 0
+        for word in self._answer(prompt).split(" "):
+            if delay:
+                time.sleep(delay)
+            yield word + " "
+
+
+class FakeItemLLM(FakeLLM):
+    """FakeLLM answering with 'Term>>Definition' lines, as the flashcard and practice question prompts ask.
+
+    Terms are two words from WORDS, so the sections of one document repeat some of them
+    like a real book does, and the merged list has near-duplicates to remove.
+    """
+
+    def _answer(self, prompt):
+        rng = _rng(prompt)
+        lines = []
+        for number in range(max(1, self.answer_words // 10)):
+            term = f"{rng.choice(WORDS).title()} {rng.choice(WORDS)}"
+            lines.append(f"{term}>>{fake_text(f'{prompt}|{number}', 8)}")
+        return "\n".join(lines)
+
+
+class FakeEmbeddings:
+    """Stands in for GoogleGenerativeAIEmbeddings with hashed bag-of-words vectors.
+
+    Texts sharing words get similar vectors, so retrieval results are meaningful. Each
+    call costs `latency_s` plus `per_text_s` per text, like one batchEmbedContents request.
+    """
+
+    def __init__(self, dimensions=768, latency_s=0.2, per_text_s=0.001):
+        self.dimensions = dimensions
+        self.latency_s = latency_s
+        self.per_text_s = per_text_s
+        self.counter = CallCounter()
+
+    def _vector(self, text):
+        vector = [0.0] * self.dimensions
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.md5(word.encode("utf-8")).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dimensions] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts):
+        self.counter.increment()
+        time.sleep(self.latency_s + self.per_text_s * len(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        self.counter.increment()
+        time.sleep(self.latency_s)
+        return self._vector(text)
+
+
+class _UploadedFile:
+    def __init__(self, name):
+        self.name = name
+
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+
+
+class _FakeGenerativeModel:
+    def __init__(self, client, model_name):
+        self.client = client
+        self.model_name = model_name
+
+    def generate_content(self, prompt, request_options=None):
+        """Returns one fake page of text per page the OCR instructions announce."""
+        self.client.counter.increment()
+        instructions = " ".join(part for part in prompt if isinstance(part, str))
+        match = re.search(r"contains (\d+) page", instructions)
+        page_count = int(match.group(1)) if match else 1
+        time.sleep(self.client.latency_s + self.client.per_page_s * page_count)
+        pages = [fake_text(f"{instructions}|{page}", self.client.words_per_page) for page in range(page_count)]
+        return _Response(f"\n{PAGE_BREAK}\n".join(pages))
+
+
+class FakeGenAI:
+    """Stands in for the `google.generativeai` module as used for OCR (upload, generate, delete)."""
+
+    def __init__(self, latency_s=1.0, per_page_s=0.3, words_per_page=300):
+        self.latency_s = latency_s
+        self.per_page_s = per_page_s
+        self.words_per_page = words_per_page
+        self.counter = CallCounter()
+        self.live_files = set()  # Uploaded and not deleted yet: empty after every OCR call
+        self._uploads = 0
+        self._lock = threading.Lock()
+
+    def configure(self, api_key=None):
+        pass
+
+    def upload_file(self, path=None, display_name=None, mime_type=None):
+        with self._lock:
+            self._uploads += 1
+            name = f"files/fake-{self._uploads}"
+            self.live_files.add(name)
+            return _UploadedFile(name)
+
+    def GenerativeModel(self, model_name=None):
+        return _FakeGenerativeModel(self, model_name)
+
+    def delete_file(self, name):
+        with self._lock:
+            self.live_files.discard(name)
+
+
+def fake_study_models(llm_latency_s=0.5, tokens_per_s=200.0, embedding_latency_s=0.2):
+    """Drop-in result for study_tools.create_study_models."""
+    return {
+        "llm_studybuddy": FakeLLM(temperature=0.7, latency_s=llm_latency_s, tokens_per_s=tokens_per_s),
+        "llm_studybuddy2": FakeLLM(temperature=1, latency_s=llm_latency_s, tokens_per_s=tokens_per_s),
+        "llm_qna": FakeLLM(temperature=0.7, latency_s=llm_latency_s, tokens_per_s=tokens_per_s),
+        "embeddings_studybuddy": FakeEmbeddings(latency_s=embedding_latency_s),
+    }
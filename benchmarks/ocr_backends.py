@@ -0,0 +1,222 @@
+"""Compares OCR backends on speed (pages/s) and accuracy (character and word error rates).
+
+    python -m benchmarks.ocr_backends                         # generated scans, every available backend
+    python -m benchmarks.ocr_backends --backends easyocr --quick
+    python -m benchmarks.ocr_backends --fixtures path/to/scans
+
+The default fixture set is generated: pages of known text are rendered with PyMuPDF and
+rasterized into image-only PDFs, so the ground truth is exact. A fixture directory holds
+`name.pdf` files, each with a `name.txt` ground truth whose pages are separated by form
+feeds. The Gemini backend makes real API calls (GOOGLE_API_KEY_GEMINI must be set);
+`--fake-gemini` measures only the pipeline overhead, and reports no accuracy. Results
+go to benchmarks/results/ocr-<timestamp>.json. The OCR cache is not used.
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import sys
+import time
+
+from benchmarks.run import REPO_ROOT, RESULTS_DIR, git_revision, percentiles
+
+
+# =============================================
+# Fixtures
+# =============================================
+
+def generated_fixtures(documents, pages_per_document, words_per_page=150, dpi=150):
+    """[(name, pdf_bytes, page_truths)] of image-only PDFs rendered from known text."""
+    import fitz  # PyMuPDF
+    from benchmarks.fakes import fake_text
+
+    fixtures = []
+    for index in range(documents):
+        source, scanned, truths = fitz.open(), fitz.open(), []
+        for page_number in range(pages_per_document):
+            text = fake_text(f"ocr-fixture|{index}|{page_number}", words_per_page)
+            page = source.new_page(width=612, height=792)
+            page.insert_textbox(fitz.Rect(72, 72, 540, 720), text, fontsize=11, fontname="helv")
+            truths.append(text)
+        for page in source:
+            # The scan keeps only the pixels: no text layer for a backend to cheat with
+            scanned_page = scanned.new_page(width=page.rect.width, height=page.rect.height)
+            scanned_page.insert_image(scanned_page.rect, pixmap=page.get_pixmap(dpi=dpi))
+        fixtures.append((f"generated-{index}", scanned.tobytes(), truths))
+    return fixtures
+
+
+def directory_fixtures(directory):
+    fixtures = []
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.lower().endswith(".pdf"):
+            continue
+        truth_path = os.path.join(directory, os.path.splitext(file_name)[0] + ".txt")
+        if not os.path.exists(truth_path):
+            print(f"  skipping {file_name}: no ground truth {os.path.basename(truth_path)}")
+            continue
+        with open(os.path.join(directory, file_name), "rb") as pdf_file, open(truth_path, encoding="utf-8") as truth_file:
+            fixtures.append((file_name, pdf_file.read(), truth_file.read().split("\f")))
+    return fixtures
+
+
+# =============================================
+# Accuracy
+# =============================================
+
+def normalize(text):
+    """Lowercase words only: markdown from Gemini and line breaks from either engine don't count as errors."""
+    return re.sub(r"\s+", " ", re.sub(r"[*#_`>|\-]+", " ", text.lower())).strip()
+
+
+def edit_distance(expected, actual):
+    """Levenshtein distance between two sequences (characters or words), one row at a time."""
+    if len(expected) < len(actual):
+        expected, actual = actual, expected
+    previous = list(range(len(actual) + 1))
+    for row, expected_item in enumerate(expected, start=1):
+        current = [row]
+        for column, actual_item in enumerate(actual, start=1):
+            current.append(min(previous[column] + 1, current[column - 1] + 1, previous[column - 1] + (expected_item != actual_item)))
+        previous = current
+    return previous[-1]
+
+
+def page_errors(truths, page_texts):
+    """Character and word edits against the ground truth, page by page (merged ranges compared as one)."""
+    totals = {"char_edits": 0, "chars": 0, "word_edits": 0, "words": 0}
+    for page_key, text in page_texts.items():
+        if isinstance(page_key, str):
+            first, last = (int(number) for number in page_key.split("-"))
+        else:
+            first = last = page_key
+        expected = normalize(" ".join(truths[first - 1:last]))
+        actual = normalize(text)
+        totals["char_edits"] += edit_distance(expected, actual)
+        totals["chars"] += len(expected)
+        totals["word_edits"] += edit_distance(expected.split(), actual.split())
+        totals["words"] += len(expected.split())
+    return totals
+
+
+# =============================================
+# Backends
+# =============================================
+
+def make_backend(name, fake_gemini):
+    from ocr import get_ocr_backend
+
+    if name == "gemini":
+        if fake_gemini:
+            from benchmarks.fakes import FakeGenAI
+            return get_ocr_backend(name, FakeGenAI())
+        api_key = os.getenv("GOOGLE_API_KEY_GEMINI")
+        if not api_key:
+            raise RuntimeError("set GOOGLE_API_KEY_GEMINI, or pass --fake-gemini")
+        from study_tools import create_genai
+        return get_ocr_backend(name, create_genai(api_key))
+    return get_ocr_backend(name)
+
+
+def warm_up(backend, fixtures):
+    """Time until the backend can OCR at all (EasyOCR loads its models in every worker)."""
+    from concurrent.futures import ThreadPoolExecutor
+    from ocr import GeminiOcrBackend, split_pdf_ranges
+
+    first_page = split_pdf_ranges(fixtures[0][1], pages_per_range=1, page_numbers=[1])[0]
+    # Concurrent calls make a process pool start every worker; a cloud API has nothing to load
+    calls = 1 if isinstance(backend, GeminiOcrBackend) else backend.max_workers
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=calls) as executor:
+        list(executor.map(lambda _: backend.ocr_range(first_page, "warm-up"), range(calls)))
+    return time.perf_counter() - started
+
+
+def bench_backend(backend, fixtures, measure_accuracy):
+    from ocr import perform_parallel_ocr
+
+    result = {"startup_s": warm_up(backend, fixtures), "documents": {}}
+    page_seconds, totals = [], {"char_edits": 0, "chars": 0, "word_edits": 0, "words": 0}
+    total_pages, total_seconds = 0, 0.0
+    for name, pdf_bytes, truths in fixtures:
+        started = time.perf_counter()
+        ocr_result = perform_parallel_ocr(pdf_bytes, name, client=backend, use_cache=False)
+        elapsed = time.perf_counter() - started
+        row = {"pages": len(truths), "seconds": elapsed, "pages_per_s": len(truths) / elapsed, "failed_ranges": len(ocr_result.failed_ranges)}
+        if measure_accuracy:
+            errors = page_errors(truths, ocr_result.page_texts)
+            row["cer"] = errors["char_edits"] / max(1, errors["chars"])
+            row["wer"] = errors["word_edits"] / max(1, errors["words"])
+            for key in totals:
+                totals[key] += errors[key]
+        result["documents"][name] = row
+        page_seconds.append(elapsed / len(truths))
+        total_pages += len(truths)
+        total_seconds += elapsed
+    result["pages_per_s"] = total_pages / total_seconds
+    result["seconds_per_page"] = percentiles(page_seconds)
+    if measure_accuracy:
+        result["cer"] = totals["char_edits"] / max(1, totals["chars"])
+        result["wer"] = totals["word_edits"] / max(1, totals["words"])
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", nargs="+", help="Backends to compare (default: every available one)")
+    parser.add_argument("--fixtures", help="Directory of name.pdf + name.txt pairs (default: generated scans)")
+    parser.add_argument("--quick", action="store_true", help="One small generated document")
+    parser.add_argument("--fake-gemini", action="store_true", help="Use the fake Gemini client: speed of the pipeline only")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/ocr-<timestamp>.json)")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, REPO_ROOT)
+    from ocr import ocr_backend_names
+
+    backends = args.backends or ocr_backend_names()
+    print("Preparing fixtures...", flush=True)
+    try:
+        fixtures = directory_fixtures(args.fixtures) if args.fixtures else generated_fixtures(1 if args.quick else 3, 3 if args.quick else 8)
+    except ImportError as e:
+        print(f"Generating fixtures needs PyMuPDF ({e}); pass --fixtures instead.")
+        return 1
+    if not fixtures:
+        print("No fixtures found.")
+        return 1
+
+    run = {
+        "meta": {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S"), "revision": git_revision(),
+            "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "fixtures": {name: len(truths) for name, _, truths in fixtures},
+        },
+        "results": {},
+        "errors": {},
+    }
+    for name in backends:
+        print(f"Running {name}...", flush=True)
+        try:
+            backend = make_backend(name, args.fake_gemini)
+            run["results"][name] = bench_backend(backend, fixtures, measure_accuracy=not (name == "gemini" and args.fake_gemini))
+        except ImportError as e:
+            run["errors"][name] = f"skipped, missing dependency: {e}"
+        except Exception as e:
+            run["errors"][name] = f"{e.__class__.__name__}: {e}"
+        if name in run["errors"]:
+            print(f"  {run['errors'][name]}")
+        else:
+            row = run["results"][name]
+            accuracy = f", CER {row['cer']:.1%}, WER {row['wer']:.1%}" if "cer" in row else ""
+            print(f"  {row['pages_per_s']:.2f} pages/s (startup {row['startup_s']:.1f}s){accuracy}", flush=True)
+
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime("ocr-%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as results_file:
+        json.dump(run, results_file, indent=2)
+    print(f"Results written to {output}")
+    return 1 if run["errors"] and not run["results"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,427 @@
+"""Offline benchmarks for Study AI.
+
+    python -m benchmarks.run                      # all scenarios, results in benchmarks/results/
+    python -m benchmarks.run --quick --scenarios ingestion retrieval
+    python -m benchmarks.run --compare benchmarks/results/<earlier>.json
+
+The Gemini LLM, embedding and OCR clients are replaced by the deterministic fakes in
+benchmarks/fakes.py; everything else (splitting, the embedding cache, Chroma, BM25,
+chat memory, the Streamlit script) is the real code. Caches and the library live in a
+fresh temporary STUDY_AI_CACHE_DIR, so every run starts cold.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+BENCH_LIBRARY = "benchmark"
+
+SCENARIOS = ("ingestion", "retrieval", "chat", "ocr", "items", "rerun", "session_memory")
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda pct: ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+    return {"count": len(ordered), "mean": statistics.fmean(ordered), "p50": pick(50), "p95": pick(95), "max": ordered[-1]}
+
+
+def synthetic_pages(doc_seed, page_count, words_per_page=400):
+    """Pages of a fake textbook as LangChain Documents (same text for the same seed)."""
+    from langchain_core.documents import Document
+    from benchmarks.fakes import fake_text
+
+    return [
+        Document(page_content=fake_text(f"{doc_seed}|{page}", words_per_page), metadata={"source": doc_seed, "page": page})
+        for page in range(page_count)
+    ]
+
+
+def split_pages(pages):
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    from study_tools import STUDY_CHUNK_OVERLAP, STUDY_CHUNK_SIZE
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=STUDY_CHUNK_SIZE, chunk_overlap=STUDY_CHUNK_OVERLAP)
+    return splitter.split_documents(pages)
+
+
+def add_synthetic_document(library, doc_id, page_count, embeddings):
+    from study_tools import EMBEDDING_CACHE_NAMESPACE
+
+    pages = synthetic_pages(doc_id.split(":")[0], page_count)
+    chunks = split_pages(pages)
+    stats = library.add_document(BENCH_LIBRARY, doc_id, f"{page_count}-page document", pages, chunks, embeddings, EMBEDDING_CACHE_NAMESPACE)
+    return pages, chunks, stats
+
+
+# =============================================
+# Scenarios
+# =============================================
+
+def bench_ingestion(config):
+    """Split + embed + write throughput, with a cold embedding cache and again with the same text cached."""
+    from benchmarks.fakes import FakeEmbeddings
+    from document_library import get_document_library
+
+    library = get_document_library()
+    results = {}
+    for page_count in config["sizes"]:
+        row = {}
+        for label, doc_id in (("cold", f"ingest-{page_count}"), ("warm_cache", f"ingest-{page_count}:copy")):
+            embeddings = FakeEmbeddings(latency_s=config["embedding_latency_s"])
+            started = time.perf_counter()
+            pages, chunks, stats = add_synthetic_document(library, doc_id, page_count, embeddings)
+            elapsed = time.perf_counter() - started
+            row[label] = {
+                "seconds": elapsed, "pages": len(pages), "chunks": len(chunks),
+                "pages_per_s": len(pages) / elapsed, "chunks_per_s": len(chunks) / elapsed,
+                "embedding_calls": embeddings.counter.calls, "cache_hits": stats["hits"], "cache_misses": stats["misses"],
+            }
+        results[f"{page_count}_pages"] = row
+    return results
+
+
+QUERIES = (
+    "what is the function of the membrane", "explain energy balance in the cycle", "treaty",
+    "how does pressure change with volume and density", "acid base reaction", "empire trade history",
+    "velocity", "evidence for the theory of climate growth",
+)
+
+
+def open_selection(library, doc_id, embeddings):
+    from study_tools import open_study_selection
+    return open_study_selection(library, BENCH_LIBRARY, [doc_id], embeddings)
+
+
+def bench_retrieval(config):
+    """Hybrid (BM25 + vector) retrieval latency per question at different document sizes.
+
+    The first pass over the questions pays for query embeddings, later passes are served
+    from the embedding cache; each size gets its own query cache namespace.
+    """
+    from benchmarks.fakes import FakeEmbeddings
+    from document_library import get_document_library
+    from embedding_cache import CachedEmbeddings
+    from study_tools import EMBEDDING_CACHE_NAMESPACE, retrieve_for_question
+    from vector_registry import get_vector_registry
+
+    library = get_document_library()
+    results = {}
+    for page_count in config["sizes"]:
+        doc_id = f"retrieval-{page_count}"
+        add_synthetic_document(library, doc_id, page_count, FakeEmbeddings(latency_s=0))
+        query_embeddings = CachedEmbeddings(FakeEmbeddings(latency_s=config["embedding_latency_s"]), f"{EMBEDDING_CACHE_NAMESPACE}|{doc_id}")
+        started = time.perf_counter()
+        handle = get_vector_registry().acquire((BENCH_LIBRARY, doc_id), lambda: library.open_selection(BENCH_LIBRARY, [doc_id], query_embeddings))
+        open_s = time.perf_counter() - started
+        passes, lexical = [], 0
+        try:
+            for _ in range(1 + config["repeats"]):
+                latencies = []
+                for query in QUERIES:
+                    started = time.perf_counter()
+                    _, info = retrieve_for_question(handle, query)
+                    latencies.append(time.perf_counter() - started)
+                    lexical += info["path"] == "lexical"
+                passes.append(latencies)
+            chunk_count = len(handle.corpus.chunk_ids)
+        finally:
+            handle.release()
+        results[f"{page_count}_pages"] = {
+            "chunks": chunk_count, "open_s": open_s,
+            "uncached_query_latency_s": percentiles(passes[0]),
+            "cached_query_latency_s": percentiles([latency for latencies in passes[1:] for latency in latencies]),
+            "lexical_only_fraction": lexical / sum(len(latencies) for latencies in passes),
+        }
+    return results
+
+
+def bench_chat(config):
+    """Chat turn latency and prompt size as the history grows (compaction settled before each turn)."""
+    from benchmarks.fakes import FakeEmbeddings, FakeLLM, fake_text
+    from chat_memory import ChatMemory
+    from corpus import estimate_tokens
+    from document_library import get_document_library
+    from llm_streaming import invoke_completion
+    from study_tools import build_chat_prompt, retrieve_for_question
+
+    library = get_document_library()
+    page_count = config["sizes"][len(config["sizes"]) // 2]
+    doc_id = f"chat-{page_count}"
+    add_synthetic_document(library, doc_id, page_count, FakeEmbeddings(latency_s=0))
+    llm = FakeLLM(latency_s=config["llm_latency_s"], tokens_per_s=config["tokens_per_s"])
+    summarizer_llm = FakeLLM(latency_s=0, tokens_per_s=0, answer_words=400)
+    handle = open_selection(library, doc_id, FakeEmbeddings(latency_s=config["embedding_latency_s"]))
+    results = {}
+    try:
+        for turns in config["history_turns"]:
+            history = []
+            for turn in range(turns):
+                history.append({"role": "user", "content": QUERIES[turn % len(QUERIES)]})
+                history.append({"role": "ai", "content": fake_text(f"answer|{turn}", 150)})
+            memory = ChatMemory()
+            memory.schedule_compaction(history, summarizer_llm)
+            if memory._pending is not None:
+                memory._pending.result()
+            question = QUERIES[turns % len(QUERIES)]
+            history.append({"role": "user", "content": question})
+
+            started = time.perf_counter()
+            history_text, history_stats = memory.prompt_history(history[:-1])
+            retrieved_docs, _ = retrieve_for_question(handle, question)
+            prompt = build_chat_prompt(question, retrieved_docs, history_text)
+            prepared = time.perf_counter()
+            invoke_completion(llm, prompt, "chat")
+            finished = time.perf_counter()
+            results[f"{turns}_turns"] = {
+                "turn_s": finished - started, "overhead_s": prepared - started,
+                "prompt_tokens": estimate_tokens(prompt), "history_tokens": history_stats["history_tokens"],
+                "verbatim_messages": history_stats["verbatim_messages"],
+            }
+    finally:
+        handle.release()
+    return results
+
+
+def blank_pdf(page_count):
+    import io
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for _ in range(page_count):
+        writer.add_blank_page(width=612, height=792)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def bench_ocr(config):
+    """Parallel page-range OCR throughput against the fake OCR model (page cache disabled)."""
+    from benchmarks.fakes import FakeGenAI
+    from ocr import perform_parallel_ocr
+
+    results = {}
+    for page_count in config["sizes"]:
+        client = FakeGenAI(latency_s=config["ocr_latency_s"], per_page_s=config["ocr_per_page_s"])
+        pdf_bytes = blank_pdf(page_count)
+        started = time.perf_counter()
+        result = perform_parallel_ocr(pdf_bytes, "benchmark.pdf", client=client, use_cache=False)
+        elapsed = time.perf_counter() - started
+        results[f"{page_count}_pages"] = {
+            "seconds": elapsed, "pages_per_s": page_count / elapsed,
+            "requests": client.counter.calls, "failed_ranges": len(result.failed_ranges),
+        }
+    return results
+
+
+def bench_items(config):
+    """Whole-document flashcards: wall-clock time per worker count, items kept and near-duplicates removed."""
+    from benchmarks.fakes import FakeItemLLM
+    from corpus import DocumentCorpus
+    from item_generation import SectionedItemGenerator
+    from study_tools import FLASHCARDS_PROMPT_TEMPLATE
+
+    pages = synthetic_pages("items", config["sizes"][-1])
+    corpus = DocumentCorpus(pages, split_pages(pages), "benchmark-items", "items.pdf")
+    results = {}
+    for workers in config["item_workers"]:
+        # A model name per run, so section outputs cached by the previous run are not reused
+        llm = FakeItemLLM(model=f"fake-items-{workers}", latency_s=config["llm_latency_s"], tokens_per_s=config["tokens_per_s"])
+        generator = SectionedItemGenerator(llm, max_workers=workers, section_tokens=config["item_section_tokens"])
+        started = time.perf_counter()
+        result = generator.generate(corpus, lambda text: FLASHCARDS_PROMPT_TEMPLATE.format(document_text=text), "flashcards")
+        results[f"{workers}_workers"] = {
+            "seconds": time.perf_counter() - started, "sections": result["section_count"], "requests": llm.counter.calls,
+            "items": len(result["items"]), "duplicates_removed": result["duplicates_removed"],
+        }
+    return results
+
+
+def patch_study_models(config):
+    """Makes the Streamlit app build fake clients instead of Gemini ones."""
+    import study_tools
+    from benchmarks.fakes import FakeGenAI, fake_study_models
+
+    study_tools.create_study_models = lambda api_key: fake_study_models(
+        config["llm_latency_s"], config["tokens_per_s"], config["embedding_latency_s"]
+    )
+    study_tools.create_genai = lambda api_key: FakeGenAI(config["ocr_latency_s"], config["ocr_per_page_s"])
+
+
+def app_test():
+    from streamlit.testing.v1 import AppTest
+    return AppTest.from_file(os.path.join(REPO_ROOT, "streamlit_app.py"), default_timeout=120)
+
+
+def bench_rerun(config):
+    """Script run time of the Streamlit app: first run, then reruns with nothing open and with a document open."""
+    from benchmarks.fakes import FakeEmbeddings
+    from document_library import get_document_library
+
+    patch_study_models(config)
+    doc_id = f"rerun-{config['sizes'][0]}"
+    add_synthetic_document(get_document_library(), doc_id, config["sizes"][0], FakeEmbeddings(latency_s=0))
+    results = {}
+    for label, selection in (("empty", []), ("document_open", [doc_id])):
+        at = app_test()
+        at.session_state["library_selection"] = selection
+        started = time.perf_counter()
+        at.run()
+        first_s = time.perf_counter() - started
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+        reruns = []
+        for _ in range(config["repeats"] * 5):
+            started = time.perf_counter()
+            at.run()
+            reruns.append(time.perf_counter() - started)
+        results[label] = {"first_run_s": first_s, "rerun_s": percentiles(reruns)}
+    return results
+
+
+def bench_session_memory(config):
+    """Python heap held per session: a document open and a few chat turns, averaged over several sessions."""
+    from benchmarks.fakes import FakeEmbeddings
+    from document_library import get_document_library
+
+    patch_study_models(config)
+    doc_id = f"memory-{config['sizes'][0]}"
+    add_synthetic_document(get_document_library(), doc_id, config["sizes"][0], FakeEmbeddings(latency_s=0))
+    warmup = app_test()  # Process-wide resources (models, the shared index) are not per session
+    warmup.session_state["library_selection"] = [doc_id]
+    warmup.run()
+
+    sessions = []
+    gc.collect()
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    for _ in range(config["sessions"]):
+        at = app_test()
+        at.session_state["library_selection"] = [doc_id]
+        at.run()
+        for question in QUERIES[:config["chat_turns"]]:
+            at.chat_input[0].set_value(question).run()
+        sessions.append(at)
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "sessions": len(sessions), "chat_turns": config["chat_turns"],
+        "bytes_per_session": (current - baseline) / len(sessions), "peak_bytes": peak - baseline,
+    }
+
+
+# =============================================
+# Runner
+# =============================================
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def flatten(results, prefix=""):
+    """{"a": {"b": 1}} -> {"a.b": 1}, numeric leaves only."""
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(previous, current):
+    """Prints every metric present in both runs with its relative change."""
+    before, after = flatten(previous["results"]), flatten(current["results"])
+    print(f"\nChange from {previous['meta']['revision']} ({previous['meta']['started']}) to {current['meta']['revision']}:")
+    for key in sorted(before.keys() & after.keys()):
+        change = (after[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+        print(f"  {key:<60} {before[key]:>12.4g} -> {after[key]:>12.4g}  ({change:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--quick", action="store_true", help="Smaller documents and fewer repeats")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Fake LLM time to first token, seconds")
+    parser.add_argument("--embedding-latency", type=float, default=0.2, help="Fake embedding request latency, seconds")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    config = {
+        "sizes": [5, 25] if args.quick else [10, 50, 200],
+        "repeats": 1 if args.quick else 3,
+        "history_turns": [0, 3, 10] if args.quick else [0, 3, 10, 30, 100],
+        "sessions": 2 if args.quick else 5,
+        "chat_turns": 2 if args.quick else 4,
+        "llm_latency_s": args.llm_latency,
+        "tokens_per_s": 200.0,
+        "embedding_latency_s": args.embedding_latency,
+        "ocr_latency_s": 1.0,
+        "ocr_per_page_s": 0.3,
+        "item_workers": [1, 4] if args.quick else [1, 2, 4, 8],
+        "item_section_tokens": 4000,
+    }
+
+    # Everything the app persists goes to a throwaway directory; set before the app modules are imported
+    cache_dir = tempfile.mkdtemp(prefix="study_ai_bench_")
+    os.environ["STUDY_AI_CACHE_DIR"] = cache_dir
+    os.environ["STUDY_AI_LIBRARY"] = BENCH_LIBRARY
+    os.environ.setdefault("GOOGLE_API_KEY_GEMINI", "benchmark-fake-key")
+    sys.path.insert(0, REPO_ROOT)
+    from study_tools import use_pysqlite3_for_chroma
+    use_pysqlite3_for_chroma()
+
+    run = {
+        "meta": {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S"), "revision": git_revision(),
+            "python": platform.python_version(), "platform": platform.platform(), "config": config,
+        },
+        "results": {},
+        "errors": {},
+    }
+    scenarios = {
+        "ingestion": bench_ingestion, "retrieval": bench_retrieval, "chat": bench_chat,
+        "ocr": bench_ocr, "items": bench_items, "rerun": bench_rerun, "session_memory": bench_session_memory,
+    }
+    for name in args.scenarios:
+        print(f"Running {name}...", flush=True)
+        started = time.perf_counter()
+        try:
+            run["results"][name] = scenarios[name](config)
+        except ImportError as e:
+            run["errors"][name] = f"skipped, missing dependency: {e}"
+        except Exception as e:
+            run["errors"][name] = f"{e.__class__.__name__}: {e}"
+        print(f"  {time.perf_counter() - started:.1f}s" + (f" ({run['errors'][name]})" if name in run["errors"] else ""), flush=True)
+
+    import telemetry
+    run["stages"] = telemetry.stage_summary() # Where the time went, across all scenarios
+
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as results_file:
+        json.dump(run, results_file, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as previous_file:
+            compare(json.load(previous_file), run)
+    return 1 if run["errors"] and not run["results"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
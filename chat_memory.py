@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import telemetry
+from corpus import CHARS_PER_TOKEN, estimate_tokens
+
+# --- Chat history configuration ---
+CHAT_RECENT_MESSAGES = int(os.getenv("STUDY_AI_CHAT_RECENT_MESSAGES", "6"))  # Sent verbatim: the last 3 question/answer pairs
+CHAT_HISTORY_TOKENS = int(os.getenv("STUDY_AI_CHAT_HISTORY_TOKENS", "6000"))  # Budget for summary + verbatim turns in one prompt
+CHAT_SUMMARY_TOKENS = CHAT_HISTORY_TOKENS // 3  # Share of the budget the rolling summary may take
+
+UPDATE_SUMMARY_PROMPT = """
+You maintain a running summary of a study conversation between a student and an AI tutor about a document.
+Update the summary with the new messages below. Keep the questions asked, the key facts and explanations given, and anything the student said about their goals or misunderstandings.
+Drop greetings and repetition. Keep the summary under {max_words} words.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}
+
+Updated summary:
+"""
+
+# Compactions run off the script thread so a rerun never waits for them
+_compaction_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chat-compaction")
+
+
+def format_message(item):
+    return f"Previous {item['role']}: {item['content']}"
+
+
+def clip_to_tokens(text, max_tokens):
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    return text if len(text) <= max_chars else text[:max_chars] + " [...]"
+
+
+class ChatMemory:
+    """Keeps the history part of chat prompts bounded.
+
+    The last CHAT_RECENT_MESSAGES messages are sent verbatim; older ones are folded into
+    a rolling summary by a background LLM call after each answer. Each compaction only
+    adds the messages that left the verbatim window since the last one, so the cost per
+    turn stays constant. Until a compaction lands, the not-yet-summarized messages are
+    sent verbatim, and everything is trimmed to CHAT_HISTORY_TOKENS.
+    """
+
+    def __init__(self, recent_messages=CHAT_RECENT_MESSAGES, budget_tokens=CHAT_HISTORY_TOKENS,
+                 summary_tokens=CHAT_SUMMARY_TOKENS):
+        self.recent_messages = recent_messages
+        self.budget_tokens = budget_tokens
+        self.summary_tokens = summary_tokens
+        self.summary = ""
+        self.summarized_count = 0  # Leading chat_history items already folded into the summary
+        self._pending = None
+        self._generation = 0  # Bumped by reset() so a compaction started before it is discarded
+        self._lock = threading.Lock()
+
+    def prompt_history(self, history):
+        """Returns (history text, stats) for a prompt answering the question after `history`."""
+        with self._lock:
+            summary, summarized_count = self.summary, self.summarized_count
+        if summarized_count > len(history):  # The chat was cleared under us
+            summary, summarized_count = "", 0
+
+        summary = clip_to_tokens(summary, self.summary_tokens) if summary else ""
+        remaining = self.budget_tokens - estimate_tokens(summary)
+        verbatim = []
+        for item in reversed(history[summarized_count:]):
+            line = format_message(item)
+            tokens = estimate_tokens(line)
+            if tokens > remaining:
+                if not verbatim and remaining > 0:
+                    verbatim.append(clip_to_tokens(line, remaining))  # Always keep part of the latest message
+                break
+            verbatim.append(line)
+            remaining -= tokens
+        verbatim.reverse()
+
+        parts = []
+        if summary:
+            parts.append(f"Summary of the earlier conversation: {summary}")
+        parts.extend(verbatim)
+        text = "\n".join(parts)
+        stats = {
+            "history_tokens": estimate_tokens(text) if text else 0,
+            "summary_tokens": estimate_tokens(summary) if summary else 0,
+            "verbatim_messages": len(verbatim),
+            "dropped_messages": len(history) - summarized_count - len(verbatim),
+        }
+        return text, stats
+
+    def schedule_compaction(self, history, llm):
+        """Folds messages that left the verbatim window into the summary, in the background."""
+        with self._lock:
+            if self._pending is not None and not self._pending.done():
+                return  # The next turn picks up whatever this one would have added
+            fold_until = len(history) - self.recent_messages
+            if fold_until <= self.summarized_count:
+                return
+            to_fold = list(history[self.summarized_count:fold_until])
+            self._pending = _compaction_executor.submit(self._compact, self.summary, to_fold, fold_until, self._generation, llm)
+
+    def _compact(self, previous_summary, to_fold, fold_until, generation, llm):
+        started = time.perf_counter()
+        prompt = UPDATE_SUMMARY_PROMPT.format(
+            max_words=self.summary_tokens * 3 // 4,
+            summary=previous_summary or "(empty)",
+            messages="\n".join(format_message(item) for item in to_fold),
+        )
+        try:
+            summary = llm.invoke(prompt).strip()
+        except Exception as e:
+            print(f"Chat history compaction failed, keeping messages verbatim: {e}")
+            return
+        with self._lock:
+            if self._generation == generation:
+                self.summary = summary
+                self.summarized_count = fold_until
+        telemetry.record("chat.compaction_s", time.perf_counter() - started, messages=len(to_fold))
+
+    def reset(self):
+        with self._lock:
+            self.summary = ""
+            self.summarized_count = 0
+            self._generation += 1
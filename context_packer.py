@@ -0,0 +1,195 @@
+import os
+
+from corpus import CHARS_PER_TOKEN, estimate_tokens
+
+# --- Per-tool context budgets (in tokens) ---
+# Defaults match the old character limits (~4 chars per token) but are now capped by the model's window.
+MODEL_CONTEXT_TOKENS = int(os.getenv("STUDY_AI_MODEL_CONTEXT_TOKENS", "1000000"))
+TOOL_TOKEN_BUDGETS = {
+    "practice_questions": int(os.getenv("STUDY_AI_BUDGET_PRACTICE_QUESTIONS", "175000")),
+    "explanation": int(os.getenv("STUDY_AI_BUDGET_EXPLANATION", "175000")),
+    "summary": int(os.getenv("STUDY_AI_BUDGET_SUMMARY", "125000")),
+    "mindmap": int(os.getenv("STUDY_AI_BUDGET_MINDMAP", "125000")),
+    "flashcards": int(os.getenv("STUDY_AI_BUDGET_FLASHCARDS", "75000")),
+}
+
+
+# Each kept section may be followed by an "[... omitted ...]" marker; reserve room for it
+MARKER_TOKENS = 16
+# No piece may take more than this fraction of the budget, so even dense pages leave room for spread
+PACK_MIN_SECTIONS = 8
+
+
+def tool_budget(tool):
+    return min(TOOL_TOKEN_BUDGETS[tool], MODEL_CONTEXT_TOKENS)
+
+
+class PackedContext:
+    """The document text chosen for one prompt, plus a record of what made it in."""
+
+    def __init__(self, text, budget_tokens, total_tokens, included, omitted, section_label, partial=()):
+        self.text = text
+        self.budget_tokens = budget_tokens
+        self.total_tokens = total_tokens
+        self.used_tokens = estimate_tokens(text)
+        self.included = included  # Section numbers (1-based) that were sent
+        self.omitted = omitted  # Section numbers left out to stay inside the budget
+        self.partial = list(partial)  # Included sections of which only some pieces were sent
+        self.section_label = section_label  # "page" or "section"
+
+    @property
+    def is_complete(self):
+        return not self.omitted and not self.partial
+
+    def report(self):
+        """One-line description for the UI, e.g. for tuning budgets."""
+        line = (
+            f"Context: ~{self.used_tokens:,} of ~{self.total_tokens:,} document tokens "
+            f"(budget {self.budget_tokens:,}), {len(self.included)} of {len(self.included) + len(self.omitted)} {self.section_label}s"
+        )
+        if self.omitted:
+            line += f"; left out {self.section_label}s {format_ranges(self.omitted)}"
+        if self.partial:
+            line += f"; only part of {self.section_label}s {format_ranges(self.partial)}"
+        return line
+
+
+def format_ranges(numbers):
+    """[1, 2, 3, 7, 9, 10] -> '1-3, 7, 9-10'."""
+    ranges = []
+    for number in sorted(numbers):
+        if ranges and number == ranges[-1][1] + 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ", ".join(str(start) if start == end else f"{start}-{end}" for start, end in ranges)
+
+
+def spread_order(count):
+    """Indices 0..count-1 ordered so any prefix is spread evenly over the whole range.
+
+    First, last, middle, then the quarter points, and so on (breadth-first bisection).
+    """
+    if count <= 0:
+        return []
+    order = [0]
+    seen = {0}
+    if count > 1:
+        order.append(count - 1)
+        seen.add(count - 1)
+    intervals = [(0, count - 1)]
+    while intervals:
+        next_intervals = []
+        for low, high in intervals:
+            if high - low < 2:
+                continue
+            middle = (low + high) // 2
+            if middle not in seen:
+                seen.add(middle)
+                order.append(middle)
+            next_intervals.extend([(low, middle), (middle, high)])
+        intervals = next_intervals
+    return order
+
+
+def split_text(text, max_chars):
+    """Cuts `text` into consecutive, non-overlapping pieces of at most `max_chars` characters.
+
+    Each cut is made at the last paragraph break, line break, sentence end or space in the
+    second half of the piece, if there is one; joining the pieces gives back `text`.
+    """
+    pieces = []
+    start = 0
+    while len(text) - start > max_chars:
+        end = start + max_chars
+        for separator in ("\n\n", "\n", ". ", " "):
+            cut = text.rfind(separator, start + max_chars // 2, end)
+            if cut != -1:
+                end = cut + len(separator)
+                break
+        pieces.append(text[start:end])
+        start = end
+    pieces.append(text[start:])
+    return pieces
+
+
+def _sections(corpus, max_section_tokens):
+    """(unit number, text) pieces of the document in order, and the unit label.
+
+    Units are pages when the document has them, otherwise one section per piece of its text.
+    Pages longer than `max_section_tokens` are split into several pieces, so a dense page
+    can't crowd every other part of the document out of the budget.
+    """
+    max_chars = max(1, max_section_tokens * CHARS_PER_TOKEN)
+    if corpus.page_count > 1:
+        return [(number, piece) for number, doc in enumerate(corpus.documents, start=1)
+                for piece in split_text(doc.page_content, max_chars)], "page"
+    # Not the retrieval chunks: they overlap, so packing them would send some text twice
+    return list(enumerate(split_text(corpus.text, max_chars), start=1)), "section"
+
+
+def _describe(units, label, pieces_per_unit):
+    """'pages 3-5 and part of page 6' for the skipped pieces of `units` ({unit number: pieces skipped})."""
+    whole = [number for number, count in units.items() if count == pieces_per_unit[number]]
+    partial = [number for number, count in units.items() if count < pieces_per_unit[number]]
+    parts = []
+    if whole:
+        parts.append(f"{label}{'s' if len(whole) > 1 else ''} {format_ranges(whole)}")
+    if partial:
+        parts.append(f"part{'s' if len(partial) > 1 else ''} of {label}{'s' if len(partial) > 1 else ''} {format_ranges(partial)}")
+    return " and ".join(parts)
+
+
+def pack_context(corpus, budget_tokens, count_tokens=estimate_tokens):
+    """Fits a DocumentCorpus into `budget_tokens`.
+
+    If the whole document fits it is sent unchanged. Otherwise the document is cut into
+    pieces (whole pages, with pages over 1/PACK_MIN_SECTIONS of the budget split without
+    overlap), which are picked in spread order (start, end, middle, quarters, ...) until the
+    budget is used, then joined in document order with a marker where content was skipped,
+    so the model sees every part of a long book instead of only its first chapters.
+    """
+    total_tokens = count_tokens(corpus.text)
+    sections, label = _sections(corpus, budget_tokens // PACK_MIN_SECTIONS)
+    unit_count = sections[-1][0] if sections else 0
+    if total_tokens <= budget_tokens:
+        return PackedContext(corpus.text, budget_tokens, total_tokens, list(range(1, unit_count + 1)), [], label)
+
+    pieces_per_unit = {}
+    for number, _ in sections:
+        pieces_per_unit[number] = pieces_per_unit.get(number, 0) + 1
+    section_tokens = [count_tokens(text) for _, text in sections]
+    chosen = set()
+    used = 0
+    for index in spread_order(len(sections)):
+        cost = section_tokens[index] + MARKER_TOKENS
+        if used + cost <= budget_tokens:
+            chosen.add(index)
+            used += cost
+
+    if not chosen:
+        # Not even one piece fits (a budget below PACK_MIN_SECTIONS markers): send the start of the first one
+        text = sections[0][1][:budget_tokens * CHARS_PER_TOKEN]
+        return PackedContext(text, budget_tokens, total_tokens, [1], list(range(2, unit_count + 1)), label, partial=[1])
+
+    parts = []
+    skipped = {}
+    for index, (number, text) in enumerate(sections):
+        if index in chosen:
+            if skipped:
+                parts.append(f"[... {_describe(skipped, label, pieces_per_unit)} omitted for length ...]")
+                skipped = {}
+            parts.append(text)
+        else:
+            skipped[number] = skipped.get(number, 0) + 1
+    if skipped:
+        parts.append(f"[... {_describe(skipped, label, pieces_per_unit)} omitted for length ...]")
+
+    sent = {}
+    for index in chosen:
+        number = sections[index][0]
+        sent[number] = sent.get(number, 0) + 1
+    included = sorted(sent)
+    omitted = [number for number in range(1, unit_count + 1) if number not in sent]
+    partial = [number for number in included if sent[number] < pieces_per_unit[number]]
+    return PackedContext("\n".join(parts), budget_tokens, total_tokens, included, omitted, label, partial=partial)
@@ -0,0 +1,50 @@
+import bisect
+import hashlib
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token for English text with Gemini's tokenizer)."""
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def chunk_id(text):
+    """Stable id of a chunk: the first 16 hex chars of the SHA-256 of its text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+class DocumentCorpus:
+    """Everything the Study Tools need about one processed document, computed once at ingestion.
+
+    `text` is the pages joined with newlines (the input every tool prompt is built from);
+    `page_offsets[i]` is where page i starts in `text`. Instances are shared read-only
+    between sessions, so nothing here may be mutated after construction.
+    """
+
+    def __init__(self, documents, chunks, content_hash, source_name):
+        self.documents = documents
+        self.chunks = chunks
+        self.content_hash = content_hash
+        self.source_name = source_name
+
+        self.page_offsets = []
+        offset = 0
+        for doc in documents:
+            self.page_offsets.append(offset)
+            offset += len(doc.page_content) + 1  # +1 for the joining newline
+        self.text = "\n".join(doc.page_content for doc in documents)
+        self.char_count = len(self.text)
+        self.token_count = estimate_tokens(self.text)
+        self.chunk_ids = [chunk_id(chunk.page_content) for chunk in chunks]
+
+    @property
+    def page_count(self):
+        return len(self.documents)
+
+    def page_index_at(self, offset):
+        """Index of the page containing character `offset` of `text`."""
+        return max(0, bisect.bisect_right(self.page_offsets, offset) - 1)
+
+    def page_text(self, index):
+        return self.documents[index].page_content
@@ -0,0 +1,143 @@
+import os
+import sqlite3
+import threading
+import time
+
+# --- On-disk cache configuration ---
+# Every persistent cache used by the app lives under this directory so a single
+# volume mount (or a single `rm -rf`) covers all of them.
+CACHE_DIR = os.getenv("STUDY_AI_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".study_ai_cache"))
+
+
+def cache_path(file_name):
+    """Returns the absolute path of a cache file, creating the cache directory if needed."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    return os.path.join(CACHE_DIR, file_name)
+
+
+class DiskLRUCache:
+    """A small SQLite-backed key/value store with size-based LRU eviction.
+
+    Values are raw bytes. The store is safe to share between threads of one process and,
+    thanks to WAL mode, between processes that point at the same file.
+    """
+
+    def __init__(self, file_name, max_bytes):
+        self.path = cache_path(file_name)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY,"
+            " value BLOB NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries(last_access)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        """Returns a dict of the keys that were found; found entries are marked as recently used."""
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        if not keys:
+            return found
+        now = time.time()
+        with self._lock:
+            # SQLite limits the number of bound parameters, so look keys up in slices.
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM entries WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, value in rows:
+                    found[key] = value
+                if rows:
+                    self._conn.executemany(
+                        "UPDATE entries SET last_access = ? WHERE key = ?",
+                        [(now, key) for key, _ in rows]
+                    )
+            self._conn.commit()
+        return found
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def set_many(self, items):
+        """Stores a dict of key -> bytes and evicts least recently used entries if over budget."""
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            for key, value in items.items():
+                row = self._conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+                if row:
+                    self._total_bytes -= row[0]
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                    (key, sqlite3.Binary(value), len(value), now)
+                )
+                self._total_bytes += len(value)
+            self._conn.commit()
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def update(self, key, update_fn):
+        """Replaces the value of `key` with `update_fn(current value or None)` in one transaction.
+
+        The read and the write hold SQLite's write lock, so concurrent read-modify-write
+        updates of a key (from this or another process) don't overwrite each other.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT value, size FROM entries WHERE key = ?", (key,)).fetchone()
+                value = update_fn(row[0] if row else None)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                    (key, sqlite3.Binary(value), len(value), time.time())
+                )
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self._total_bytes += len(value) - (row[1] if row else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def delete(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            if row:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._conn.commit()
+                self._total_bytes -= row[0]
+
+    def _evict(self):
+        # Other processes may write to the same file, so re-read the real total before evicting.
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        target = int(self.max_bytes * 0.9)  # Leave some headroom so we don't evict on every insert
+        if self._total_bytes <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM entries ORDER BY last_access ASC").fetchall()
+        doomed = []
+        for key, size in rows:
+            if self._total_bytes <= target:
+                break
+            doomed.append((key,))
+            self._total_bytes -= size
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", doomed)
+        self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {"entries": count, "bytes": self._total_bytes, "max_bytes": self.max_bytes}
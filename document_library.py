@@ -0,0 +1,320 @@
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import telemetry
+from corpus import DocumentCorpus, chunk_id
+from disk_cache import cache_path
+from embedding_cache import CachedEmbeddings
+from hybrid_retrieval import BM25Index
+from vector_registry import StudyIndex, estimate_index_bytes
+
+# --- Document library configuration ---
+LIBRARY_CATALOG_FILE = "library.sqlite3"  # Which documents each library holds, plus their pages and chunks
+LIBRARY_VECTOR_DIR = "library_chroma"  # Persistent Chroma directory holding the vectors of every library
+LIBRARY_COLLECTION = "study_library"
+DEFAULT_LIBRARY = os.getenv("STUDY_AI_LIBRARY", "default")
+CHROMA_UPSERT_BATCH = 1000  # Chroma rejects very large single writes
+
+
+def selection_key(ids):
+    """Identifies a set of documents (or of their contents); a single one keeps its own id."""
+    ids = sorted(set(ids))
+    if len(ids) == 1:
+        return ids[0]
+    return hashlib.md5("\0".join(ids).encode("utf-8")).hexdigest()
+
+
+def doc_id_filter(doc_ids):
+    """Chroma metadata filter restricting a search to the given documents."""
+    doc_ids = list(doc_ids)
+    return {"doc_id": doc_ids[0]} if len(doc_ids) == 1 else {"doc_id": {"$in": doc_ids}}
+
+
+def clean_metadata(metadata, doc_id, doc_name):
+    """Chroma only stores scalar metadata; the loader's temp-file `source` is replaced by the document name."""
+    cleaned = {key: value for key, value in metadata.items() if isinstance(value, (str, int, float, bool))}
+    cleaned["source"] = doc_name
+    cleaned["doc_id"] = doc_id
+    cleaned["doc_name"] = doc_name
+    return cleaned
+
+
+def chunk_keys(doc_id, texts):
+    """Chroma ids for a document's chunks: content hashes, with a suffix for repeated chunks."""
+    seen = {}
+    keys = []
+    for text in texts:
+        digest = chunk_id(text)
+        count = seen.get(digest, 0)
+        seen[digest] = count + 1
+        keys.append(f"{doc_id}:{digest}" if count == 0 else f"{doc_id}:{digest}:{count}")
+    return keys
+
+
+class LibraryView:
+    """The library's vector store restricted to a selection of documents."""
+
+    def __init__(self, vector_store, doc_ids):
+        self.vector_store = vector_store
+        self.doc_ids = list(doc_ids)
+        self.filter = doc_id_filter(self.doc_ids)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return self.vector_store.similarity_search(query, k=k, filter=self.filter, **kwargs)
+
+    def as_retriever(self, **kwargs):
+        search_kwargs = dict(kwargs.pop("search_kwargs", {}), filter=self.filter)
+        return self.vector_store.as_retriever(search_kwargs=search_kwargs, **kwargs)
+
+
+class DocumentLibrary:
+    """Documents kept across sessions: one persistent Chroma collection tagged by `doc_id`.
+
+    Files are identified by their content hash, edited notes by a stable id; a document
+    may belong to several named libraries, its vectors are stored once and dropped when
+    the last library removes it. Adding a document embeds only that document (through the embedding cache), and
+    a selection of documents is searched with a `doc_id` metadata filter. The catalog
+    (membership, pages and chunk text) is SQLite, so listing a library never loads Chroma.
+    """
+
+    def __init__(self, catalog_file=LIBRARY_CATALOG_FILE, vector_dir=LIBRARY_VECTOR_DIR):
+        self.vector_path = cache_path(vector_dir)
+        self._client = None
+        self._lock = threading.Lock()
+        self._document_locks = {}  # doc_id -> lock, so two edits of one document are written one after the other
+        self._edit_sequence = itertools.count(1)
+        self._committed_edits = {}  # doc_id -> sequence number of the newest edit written
+        self._conn = sqlite3.connect(cache_path(catalog_file), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " doc_id TEXT PRIMARY KEY, content_hash TEXT NOT NULL, page_count INTEGER NOT NULL,"
+            " chunk_count INTEGER NOT NULL, char_count INTEGER NOT NULL, indexed_at REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS memberships ("
+            " library TEXT NOT NULL, doc_id TEXT NOT NULL, name TEXT NOT NULL, added_at REAL NOT NULL,"
+            " PRIMARY KEY (library, doc_id));"
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " doc_id TEXT NOT NULL, position INTEGER NOT NULL, text TEXT NOT NULL, metadata TEXT NOT NULL,"
+            " PRIMARY KEY (doc_id, position));"
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " doc_id TEXT NOT NULL, position INTEGER NOT NULL, chunk_key TEXT NOT NULL, text TEXT NOT NULL,"
+            " metadata TEXT NOT NULL, PRIMARY KEY (doc_id, position));"
+        )
+        self._conn.commit()
+
+    def _collection(self):
+        """The shared Chroma collection, opened on first use (callers must have set up sqlite for Chroma)."""
+        with self._lock:
+            if self._client is None:
+                import chromadb
+                self._client = chromadb.PersistentClient(path=self.vector_path)
+            return self._client.get_or_create_collection(LIBRARY_COLLECTION)
+
+    def _vector_store(self, embeddings):
+        from langchain_community.vectorstores import Chroma
+        self._collection()
+        return Chroma(client=self._client, collection_name=LIBRARY_COLLECTION, embedding_function=embeddings)
+
+    # --- Catalog ---
+
+    def list_documents(self, library):
+        """The library's documents, oldest first, as dicts."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT m.doc_id, m.name, m.added_at, d.content_hash, d.page_count, d.chunk_count, d.char_count"
+                " FROM memberships m JOIN documents d ON d.doc_id = m.doc_id"
+                " WHERE m.library = ? ORDER BY m.added_at",
+                (library,)
+            ).fetchall()
+        columns = ("doc_id", "name", "added_at", "content_hash", "page_count", "chunk_count", "char_count")
+        return [dict(zip(columns, row)) for row in rows]
+
+    def has_document(self, library, doc_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM memberships WHERE library = ? AND doc_id = ?", (library, doc_id)
+            ).fetchone()
+        return row is not None
+
+    def is_indexed(self, doc_id):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM documents WHERE doc_id = ?", (doc_id,)).fetchone() is not None
+
+    # --- Incremental updates ---
+
+    def add_document(self, library, doc_id, name, documents, chunks, embeddings, embedding_namespace, progress_callback=None):
+        """Adds a loaded and split document whose `doc_id` is its content hash.
+
+        Returns embedding stats; nothing is embedded when another library already
+        indexed the same content.
+        """
+        stats = {"added": 0, "removed": 0, "kept": 0, "hits": 0, "misses": 0}
+        if not self.is_indexed(doc_id):
+            stats = self._write_document(doc_id, name, documents, chunks, doc_id, embeddings, embedding_namespace, progress_callback)
+        self._add_membership(library, doc_id, name)
+        return stats
+
+    def next_edit_sequence(self):
+        """Numbers an edit when it is submitted; pass the number to `update_document`.
+
+        Edits are indexed by background jobs that may reach the write out of order.
+        """
+        with self._lock:
+            return next(self._edit_sequence)
+
+    def update_document(self, library, doc_id, name, documents, chunks, content_hash, embeddings, embedding_namespace,
+                        progress_callback=None, edit_sequence=None):
+        """Re-indexes an edited document under the same `doc_id`.
+
+        Chunk ids are content hashes, so unchanged chunks keep their vectors: only chunks
+        that are new in this version are embedded and only chunks that disappeared are
+        deleted, which keeps the cost proportional to the size of the edit. An edit whose
+        `edit_sequence` is older than the one already written is dropped (stats say
+        `superseded`), so a slow job can't put back the text of an earlier version.
+        """
+        stats = self._write_document(doc_id, name, documents, chunks, content_hash, embeddings, embedding_namespace,
+                                     progress_callback, edit_sequence)
+        self._add_membership(library, doc_id, name)
+        return stats
+
+    def _write_document(self, doc_id, name, documents, chunks, content_hash, embeddings, embedding_namespace, progress_callback,
+                        edit_sequence=None):
+        with self._lock:
+            document_lock = self._document_locks.setdefault(doc_id, threading.Lock())
+        with document_lock:
+            if edit_sequence is not None and edit_sequence < self._committed_edits.get(doc_id, 0):
+                return {"added": 0, "removed": 0, "kept": 0, "hits": 0, "misses": 0, "superseded": True}
+            stats = self._diff_and_write(doc_id, name, documents, chunks, content_hash, embeddings, embedding_namespace, progress_callback)
+            if edit_sequence is not None:
+                self._committed_edits[doc_id] = edit_sequence
+            return stats
+
+    def _diff_and_write(self, doc_id, name, documents, chunks, content_hash, embeddings, embedding_namespace, progress_callback):
+        texts = [chunk.page_content for chunk in chunks]
+        keys = chunk_keys(doc_id, texts)
+        chunk_metadata = [clean_metadata(chunk.metadata, doc_id, name) for chunk in chunks]
+        with self._lock:
+            old_keys = {row[0] for row in self._conn.execute("SELECT chunk_key FROM chunks WHERE doc_id = ?", (doc_id,))}
+        new_positions = [position for position, key in enumerate(keys) if key not in old_keys]
+        stale_keys = sorted(old_keys - set(keys))
+
+        stats = {"added": len(new_positions), "removed": len(stale_keys), "kept": len(keys) - len(new_positions), "hits": 0, "misses": 0}
+        if new_positions or stale_keys:
+            collection = self._collection()
+        if new_positions:
+            cached_embeddings = CachedEmbeddings(embeddings, embedding_namespace, progress_callback=progress_callback)
+            vectors, embed_stats = cached_embeddings.embed_documents_with_stats([texts[position] for position in new_positions])
+            stats.update(embed_stats)
+        with telemetry.span("index", added=len(new_positions), removed=len(stale_keys), kept=stats["kept"], pages=len(documents)):
+            for start in range(0, len(new_positions), CHROMA_UPSERT_BATCH):
+                batch = new_positions[start:start + CHROMA_UPSERT_BATCH]
+                collection.upsert(
+                    ids=[keys[position] for position in batch],
+                    embeddings=vectors[start:start + CHROMA_UPSERT_BATCH],
+                    documents=[texts[position] for position in batch],
+                    metadatas=[chunk_metadata[position] for position in batch]
+                )
+            for start in range(0, len(stale_keys), CHROMA_UPSERT_BATCH):
+                collection.delete(ids=stale_keys[start:start + CHROMA_UPSERT_BATCH])
+
+            with self._lock:
+                self._conn.execute("DELETE FROM pages WHERE doc_id = ?", (doc_id,))
+                self._conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+                self._conn.executemany(
+                    "INSERT INTO pages (doc_id, position, text, metadata) VALUES (?, ?, ?, ?)",
+                    [(doc_id, position, doc.page_content, json.dumps(clean_metadata(doc.metadata, doc_id, name)))
+                     for position, doc in enumerate(documents)]
+                )
+                self._conn.executemany(
+                    "INSERT INTO chunks (doc_id, position, chunk_key, text, metadata) VALUES (?, ?, ?, ?, ?)",
+                    [(doc_id, position, key, text, json.dumps(metadata))
+                     for position, (key, text, metadata) in enumerate(zip(keys, texts, chunk_metadata))]
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO documents (doc_id, content_hash, page_count, chunk_count, char_count, indexed_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (doc_id, content_hash, len(documents), len(chunks), sum(len(doc.page_content) for doc in documents), time.time())
+                )
+                self._conn.commit()
+        return stats
+
+    def _add_membership(self, library, doc_id, name):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO memberships (library, doc_id, name, added_at) VALUES (?, ?, ?, ?)",
+                (library, doc_id, name, time.time())
+            )
+            self._conn.commit()
+
+    def remove_document(self, library, doc_id):
+        """Removes a document from a library; its vectors go when no library holds it any more."""
+        with self._lock:
+            self._conn.execute("DELETE FROM memberships WHERE library = ? AND doc_id = ?", (library, doc_id))
+            still_used = self._conn.execute("SELECT 1 FROM memberships WHERE doc_id = ?", (doc_id,)).fetchone()
+            keys = [] if still_used else [
+                row[0] for row in self._conn.execute("SELECT chunk_key FROM chunks WHERE doc_id = ?", (doc_id,))
+            ]
+            if not still_used:
+                for table in ("documents", "pages", "chunks"):
+                    self._conn.execute(f"DELETE FROM {table} WHERE doc_id = ?", (doc_id,))
+            self._conn.commit()
+        if keys:
+            collection = self._collection()
+            for start in range(0, len(keys), CHROMA_UPSERT_BATCH):
+                collection.delete(ids=keys[start:start + CHROMA_UPSERT_BATCH])
+
+    # --- Selections ---
+
+    def open_selection(self, library, doc_ids, query_embeddings):
+        """Builds a StudyIndex over the selected documents (in library order) for chat and the tools."""
+        with telemetry.span("open_selection", documents=len(doc_ids)) as open_span:
+            index = self._open_selection(library, doc_ids, query_embeddings)
+            open_span.set(chunks=len(index.chunks), chars=index.corpus.char_count)
+            return index
+
+    def _open_selection(self, library, doc_ids, query_embeddings):
+        from langchain_core.documents import Document
+
+        library_documents = {doc["doc_id"]: doc for doc in self.list_documents(library)}
+        doc_ids = [doc_id for doc_id in library_documents if doc_id in set(doc_ids)]
+        documents, chunks = [], []
+        with self._lock:
+            for doc_id in doc_ids:
+                documents.extend(
+                    Document(page_content=text, metadata=json.loads(metadata))
+                    for text, metadata in self._conn.execute(
+                        "SELECT text, metadata FROM pages WHERE doc_id = ? ORDER BY position", (doc_id,)
+                    )
+                )
+                chunks.extend(
+                    Document(page_content=text, metadata=json.loads(metadata))
+                    for text, metadata in self._conn.execute(
+                        "SELECT text, metadata FROM chunks WHERE doc_id = ? ORDER BY position", (doc_id,)
+                    )
+                )
+        selected_names = [library_documents[doc_id]["name"] for doc_id in doc_ids]
+        source_name = ", ".join(selected_names) if len(selected_names) <= 3 else f"{len(selected_names)} documents"
+        # Keyed by content, not doc_id: an edited document must not hit caches built from its old text
+        content_hash = selection_key(library_documents[doc_id]["content_hash"] for doc_id in doc_ids)
+        corpus = DocumentCorpus(documents, chunks, content_hash, source_name)
+        view = LibraryView(self._vector_store(query_embeddings), doc_ids)
+        return StudyIndex(view, corpus, estimate_index_bytes(chunks), lexical_index=BM25Index(chunks))
+
+
+_library = None
+_library_lock = threading.Lock()
+
+
+def get_document_library():
+    """Returns the document library shared by all sessions served by this process."""
+    global _library
+    with _library_lock:
+        if _library is None:
+            _library = DocumentLibrary()
+        return _library
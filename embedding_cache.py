@@ -0,0 +1,168 @@
+import contextvars
+import hashlib
+import os
+import threading
+from array import array
+
+import telemetry
+from disk_cache import DiskLRUCache
+from embedding_pipeline import EMBED_BATCH_SIZE, EMBED_MAX_WORKERS, embed_in_batches
+
+# --- Embedding cache configuration ---
+EMBEDDING_CACHE_FILE = "embeddings.sqlite3"
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("STUDY_AI_EMBEDDING_CACHE_MAX_MB", "1024")) * 1024 * 1024
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """Returns the process-wide embedding cache (opened lazily on first use)."""
+    global _embedding_cache
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            _embedding_cache = DiskLRUCache(EMBEDDING_CACHE_FILE, EMBEDDING_CACHE_MAX_BYTES)
+        return _embedding_cache
+
+
+def embedding_key(model_name, text):
+    """Content address of a chunk: the embedding model plus a hash of the exact chunk text."""
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return f"{model_name}:{digest}"
+
+
+def encode_vector(vector):
+    return array("f", vector).tobytes()
+
+
+def decode_vector(blob):
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+class CachedEmbeddings:
+    """Drop-in wrapper around a LangChain embeddings client that checks the on-disk cache first.
+
+    Only chunks whose text has never been embedded with `model_name` are sent to the API.
+    Misses go through the concurrent, rate-limited batch pipeline and are written to the
+    cache batch by batch, so an interrupted ingestion resumes where it stopped.
+    `embed_documents_with_stats` also returns the call's hit/miss counts; they are per call
+    (not kept on the instance) because one wrapper is shared by threads.
+    """
+
+    def __init__(self, embeddings, model_name, cache=None, progress_callback=None):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache or get_embedding_cache()
+        self.progress_callback = progress_callback
+
+    def embed_documents(self, texts):
+        return self.embed_documents_with_stats(texts)[0]
+
+    def embed_documents_with_stats(self, texts):
+        """Returns (vectors, {"hits", "misses"}) for `texts`."""
+        with telemetry.span("embed", texts=len(texts), chars=sum(len(text) for text in texts)) as embed_span:
+            vectors, stats = self._embed_documents(texts)
+            embed_span.set(**stats)
+            return vectors, stats
+
+    def _embed_documents(self, texts):
+        keys = [embedding_key(self.model_name, text) for text in texts]
+        found = self.cache.get_many(keys)
+
+        # Identical chunks (headers, boilerplate) are only embedded once.
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+
+        if missing:
+            key_by_text = {text: key for key, text in missing.items()}
+
+            def save_batch(batch_texts, batch_vectors):
+                new_entries = {key_by_text[text]: encode_vector(vector) for text, vector in zip(batch_texts, batch_vectors)}
+                self.cache.set_many(new_entries)
+                found.update(new_entries)
+
+            embed_in_batches(
+                self.embeddings.embed_documents,
+                list(missing.values()),
+                on_batch_done=save_batch,
+                progress_callback=self.progress_callback
+            )
+
+        stats = {"hits": len(texts) - len(missing), "misses": len(missing)}
+        return [decode_vector(found[key]) for key in keys], stats
+
+    def embed_query(self, text):
+        """Query vectors are cached too, so a repeated question needs no embedding call."""
+        key = embedding_key(f"{self.model_name}|query", text)
+        with telemetry.span("embed_query", chars=len(text)) as embed_span:
+            cached = self.cache.get(key)
+            embed_span.set(cached=cached is not None)
+            if cached is not None:
+                return decode_vector(cached)
+            vector = self.embeddings.embed_query(text)
+            self.cache.set(key, encode_vector(vector))
+            return vector
+
+
+class EmbeddingPrefetcher:
+    """Embeds texts into the cache on a background thread while the caller is still producing them.
+
+    Ingestion feeds it each page's chunks as the PDF is extracted, so embedding overlaps
+    extraction; when the document is then written, its vectors are already cache hits.
+    Prefetching is best effort: after an error it stops, and the write embeds what is left
+    (and reports the error) itself. `stats` adds up the hits and misses of what it embedded.
+    """
+
+    def __init__(self, cached_embeddings, batch_size=EMBED_BATCH_SIZE * EMBED_MAX_WORKERS):
+        self.cached_embeddings = cached_embeddings
+        self.batch_size = batch_size  # Enough texts to keep every embedding worker busy
+        self.stats = {"hits": 0, "misses": 0}
+        self.error = None
+        self._pending = []
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=contextvars.copy_context().run, args=(self._run,), daemon=True)
+        self._thread.start()
+
+    def add(self, texts):
+        with self._condition:
+            if self.error is None and not self._closed:
+                self._pending.extend(texts)
+                self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed and len(self._pending) < self.batch_size:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                batch, self._pending = self._pending, []
+            try:
+                _, batch_stats = self.cached_embeddings.embed_documents_with_stats(batch)
+            except Exception as e:
+                with self._condition:
+                    self.error = e
+                    self._pending = []
+                return
+            for key, value in batch_stats.items():
+                self.stats[key] += value
+
+    def finish(self):
+        """Embeds whatever is still pending, waits for it and returns `stats`."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        return self.stats
+
+    def cancel(self):
+        """Drops pending texts; a batch already sent finishes in the background."""
+        with self._condition:
+            self._closed = True
+            self._pending = []
+            self._condition.notify()
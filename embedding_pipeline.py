@@ -0,0 +1,150 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from corpus import estimate_tokens
+
+# --- Embedding pipeline configuration ---
+EMBED_BATCH_SIZE = int(os.getenv("STUDY_AI_EMBED_BATCH_SIZE", "100"))  # batchEmbedContents accepts at most 100 texts
+EMBED_MAX_WORKERS = int(os.getenv("STUDY_AI_EMBED_WORKERS", "4"))
+EMBED_REQUESTS_PER_MINUTE = int(os.getenv("STUDY_AI_EMBED_RPM", "1000"))
+EMBED_TOKENS_PER_MINUTE = int(os.getenv("STUDY_AI_EMBED_TPM", "1000000"))
+EMBED_MAX_RETRIES = int(os.getenv("STUDY_AI_EMBED_MAX_RETRIES", "5"))
+
+
+def is_rate_limit_error(error):
+    message = str(error).lower()
+    return (
+        "429" in message
+        or "resource exhausted" in message
+        or "resourceexhausted" in message
+        or "quota" in message
+        or type(error).__name__ == "ResourceExhausted"
+    )
+
+
+class RateLimiter:
+    """Token-bucket limiter enforcing a requests-per-minute and a tokens-per-minute budget.
+
+    Shared by all worker threads (and all sessions) so the whole process stays inside the quota.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_allowance = float(requests_per_minute)
+        self._token_allowance = float(tokens_per_minute)
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._request_allowance = min(self.requests_per_minute, self._request_allowance + elapsed * self.requests_per_minute / 60)
+        self._token_allowance = min(self.tokens_per_minute, self._token_allowance + elapsed * self.tokens_per_minute / 60)
+
+    def acquire(self, tokens):
+        """Blocks until one request carrying `tokens` tokens fits in both budgets."""
+        tokens = min(tokens, self.tokens_per_minute)  # A single oversized batch must still be able to go out
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._paused_until and self._request_allowance >= 1 and self._token_allowance >= tokens:
+                    self._request_allowance -= 1
+                    self._token_allowance -= tokens
+                    return
+                wait = max(
+                    self._paused_until - now,
+                    (1 - self._request_allowance) * 60 / self.requests_per_minute,
+                    (tokens - self._token_allowance) * 60 / self.tokens_per_minute,
+                    0.05
+                )
+            time.sleep(min(wait, 5))
+
+    def pause(self, seconds):
+        """Holds back every caller for `seconds`, e.g. after the API answered 429."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_embedding_rate_limiter():
+    """Returns the process-wide embedding rate limiter."""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter(EMBED_REQUESTS_PER_MINUTE, EMBED_TOKENS_PER_MINUTE)
+        return _rate_limiter
+
+
+def _embed_batch_with_retries(embed_fn, batch, limiter, max_retries):
+    attempt = 0
+    while True:
+        limiter.acquire(sum(estimate_tokens(text) for text in batch))
+        try:
+            return embed_fn(batch)
+        except Exception as e:
+            attempt += 1
+            if attempt > max_retries:
+                raise
+            delay = min(60, 2 ** attempt) + random.uniform(0, 1)
+            if is_rate_limit_error(e):
+                limiter.pause(delay)  # Everyone backs off, not just this worker
+            else:
+                time.sleep(delay)
+
+
+def embed_in_batches(embed_fn, texts, on_batch_done=None, progress_callback=None,
+                     batch_size=EMBED_BATCH_SIZE, max_workers=EMBED_MAX_WORKERS,
+                     limiter=None, max_retries=EMBED_MAX_RETRIES):
+    """Embeds `texts` in concurrent batches and returns the vectors in input order.
+
+    `on_batch_done(batch_texts, batch_vectors)` is called as each batch finishes, so callers
+    can persist partial progress: if a batch ultimately fails, the exception propagates but
+    every batch that finished is already saved and won't be re-embedded on the next attempt.
+    `progress_callback(done_batches, total_batches)` is called from the calling thread.
+    """
+    limiter = limiter or get_embedding_rate_limiter()
+    batches = [texts[start:start + batch_size] for start in range(0, len(texts), batch_size)]
+    results = [None] * len(batches)
+    if not batches:
+        return []
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as executor:
+        futures = {
+            executor.submit(_embed_batch_with_retries, embed_fn, batch, limiter, max_retries): index
+            for index, batch in enumerate(batches)
+        }
+        done = 0
+        first_error = None
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                if first_error is None:
+                    first_error = e
+                    for pending in futures:
+                        pending.cancel()
+                continue
+            if on_batch_done:
+                on_batch_done(batches[index], results[index])
+            done += 1
+            if progress_callback:
+                try:
+                    progress_callback(done, len(batches))
+                except BaseException:
+                    for pending in futures:  # The caller gave up (e.g. a cancelled job): don't start queued batches
+                        pending.cancel()
+                    raise
+        if first_error is not None:
+            raise first_error
+
+    return [vector for batch_vectors in results for vector in batch_vectors]
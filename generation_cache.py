@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+from disk_cache import DiskLRUCache
+
+# --- Generation cache configuration ---
+GENERATION_CACHE_FILE = "generations.sqlite3"
+GENERATION_CACHE_MAX_BYTES = int(os.getenv("STUDY_AI_GENERATION_CACHE_MAX_MB", "512")) * 1024 * 1024
+GENERATION_CACHE_TTL_S = int(os.getenv("STUDY_AI_GENERATION_CACHE_TTL_HOURS", "168")) * 3600
+# High-temperature models give a different answer each time; keep a few and serve one at random
+GENERATION_CACHE_MAX_VARIANTS = int(os.getenv("STUDY_AI_GENERATION_CACHE_VARIANTS", "3"))
+HIGH_TEMPERATURE = 1.0
+
+ERROR_OUTPUT_PREFIXES = ("Error ", "Response blocked", "Sorry, an error occurred", "No document loaded")
+
+
+def llm_identity(llm):
+    """Model name and temperature of a LangChain LLM, the parts of it that change the output."""
+    return getattr(llm, "model", None), getattr(llm, "temperature", None)
+
+
+def generation_key(document_hash, tool, options, llm):
+    """Cache key for one tool run: document, tool, its options, model and temperature."""
+    model_name, temperature = llm_identity(llm)
+    payload = json.dumps(
+        {"document": document_hash, "tool": tool, "options": options, "model": model_name, "temperature": temperature},
+        sort_keys=True, default=str
+    )
+    return f"{tool}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+
+def max_variants_for(llm):
+    _, temperature = llm_identity(llm)
+    if temperature is not None and temperature >= HIGH_TEMPERATURE:
+        return GENERATION_CACHE_MAX_VARIANTS
+    return 1
+
+
+def is_error_output(text):
+    """Tool functions return error messages as text; those must never be cached."""
+    return not text or not text.strip() or text.startswith(ERROR_OUTPUT_PREFIXES)
+
+
+class GenerationCache:
+    """Stores LLM outputs per tool run, with a time-to-live and a total size limit.
+
+    Each key holds up to `max_variants` outputs (newest last); `get` serves one of the
+    variants that haven't expired.
+    """
+
+    def __init__(self, store, ttl_seconds=GENERATION_CACHE_TTL_S):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+
+    def _variants(self, key):
+        return self._live_variants(self.store.get(key))
+
+    def _live_variants(self, raw):
+        if raw is None:
+            return []
+        variants = json.loads(raw.decode("utf-8"))
+        cutoff = time.time() - self.ttl_seconds
+        return [variant for variant in variants if variant["created"] >= cutoff]
+
+    def get(self, key):
+        variants = self._variants(key)
+        if not variants:
+            return None
+        return random.choice(variants)["text"]
+
+    def add(self, key, text, max_variants=1):
+        """Appends a variant; concurrent adds to one key (e.g. two regenerations) all keep theirs."""
+        def append(raw):
+            variants = self._live_variants(raw) + [{"text": text, "created": time.time()}]
+            return json.dumps(variants[-max_variants:]).encode("utf-8")
+
+        self.store.update(key, append)
+
+    def variant_count(self, key):
+        return len(self._variants(key))
+
+
+_generation_cache = None
+_generation_cache_lock = threading.Lock()
+
+
+def get_generation_cache():
+    """Returns the process-wide generation cache."""
+    global _generation_cache
+    with _generation_cache_lock:
+        if _generation_cache is None:
+            _generation_cache = GenerationCache(DiskLRUCache(GENERATION_CACHE_FILE, GENERATION_CACHE_MAX_BYTES))
+        return _generation_cache
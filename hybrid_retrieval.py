@@ -0,0 +1,123 @@
+import math
+import os
+import re
+import time
+from collections import Counter, defaultdict
+
+import telemetry
+
+# --- Hybrid retrieval configuration ---
+RETRIEVAL_FETCH_K = int(os.getenv("STUDY_AI_RETRIEVAL_FETCH_K", "10"))  # Candidates taken from each retriever before fusion
+RRF_K = 60  # Standard reciprocal rank fusion constant
+# Lexical fast path: skip the query embedding when BM25 is clearly confident
+LEXICAL_MIN_TERM_COVERAGE = 1.0  # The top chunk must contain every query term
+LEXICAL_MIN_SCORE_RATIO = float(os.getenv("STUDY_AI_LEXICAL_SCORE_RATIO", "1.5"))  # ...and beat the runner-up by this factor
+
+# Keeps "h2o", "1914", "x-ray" and "3.14" as single terms; "newton's" becomes "newton" + "s"
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.\-][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be but by can did do does for from had has have how i if in into is it its me my "
+    "of on or our so than that the their them then there these they this to was we were what when where "
+    "which who whom why will with would you your about explain tell describe define s t".split()
+)
+
+
+def tokenize(text):
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """In-process Okapi BM25 index over the chunks of one document."""
+
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)  # term -> [(chunk index, term frequency)]
+        self.doc_lengths = []
+        for index, chunk in enumerate(chunks):
+            counts = Counter(tokenize(chunk.page_content))
+            self.doc_lengths.append(sum(counts.values()))
+            for term, frequency in counts.items():
+                self.postings[term].append((index, frequency))
+        self.avg_doc_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if self.doc_lengths else 0
+        count = len(chunks)
+        self.idf = {
+            term: math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def search(self, query, k):
+        """Returns up to k (chunk index, score, matched term count) tuples, best first."""
+        terms = set(tokenize(query))
+        scores = defaultdict(float)
+        matched = defaultdict(int)
+        for term in terms:
+            for index, frequency in self.postings.get(term, ()):
+                length_norm = 1 - self.b + self.b * self.doc_lengths[index] / (self.avg_doc_length or 1)
+                scores[index] += self.idf[term] * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+                matched[index] += 1
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(index, score, matched[index]) for index, score in ranked]
+
+
+class HybridRetriever:
+    """BM25 + vector retrieval merged with reciprocal rank fusion.
+
+    When BM25 alone is confident (the top chunk contains every query term and clearly
+    beats the runner-up) the vector search, and with it the remote query-embedding call,
+    is skipped. `last_run` describes the most recent call for display/metrics.
+    """
+
+    def __init__(self, vector_store, lexical_index, k=3, fetch_k=RETRIEVAL_FETCH_K):
+        self.vector_store = vector_store
+        self.lexical_index = lexical_index
+        self.k = k
+        self.fetch_k = fetch_k
+        self.last_run = None
+
+    def _lexical_is_confident(self, query, lexical_hits):
+        query_terms = set(tokenize(query))
+        if not query_terms or not lexical_hits:
+            return False
+        _, top_score, top_matched = lexical_hits[0]
+        if top_matched / len(query_terms) < LEXICAL_MIN_TERM_COVERAGE:
+            return False
+        if len(lexical_hits) == 1:
+            return True
+        return top_score >= LEXICAL_MIN_SCORE_RATIO * lexical_hits[1][1]
+
+    def invoke(self, query):
+        with telemetry.span("retrieve", k=self.k, query_chars=len(query)) as retrieve_span:
+            results = self._invoke(query)
+            retrieve_span.set(path=self.last_run["path"], results=len(results))
+            return results
+
+    def _invoke(self, query):
+        started = time.perf_counter()
+        lexical_hits = self.lexical_index.search(query, self.fetch_k)
+        chunks = self.lexical_index.chunks
+
+        if self._lexical_is_confident(query, lexical_hits):
+            path = "lexical"
+            results = [chunks[index] for index, _, _ in lexical_hits[:self.k]]
+        else:
+            path = "hybrid"
+            vector_docs = self.vector_store.similarity_search(query, k=self.fetch_k)
+            fused = defaultdict(float)
+            documents = {}
+            for rank, (index, _, _) in enumerate(lexical_hits):
+                key = chunks[index].page_content
+                fused[key] += 1 / (RRF_K + rank + 1)
+                documents[key] = chunks[index]
+            for rank, doc in enumerate(vector_docs):
+                fused[doc.page_content] += 1 / (RRF_K + rank + 1)
+                documents.setdefault(doc.page_content, doc)
+            ranked = sorted(fused, key=fused.get, reverse=True)[:self.k]
+            results = [documents[key] for key in ranked]
+
+        elapsed = time.perf_counter() - started
+        telemetry.record("retrieval.latency_s", elapsed, path=path)
+        telemetry.record("retrieval.embedding_calls", 0 if path == "lexical" else 1, path=path)
+        self.last_run = {"path": path, "latency_s": elapsed}
+        return results
@@ -0,0 +1,87 @@
+import contextvars
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import telemetry
+from generation_cache import get_generation_cache, is_error_output, llm_identity
+from llm_streaming import invoke_completion
+from near_duplicates import remove_near_duplicates, split_items
+from summarizer import build_sections
+
+# --- Sectioned flashcard / practice question configuration ---
+ITEM_SECTION_TOKENS = int(os.getenv("STUDY_AI_ITEM_SECTION_TOKENS", "20000"))
+ITEM_MAX_WORKERS = int(os.getenv("STUDY_AI_ITEM_WORKERS", "6"))
+
+
+class SectionedItemGenerator:
+    """Generates 'front>>back' study items (flashcards, practice questions) from every section of a document.
+
+    Each section gets its own prompt, run concurrently by a bounded worker pool, so a long
+    book is covered to the last chapter and wall-clock time falls with more workers. Section
+    outputs are cached by the hash of their prompt (bypassed when regenerating); the merged list drops near-duplicates
+    (see near_duplicates.remove_near_duplicates). A section whose call fails is reported and
+    skipped instead of failing the whole run.
+    """
+
+    def __init__(self, llm, cache=None, max_workers=ITEM_MAX_WORKERS, section_tokens=ITEM_SECTION_TOKENS):
+        self.llm = llm
+        self.cache = cache or get_generation_cache()
+        self.max_workers = max_workers
+        self.section_tokens = section_tokens
+
+    def _cache_key(self, tool, prompt):
+        model_name, temperature = llm_identity(self.llm)
+        digest = hashlib.sha256("\0".join([tool, str(model_name), str(temperature), prompt]).encode("utf-8")).hexdigest()
+        return f"{tool}_section:{digest}"
+
+    def _generate(self, tool, prompt, regenerate):
+        key = self._cache_key(tool, prompt)
+        cached = None if regenerate else self.cache.get(key)
+        if cached is not None:
+            return cached
+        text = invoke_completion(self.llm, prompt, tool)
+        if not is_error_output(text):
+            self.cache.add(key, text)
+        return text
+
+    def generate(self, corpus, build_prompt, tool, progress_callback=None, regenerate=False):
+        """Returns {"items", "section_count", "duplicates_removed", "failed_sections"}; items keep the document order.
+
+        `build_prompt(section_text)` makes the prompt for one section; `progress_callback(done, total)`
+        is called as sections finish. `regenerate` asks the model again for every section.
+        """
+        started = time.perf_counter()
+        sections = build_sections(corpus, self.section_tokens)
+        outputs = [None] * len(sections)
+        errors = {}
+        if sections:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(sections)))) as executor:
+                futures = {
+                    executor.submit(contextvars.copy_context().run, self._generate, tool, build_prompt(section.text), regenerate): index
+                    for index, section in enumerate(sections)
+                }
+                for done, future in enumerate(as_completed(futures), start=1):
+                    index = futures[future]
+                    try:
+                        outputs[index] = future.result()
+                    except Exception as e:
+                        errors[index] = str(e)
+                    if progress_callback:
+                        try:
+                            progress_callback(done, len(sections))
+                        except BaseException:
+                            for pending in futures:  # The caller gave up (e.g. a cancelled job): don't start queued sections
+                                pending.cancel()
+                            raise
+        for index, output in enumerate(outputs):
+            if output is not None and is_error_output(output):
+                errors[index] = output.strip()[:80]
+        failed_sections = [f"{sections[index].location} ({errors[index]})" for index in sorted(errors)]
+        items = [item for output in outputs if output and not is_error_output(output) for item in split_items(output)]
+        with telemetry.span("items.dedupe", tool=tool, items=len(items)) as dedupe_span:
+            kept, removed = remove_near_duplicates(items)
+            dedupe_span.set(removed=removed)
+        telemetry.record("items.generate_s", time.perf_counter() - started, tool=tool, sections=len(sections))
+        return {"items": kept, "section_count": len(sections), "duplicates_removed": removed, "failed_sections": failed_sections}
@@ -0,0 +1,172 @@
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import telemetry
+
+# --- Background job configuration ---
+JOB_MAX_WORKERS = int(os.getenv("STUDY_AI_JOB_WORKERS", "4"))  # Jobs running at once for the whole server
+JOB_RESULT_TTL_S = int(os.getenv("STUDY_AI_JOB_RESULT_TTL_S", "1800"))  # Finished jobs are forgotten after this
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(BaseException):
+    """Raised inside a job (from `report()`) once every session waiting for it has cancelled.
+
+    A BaseException, like KeyboardInterrupt, so the `except Exception` retry and fallback
+    handlers inside the job functions don't swallow it.
+    """
+
+
+class Job:
+    """One unit of background work. Status and progress live here, outside any script run."""
+
+    def __init__(self, kind, key):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.status = QUEUED
+        self.done = 0
+        self.total = 0
+        self.message = "Waiting for a free worker..."
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.subscribers = 1  # Sessions waiting for this job; it is only cancelled when all of them cancel
+        self._cancel_event = threading.Event()
+
+    @property
+    def is_finished(self):
+        return self.status in FINISHED_STATES
+
+    @property
+    def fraction(self):
+        if self.status == DONE:
+            return 1.0
+        return min(1.0, self.done / self.total) if self.total else 0.0
+
+    @property
+    def cancel_requested(self):
+        return self._cancel_event.is_set()
+
+    def report(self, done=None, total=None, message=None):
+        """Progress callback for job functions; also the point where cancellation takes effect."""
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+        if done is not None:
+            self.done = done
+        if total is not None:
+            self.total = total
+        if message is not None:
+            self.message = message
+
+
+class JobRunner:
+    """Runs OCR, ingestion and long generations on one bounded pool shared by all sessions.
+
+    Submitting a job whose key matches a queued, running or recently finished successful
+    job returns that job instead, so two sessions (or two reruns) asking for the same work
+    share it. Jobs that write data (ingestion) pass `reuse_result=False`: only a queued or
+    running job is shared, because a finished one may have been undone since (a removed
+    document). A job submitted with `supersede=group` cancels the group's earlier job if it
+    hasn't finished: only the newest matters (e.g. the edits of one document). Job functions
+    take the Job as their first argument and call `job.report()`.
+    """
+
+    def __init__(self, max_workers=JOB_MAX_WORKERS, result_ttl=JOB_RESULT_TTL_S):
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="study-job")
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._by_key = {}
+        self._by_group = {}
+
+    def submit(self, kind, key, fn, *args, reuse_result=True, supersede=None, **kwargs):
+        """Returns the id of the job doing `fn(job, *args, **kwargs)` for `key`, starting it if needed."""
+        with self._lock:
+            self._prune()
+            existing = self._jobs.get(self._by_key.get(key))
+            reusable = (QUEUED, RUNNING, DONE) if reuse_result else (QUEUED, RUNNING)
+            if existing is not None and existing.status in reusable and not existing.cancel_requested:
+                existing.subscribers += 1
+                return existing.id
+            job = Job(kind, key)
+            self._jobs[job.id] = job
+            self._by_key[key] = job.id
+            if supersede is not None:
+                previous = self._jobs.get(self._by_group.get(supersede))
+                if previous is not None and not previous.is_finished:
+                    # Cancelled for every subscriber, not just one: they all want the newest version
+                    previous._cancel_event.set()
+                    previous.message = "Replaced by a newer version..."
+                self._by_group[supersede] = job.id
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job.id
+
+    def _run(self, job, fn, args, kwargs):
+        if job.cancel_requested:
+            job.status, job.finished_at = CANCELLED, time.time()
+            return
+        job.status, job.started_at = RUNNING, time.time()
+        job.message = "Running..."
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = DONE
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            job.error = str(e) or e.__class__.__name__
+            job.status = FAILED
+            print(f"Background job {job.kind} failed:\n{traceback.format_exc()}")
+        job.finished_at = time.time()
+        telemetry.record("job.run_s", job.finished_at - job.started_at, kind=job.kind, status=job.status)
+        telemetry.record("job.wait_s", job.started_at - job.created_at, kind=job.kind)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Withdraws one session's interest; the job stops at its next progress report once nobody waits for it."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.is_finished:
+                return
+            job.subscribers = max(0, job.subscribers - 1)
+            if job.subscribers == 0:
+                job._cancel_event.set()
+                job.message = "Cancelling..."
+
+    def _prune(self):
+        cutoff = time.time() - self.result_ttl
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.is_finished and job.finished_at < cutoff]:
+            job = self._jobs.pop(job_id)
+            if self._by_key.get(job.key) == job_id:
+                del self._by_key[job.key]
+        for group in [group for group, job_id in self._by_group.items() if job_id not in self._jobs]:
+            del self._by_group[group]
+
+    def stats(self):
+        with self._lock:
+            return {status: sum(1 for job in self._jobs.values() if job.status == status)
+                    for status in (QUEUED, RUNNING, DONE, FAILED, CANCELLED)}
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_job_runner():
+    """Returns the job runner shared by all sessions served by this process."""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner()
+        return _runner
@@ -0,0 +1,72 @@
+import time
+
+import telemetry
+from corpus import estimate_tokens
+
+
+class CompletionStream:
+    """Iterates over an LLM answer as it is generated, for use with `st.write_stream`.
+
+    Records time-to-first-token and total generation time under the `tool` label. If the
+    call fails, `on_error(exception)` provides the text to show instead; its result is
+    yielded as the final chunk so the caller still ends up with a displayable string.
+    The whole generation is one `llm` span under the span that created the stream.
+    """
+
+    def __init__(self, llm, prompt, tool, on_error=None):
+        self.llm = llm
+        self.prompt = prompt
+        self.tool = tool
+        self.on_error = on_error
+        self.ttft_s = None
+        self.total_s = None
+        self.text = ""
+        self._parent_span = telemetry.current_span()
+
+    def __iter__(self):
+        started = time.perf_counter()
+        llm_span = telemetry.start_span(
+            "llm", parent=self._parent_span, tool=self.tool, streamed=True,
+            prompt_chars=len(self.prompt), prompt_tokens=estimate_tokens(self.prompt)
+        )
+        error = None
+        try:
+            for chunk in self.llm.stream(self.prompt):
+                if not chunk:
+                    continue
+                if self.ttft_s is None:
+                    self.ttft_s = time.perf_counter() - started
+                    telemetry.record("llm.ttft_s", self.ttft_s, tool=self.tool)
+                self.text += chunk
+                yield chunk
+        except Exception as e:
+            error = e
+            if self.on_error is None:
+                raise
+            message = self.on_error(e)
+            self.text += message
+            yield message
+        finally:
+            self.total_s = time.perf_counter() - started
+            telemetry.record("llm.total_s", self.total_s, tool=self.tool)
+            llm_span.set(ttft_s=self.ttft_s, output_chars=len(self.text), output_tokens=estimate_tokens(self.text) if self.text else 0)
+            llm_span.end(error=error)
+
+
+def invoke_completion(llm, prompt, tool, **invoke_kwargs):
+    """Blocking counterpart of CompletionStream that records the same latency metrics.
+
+    `invoke_kwargs` go to `llm.invoke`, e.g. a `generation_config` asking Gemini for JSON.
+    """
+    started = time.perf_counter()
+    with telemetry.span("llm", tool=tool, streamed=False, prompt_chars=len(prompt), prompt_tokens=estimate_tokens(prompt)) as llm_span:
+        try:
+            response = llm.invoke(prompt, **invoke_kwargs)
+            llm_span.set(output_chars=len(response), output_tokens=estimate_tokens(response) if response else 0)
+            return response
+        finally:
+            elapsed = time.perf_counter() - started
+            # Without streaming the first token arrives with the last one
+            llm_span.set(ttft_s=elapsed)
+            telemetry.record("llm.ttft_s", elapsed, tool=tool)
+            telemetry.record("llm.total_s", elapsed, tool=tool)
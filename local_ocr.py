@@ -0,0 +1,107 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+
+import telemetry
+from ocr import OcrBackend
+
+# --- Local EasyOCR configuration ---
+EASYOCR_LANGUAGES = os.getenv("STUDY_AI_EASYOCR_LANGUAGES", "en").split(",")
+EASYOCR_WORKERS = int(os.getenv("STUDY_AI_EASYOCR_WORKERS", str(max(1, min(4, (os.cpu_count() or 2) // 2)))))
+EASYOCR_PAGES_PER_RANGE = int(os.getenv("STUDY_AI_EASYOCR_PAGES_PER_RANGE", "2"))
+EASYOCR_DPI = int(os.getenv("STUDY_AI_EASYOCR_DPI", "200"))  # Enough for 10pt text; higher mostly costs time
+EASYOCR_BATCH_SIZE = int(os.getenv("STUDY_AI_EASYOCR_BATCH_SIZE", "8"))  # Text lines recognized per forward pass
+
+_worker_reader = None
+
+
+def _init_worker(languages, torch_threads):
+    """Runs once per worker process: the EasyOCR models are loaded here and reused for every range."""
+    global _worker_reader
+    import torch
+    torch.set_num_threads(torch_threads)  # Workers share the cores instead of each spawning one thread per core
+    import easyocr
+    _worker_reader = easyocr.Reader(languages, gpu=False, verbose=False)
+
+
+def _recognize_pdf(pdf_bytes, dpi, batch_size):
+    """Rasterizes every page of a (page range) PDF with PyMuPDF and returns the text of each page."""
+    import fitz  # PyMuPDF
+    import numpy as np
+
+    texts = []
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as document:
+        for page in document:
+            pixmap = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+            image = np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.stride)[:, :pixmap.width]
+            # paragraph=True joins detected lines into reading-order paragraphs
+            paragraphs = _worker_reader.readtext(image, detail=0, paragraph=True, batch_size=batch_size)
+            texts.append("\n\n".join(paragraphs))
+    return texts
+
+
+class EasyOcrBackend(OcrBackend):
+    """OCR on this machine's CPU with EasyOCR: no upload, no quota, no per-page cost.
+
+    Page ranges are rasterized and recognized in a pool of worker processes that each
+    load the EasyOCR models once and keep them for the life of the server; the pool is
+    started on first use. Output is plain text (no markdown formatting, unlike Gemini).
+    """
+
+    name = "easyocr"
+    pages_per_range = EASYOCR_PAGES_PER_RANGE
+
+    def __init__(self, languages=EASYOCR_LANGUAGES, workers=EASYOCR_WORKERS, dpi=EASYOCR_DPI, batch_size=EASYOCR_BATCH_SIZE):
+        self.languages = list(languages)
+        self.max_workers = workers  # One dispatching thread per worker process keeps every process busy
+        self.dpi = dpi
+        self.batch_size = batch_size
+        self.cache_tag = f"easyocr-{'+'.join(self.languages)}-{dpi}dpi"
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                torch_threads = max(1, (os.cpu_count() or 1) // self.max_workers)
+                # Spawned workers: forking a process that runs Streamlit's or uvicorn's threads is unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=get_context("spawn"),
+                    initializer=_init_worker, initargs=(self.languages, torch_threads)
+                )
+            return self._executor
+
+    def ocr_range(self, page_range, display_name):
+        with telemetry.span("ocr.recognize", backend=self.name, pages=page_range.page_count) as recognize_span:
+            executor = self._pool()
+            try:
+                texts = executor.submit(_recognize_pdf, page_range.pdf_bytes, self.dpi, self.batch_size).result()
+            except BrokenProcessPool:
+                # A worker died (usually out of memory): the retry gets a fresh pool
+                with self._lock:
+                    if self._executor is executor:
+                        self._executor = None
+                raise
+            recognize_span.set(output_chars=sum(len(text) for text in texts))
+        return {page_range.first_page + offset: text.strip() for offset, text in enumerate(texts)}
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+_easyocr_backend = None
+_easyocr_backend_lock = threading.Lock()
+
+
+def get_easyocr_backend():
+    """Returns the process-wide EasyOCR backend, so its worker pool (and loaded models) are shared."""
+    global _easyocr_backend
+    with _easyocr_backend_lock:
+        if _easyocr_backend is None:
+            _easyocr_backend = EasyOcrBackend()
+        return _easyocr_backend
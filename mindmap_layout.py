@@ -0,0 +1,185 @@
+import math
+import re
+from collections import deque
+
+import numpy as np
+
+# --- Mindmap layout configuration (JSON Canvas pixels) ---
+CHAR_WIDTH = 8  # Average glyph width of Obsidian's default canvas font
+LINE_HEIGHT = 26
+NODE_PADDING_X = 24
+NODE_PADDING_Y = 20
+NODE_MIN_WIDTH = 140
+NODE_MAX_WIDTH = 320
+CENTER_MIN_WIDTH = 220
+NODE_GAP = 40  # Free space kept between any two node boxes
+RING_SPACING = 260  # Distance between depth rings of the radial layout
+FORCE_ITERATIONS = 120
+OVERLAP_PASSES = 200
+
+
+def node_size(text, minimum_width=NODE_MIN_WIDTH):
+    """(width, height) of a text node: wide enough for short labels on one line, wrapped beyond NODE_MAX_WIDTH."""
+    text_width = len(text) * CHAR_WIDTH
+    width = min(NODE_MAX_WIDTH, max(minimum_width, text_width + NODE_PADDING_X))
+    # Word wrapping wastes part of each line, hence the 10% margin
+    lines = max(1, math.ceil(text_width * 1.1 / (width - NODE_PADDING_X)))
+    return width, lines * LINE_HEIGHT + NODE_PADDING_Y
+
+
+def _spanning_tree(node_count, edges):
+    """BFS tree from node 0 over the undirected edges: (parent, depth, children) per node."""
+    neighbours = [[] for _ in range(node_count)]
+    for source, target, _ in edges:
+        neighbours[source].append(target)
+        neighbours[target].append(source)
+    parent, depth = [None] * node_count, [0] * node_count
+    children = [[] for _ in range(node_count)]
+    seen, queue = {0}, deque([0])
+    while queue:
+        node = queue.popleft()
+        for neighbour in neighbours[node]:
+            if neighbour not in seen:
+                seen.add(neighbour)
+                parent[neighbour], depth[neighbour] = node, depth[node] + 1
+                children[node].append(neighbour)
+                queue.append(neighbour)
+    for node in range(1, node_count):
+        if node not in seen:  # Callers connect every node, but never lose one if they didn't
+            parent[node], depth[node] = 0, 1
+            children[0].append(node)
+    return parent, depth, children
+
+
+def _radial_positions(node_count, edges, sizes):
+    """Radial tree layout: depth d on ring d, each subtree in an angular sector sized by its leaf count."""
+    _, depth, children = _spanning_tree(node_count, edges)
+
+    leaves = [0] * node_count
+    for node in sorted(range(node_count), key=lambda node: -depth[node]):
+        leaves[node] = max(1, sum(leaves[child] for child in children[node]))
+
+    # A ring must be long enough for the boxes on it, or neighbours start out on top of each other
+    ring_count = max(depth)
+    radii = [0.0]
+    for ring in range(1, ring_count + 1):
+        ring_nodes = [node for node in range(node_count) if depth[node] == ring]
+        needed = sum(math.hypot(*sizes[node]) + NODE_GAP for node in ring_nodes) / (2 * math.pi)
+        radii.append(max(radii[-1] + RING_SPACING, needed))
+
+    angles = np.zeros(node_count)
+    stack = [(0, 0.0, 2 * math.pi)]
+    while stack:
+        node, start, span = stack.pop()
+        angles[node] = start + span / 2
+        offset = start
+        for child in children[node]:
+            child_span = span * leaves[child] / leaves[node]
+            stack.append((child, offset, child_span))
+            offset += child_span
+
+    radius = np.array([radii[depth[node]] for node in range(node_count)])
+    return np.column_stack((radius * np.cos(angles), radius * np.sin(angles)))
+
+
+def _relax(positions, sizes, edges, iterations=FORCE_ITERATIONS):
+    """Force-directed refinement: linked nodes attract, crowded nodes repel; node 0 stays at the origin."""
+    if len(positions) < 3:
+        return positions
+    radii = np.hypot(sizes[:, 0], sizes[:, 1]) / 2
+    comfortable = radii[:, None] + radii[None, :] + NODE_GAP  # Distance at which two boxes stop pushing
+    sources = np.array([source for source, _, _ in edges], dtype=int)
+    targets = np.array([target for _, target, _ in edges], dtype=int)
+    rest_length = comfortable[sources, targets] + RING_SPACING / 2
+    step = RING_SPACING / 4
+    for _ in range(iterations):
+        delta = positions[:, None, :] - positions[None, :, :]
+        distance = np.linalg.norm(delta, axis=2)
+        np.fill_diagonal(distance, np.inf)
+        distance = np.maximum(distance, 1.0)
+        push = np.maximum(0.0, 1.5 * comfortable - distance) / (1.5 * comfortable)  # Short range: only crowded pairs push
+        force = (delta / distance[:, :, None] * push[:, :, None]).sum(axis=1)
+        if len(sources):
+            link = positions[targets] - positions[sources]
+            length = np.maximum(np.linalg.norm(link, axis=1), 1.0)
+            pull = (link / length[:, None]) * ((length - rest_length) / rest_length)[:, None]
+            np.add.at(force, sources, pull)
+            np.add.at(force, targets, -pull)
+        force[0] = 0
+        norms = np.maximum(np.linalg.norm(force, axis=1), 1e-9)
+        positions = positions + force * (np.minimum(norms * step, step) / norms)[:, None]  # At most `step` px per iteration
+        step *= 0.96  # Cooling: big moves first, then settle
+    return positions
+
+
+def _remove_overlaps(positions, sizes, passes=OVERLAP_PASSES):
+    """Pushes apart every pair of boxes closer than NODE_GAP, along the axis where they overlap least."""
+    positions = positions.copy()
+    node_count = len(positions)
+    order = np.arange(node_count)
+    tie_break = np.where(order[:, None] < order[None, :], -1.0, 1.0)  # Coincident centres still move apart
+    for _ in range(passes):
+        delta = positions[:, None, :] - positions[None, :, :]
+        overlap = (sizes[:, None, :] + sizes[None, :, :]) / 2 + NODE_GAP - np.abs(delta)
+        overlapping = (overlap[:, :, 0] > 0) & (overlap[:, :, 1] > 0)
+        np.fill_diagonal(overlapping, False)
+        if not overlapping.any():
+            break
+        along_x = overlap[:, :, 0] < overlap[:, :, 1]
+        direction = np.where(delta == 0, tie_break[:, :, None], np.sign(delta))
+        shift = np.zeros_like(delta)
+        shift[:, :, 0] = np.where(overlapping & along_x, overlap[:, :, 0] / 2 + 1, 0) * direction[:, :, 0]
+        shift[:, :, 1] = np.where(overlapping & ~along_x, overlap[:, :, 1] / 2 + 1, 0) * direction[:, :, 1]
+        positions += shift.sum(axis=1)
+    return positions
+
+
+def _node_id(index, text):
+    slug = re.sub(r"[^a-z0-9]+", "_", text.lower()).strip("_")[:40]
+    return f"node_{index}_{slug}" if slug else f"node_{index}"
+
+
+def _sides(from_center, to_center):
+    dx, dy = to_center - from_center
+    if abs(dx) >= abs(dy):
+        return ("right", "left") if dx >= 0 else ("left", "right")
+    return ("bottom", "top") if dy >= 0 else ("top", "bottom")  # Canvas y grows downwards
+
+
+def layout_mindmap(central_topic, topics, edges):
+    """Lays out a concept graph as a JSON Canvas dict ({"nodes", "edges"}), deterministically.
+
+    Node 0 is `central_topic`, node i is `topics[i - 1]`; `edges` are (from, to, label)
+    index triples. Sizes follow the text length, the positions come from a radial tree
+    refined by a vectorized force simulation, and a final pass separates any boxes that
+    still overlap.
+    """
+    texts = [central_topic] + list(topics)
+    sizes = np.array(
+        [node_size(text, CENTER_MIN_WIDTH if index == 0 else NODE_MIN_WIDTH) for index, text in enumerate(texts)], dtype=float
+    )
+    positions = _radial_positions(len(texts), edges, sizes)
+    positions = _relax(positions, sizes, edges)
+    positions = _remove_overlaps(positions, sizes)
+    positions -= positions[0]  # Central topic at the origin
+
+    ids = [_node_id(index, text) for index, text in enumerate(texts)]
+    nodes = []
+    for index, text in enumerate(texts):
+        width, height = (int(value) for value in sizes[index])
+        node = {
+            "id": ids[index], "type": "text", "text": text,
+            "x": int(round(positions[index, 0] - width / 2)), "y": int(round(positions[index, 1] - height / 2)),
+            "width": width, "height": height,
+        }
+        if index == 0:
+            node["color"] = "4"  # Canvas preset colour, so the central topic stands out
+        nodes.append(node)
+    canvas_edges = []
+    for number, (source, target, label) in enumerate(edges):
+        from_side, to_side = _sides(positions[source], positions[target])
+        edge = {"id": f"edge_{number}", "fromNode": ids[source], "fromSide": from_side, "toNode": ids[target], "toSide": to_side}
+        if label:
+            edge["label"] = label
+        canvas_edges.append(edge)
+    return {"nodes": nodes, "edges": canvas_edges}
@@ -0,0 +1,104 @@
+import os
+import re
+import zlib
+
+import numpy as np
+
+# --- Near-duplicate detection configuration ---
+MINHASH_PERMUTATIONS = 64
+# 16 bands of 4 rows: a pair with Jaccard similarity s shares a band with probability 1 - (1 - s**4)**16,
+# about 0.64 at 0.5, 0.89 at 0.6 and 0.998 at 0.75 (exact repeats of the term or question are always caught)
+LSH_BANDS = 16
+SHINGLE_WORDS = 2
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("STUDY_AI_NEAR_DUPLICATE_THRESHOLD", "0.6"))  # Estimated Jaccard similarity
+_HASH_PRIME = 4294967311  # First prime above 2**32: the shingle hashes are 32-bit CRCs
+
+_rng = np.random.default_rng(20240611)  # Fixed seed: signatures must not change between runs
+_PERMUTATION_A = _rng.integers(1, 1 << 31, MINHASH_PERMUTATIONS, dtype=np.uint64)
+_PERMUTATION_B = _rng.integers(0, 1 << 31, MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+_LIST_MARKER = re.compile(r"^(?:[-*•]\s+|\d+[.)]\s+)")
+_QUOTES = "'\"`"
+
+
+def _clean_item(lines):
+    item = "\n".join(lines).strip()
+    if len(item) > 1 and item[0] in _QUOTES and item[-1] == item[0]:
+        item = item[1:-1].strip()
+    front, _, back = item.partition(">>")
+    return f"{front.strip()}>>{back.strip()}" if front.strip() and back.strip() else None
+
+
+def split_items(text):
+    """The 'front>>back' items of a generated list, without bullets, numbers or quotes around them.
+
+    An item starts at a line containing '>>'; the lines after it without '>>' (a multi-line
+    answer, blank lines between paragraphs) belong to it until the next item or a markdown
+    heading. Text before the first item is dropped.
+    """
+    items, current = [], None
+    for line in text.splitlines() + ["#"]:  # The final heading closes the last item
+        stripped = line.strip()
+        if ">>" in stripped or stripped.startswith("#"):
+            if current:
+                item = _clean_item(current)
+                if item:
+                    items.append(item)
+            current = [_LIST_MARKER.sub("", stripped)] if ">>" in stripped else None
+        elif current is not None:
+            current.append(line.rstrip())
+    return items
+
+
+def _words(text):
+    return re.findall(r"\w+", text.lower())
+
+
+def _shingle_hashes(text):
+    words = _words(text)
+    if len(words) <= SHINGLE_WORDS:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[start:start + SHINGLE_WORDS]) for start in range(len(words) - SHINGLE_WORDS + 1)}
+    return np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+
+
+def minhash_signatures(texts):
+    """One MinHash signature (MINHASH_PERMUTATIONS values) per text, over its word shingles."""
+    signatures = np.empty((len(texts), MINHASH_PERMUTATIONS), dtype=np.uint64)
+    for row, text in enumerate(texts):
+        hashes = _shingle_hashes(text)
+        # a * h + b stays below 2**64 because a, b < 2**31 and h < 2**32
+        signatures[row] = ((hashes[:, None] * _PERMUTATION_A + _PERMUTATION_B) % _HASH_PRIME).min(axis=0)
+    return signatures
+
+
+def remove_near_duplicates(items, threshold=NEAR_DUPLICATE_THRESHOLD):
+    """Drops every 'front>>back' item that repeats an earlier one; returns (kept items, removed count).
+
+    An item is a repeat when its front (the term or question) is the same, ignoring case and
+    punctuation, or when the estimated Jaccard similarity of its word shingles with a kept item
+    reaches `threshold`. Candidates come from LSH banding of the MinHash signatures, so each
+    item is compared with a handful of others instead of all of them. The first occurrence
+    wins, which keeps the document order.
+    """
+    if not items:
+        return [], 0
+    signatures = minhash_signatures(items)
+    rows = MINHASH_PERMUTATIONS // LSH_BANDS
+    buckets = [{} for _ in range(LSH_BANDS)]
+    seen_fronts = set()
+    kept = []
+    for index, item in enumerate(items):
+        front = " ".join(_words(item.partition(">>")[0]))
+        if front in seen_fronts:
+            continue
+        bands = [signatures[index, band * rows:(band + 1) * rows].tobytes() for band in range(LSH_BANDS)]
+        candidates = {other for band, key in enumerate(bands) for other in buckets[band].get(key, ())}
+        if any(np.mean(signatures[index] == signatures[other]) >= threshold for other in candidates):
+            continue
+        seen_fronts.add(front)
+        for band, key in enumerate(bands):
+            buckets[band].setdefault(key, []).append(index)
+        kept.append(item)
+    return kept, len(items) - len(kept)
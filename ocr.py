@@ -0,0 +1,331 @@
+import contextvars
+import hashlib
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import telemetry
+from disk_cache import DiskLRUCache
+
+# --- OCR configuration ---
+OCR_MODEL_NAME = "gemini-3-flash-preview"
+OCR_PAGES_PER_RANGE = int(os.getenv("STUDY_AI_OCR_PAGES_PER_RANGE", "5"))
+OCR_MAX_WORKERS = int(os.getenv("STUDY_AI_OCR_WORKERS", "4"))
+OCR_MAX_ATTEMPTS = int(os.getenv("STUDY_AI_OCR_MAX_ATTEMPTS", "3"))
+OCR_RANGE_TIMEOUT_S = int(os.getenv("STUDY_AI_OCR_RANGE_TIMEOUT_S", "300"))
+PAGE_BREAK = "<<<PAGE_BREAK>>>"
+OCR_CACHE_FILE = "ocr.sqlite3"
+OCR_CACHE_MAX_BYTES = int(os.getenv("STUDY_AI_OCR_CACHE_MAX_MB", "256")) * 1024 * 1024
+OCR_CACHE_VERSION = "v1"  # Bump when the OCR prompt changes so old results aren't reused
+
+OCR_BACKEND_LABELS = {"gemini": "Gemini (cloud)", "easyocr": "EasyOCR (local CPU)"}
+
+OCR_INSTRUCTIONS = [
+    "Please perform OCR on the provided PDF document and extract all text content and format it in markdown, with bold headings and leave lines wherever required.",
+    "Focus solely on extracting the text as accurately as possible from the document and formatting it properly.",
+]
+
+
+class PageRange:
+    """A contiguous slice of the source PDF (1-based, inclusive page numbers) as its own PDF file."""
+
+    def __init__(self, first_page, last_page, pdf_bytes):
+        self.first_page = first_page
+        self.last_page = last_page
+        self.pdf_bytes = pdf_bytes
+
+    @property
+    def page_count(self):
+        return self.last_page - self.first_page + 1
+
+    @property
+    def label(self):
+        if self.first_page == self.last_page:
+            return f"page {self.first_page}"
+        return f"pages {self.first_page}-{self.last_page}"
+
+
+class OcrResult:
+    def __init__(self, text, page_texts, failed_ranges):
+        self.text = text
+        self.page_texts = page_texts  # page number -> text (a multi-page key is "first-last" if pages couldn't be separated)
+        self.failed_ranges = failed_ranges
+
+
+_ocr_cache = None
+_ocr_cache_lock = threading.Lock()
+
+
+def get_ocr_cache():
+    """Returns the process-wide OCR result cache."""
+    global _ocr_cache
+    with _ocr_cache_lock:
+        if _ocr_cache is None:
+            _ocr_cache = DiskLRUCache(OCR_CACHE_FILE, OCR_CACHE_MAX_BYTES)
+        return _ocr_cache
+
+
+def document_cache_key(pdf_bytes, cache_tag=OCR_MODEL_NAME):
+    return f"doc:{cache_tag}:{OCR_CACHE_VERSION}:{hashlib.sha256(pdf_bytes).hexdigest()}"
+
+
+def page_cache_key(page, cache_tag=OCR_MODEL_NAME):
+    """Fingerprints a pypdf page by its content stream, images and geometry.
+
+    The same worksheet page embedded in two different PDFs gets the same key.
+    `cache_tag` names the OCR engine, so backends never serve each other's text.
+    """
+    digest = hashlib.sha256()
+    digest.update(repr([float(value) for value in page.mediabox]).encode())
+    digest.update(str(page.get("/Rotate", 0)).encode())
+    contents = page.get_contents()
+    if contents is not None:
+        digest.update(contents.get_data())
+    resources = page.get("/Resources")
+    xobjects = resources.get_object().get("/XObject") if resources is not None else None
+    if xobjects is not None:
+        xobjects = xobjects.get_object()
+        for name in sorted(xobjects):
+            digest.update(name.encode())
+            digest.update(getattr(xobjects[name].get_object(), "_data", b"") or b"")
+    return f"page:{cache_tag}:{OCR_CACHE_VERSION}:{digest.hexdigest()}"
+
+
+def get_cached_document_ocr(pdf_bytes, cache=None, cache_tag=OCR_MODEL_NAME):
+    """Returns the cached OCR text of a whole PDF, or None."""
+    cached = (cache or get_ocr_cache()).get(document_cache_key(pdf_bytes, cache_tag))
+    return cached.decode("utf-8") if cached is not None else None
+
+
+def store_document_ocr(pdf_bytes, text, cache=None, cache_tag=OCR_MODEL_NAME):
+    (cache or get_ocr_cache()).set(document_cache_key(pdf_bytes, cache_tag), text.encode("utf-8"))
+
+
+def split_pdf_ranges(pdf_bytes, pages_per_range=OCR_PAGES_PER_RANGE, page_numbers=None, reader=None):
+    """Splits a PDF into PageRange objects of at most `pages_per_range` consecutive pages.
+
+    `page_numbers` (1-based) restricts the split to those pages, e.g. the ones not found in the cache.
+    """
+    from pypdf import PdfReader, PdfWriter
+
+    reader = reader or PdfReader(io.BytesIO(pdf_bytes))
+    if page_numbers is None:
+        page_numbers = range(1, len(reader.pages) + 1)
+
+    # Group consecutive page numbers, capped at pages_per_range pages per group
+    groups = []
+    for page_number in sorted(page_numbers):
+        if groups and page_number == groups[-1][-1] + 1 and len(groups[-1]) < pages_per_range:
+            groups[-1].append(page_number)
+        else:
+            groups.append([page_number])
+
+    ranges = []
+    for group in groups:
+        writer = PdfWriter()
+        for page_number in group:
+            writer.add_page(reader.pages[page_number - 1])
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        ranges.append(PageRange(group[0], group[-1], buffer.getvalue()))
+    return ranges
+
+
+def _generate_from_pdf(client, pdf_bytes, display_name, instructions, timeout):
+    """Uploads one PDF, runs the OCR prompt on it and always deletes the uploaded file."""
+    with telemetry.span("ocr.upload", bytes=len(pdf_bytes)):
+        uploaded_file = client.upload_file(path=io.BytesIO(pdf_bytes), display_name=display_name, mime_type="application/pdf")
+    try:
+        with telemetry.span("ocr.generate", model=OCR_MODEL_NAME) as generate_span:
+            model_ocr = client.GenerativeModel(model_name=OCR_MODEL_NAME)
+            response = model_ocr.generate_content(instructions + [uploaded_file], request_options={"timeout": timeout})
+            generate_span.set(output_chars=len(response.text))
+        return response.text
+    finally:
+        try:
+            with telemetry.span("ocr.delete"):
+                client.delete_file(uploaded_file.name)
+        except Exception:
+            pass
+
+
+def ocr_page_range(client, page_range, display_name):
+    """OCRs one PageRange and returns {page_number: text}."""
+    instructions = OCR_INSTRUCTIONS + [
+        f"This PDF contains {page_range.page_count} page(s), {page_range.label} of the original document.",
+        f"Output the text of each page in order and put a line containing only {PAGE_BREAK} between consecutive pages. Do not add any other page headers.",
+    ]
+    text = _generate_from_pdf(
+        client, page_range.pdf_bytes, f"{display_name} ({page_range.label})", instructions, OCR_RANGE_TIMEOUT_S
+    )
+    parts = [part.strip() for part in text.split(PAGE_BREAK)]
+    if len(parts) == page_range.page_count:
+        return {page_range.first_page + offset: part for offset, part in enumerate(parts)}
+    # The model didn't separate pages reliably: keep the text, labelled with the whole range
+    return {f"{page_range.first_page}-{page_range.last_page}": text.replace(PAGE_BREAK, "").strip()}
+
+
+class OcrBackend:
+    """An OCR engine that perform_parallel_ocr can drive.
+
+    `ocr_range(page_range, display_name)` returns {page_number: text} for one PageRange
+    (or {"first-last": text} when pages can't be told apart) and may raise to have the
+    range retried. `pages_per_range` and `max_workers` are the engine's preferred
+    batch size and concurrency; `cache_tag` keys its results in the OCR cache.
+    """
+
+    name = None
+    cache_tag = None
+    pages_per_range = OCR_PAGES_PER_RANGE
+    max_workers = OCR_MAX_WORKERS
+
+    def ocr_range(self, page_range, display_name):
+        raise NotImplementedError
+
+
+class GeminiOcrBackend(OcrBackend):
+    """Uploads each page range as its own PDF and has the Gemini OCR model transcribe it."""
+
+    name = "gemini"
+    cache_tag = OCR_MODEL_NAME
+
+    def __init__(self, client=None):
+        self.client = client  # The configured google.generativeai module (or a stand-in)
+
+    def ocr_range(self, page_range, display_name):
+        if self.client is None:
+            import google.generativeai
+            self.client = google.generativeai
+        return ocr_page_range(self.client, page_range, display_name)
+
+
+def _missing_modules(modules):
+    import importlib.util
+    return [module for module in modules if importlib.util.find_spec(module) is None]
+
+
+def ocr_backend_names():
+    """Backends that can run in this environment, cloud first."""
+    names = [GeminiOcrBackend.name]
+    if not _missing_modules(("easyocr", "fitz", "torch")):
+        names.append("easyocr")
+    return names
+
+
+def get_ocr_backend(name, client=None):
+    """The backend called `name`; `client` is the google.generativeai module the Gemini backend uses."""
+    if name == "easyocr":
+        missing = _missing_modules(("easyocr", "fitz", "torch"))
+        if missing:  # Fail here, not later in a worker process
+            raise ImportError(f"the local OCR backend needs {', '.join(missing)}")
+        from local_ocr import get_easyocr_backend
+        return get_easyocr_backend()
+    if name != GeminiOcrBackend.name:
+        raise ValueError(f"Unknown OCR backend: {name}")
+    return GeminiOcrBackend(client)
+
+
+def as_ocr_backend(client):
+    """Accepts an OcrBackend, or a google.generativeai-like client (or None) for the Gemini backend."""
+    return client if isinstance(client, OcrBackend) else GeminiOcrBackend(client)
+
+
+def _page_sort_key(page_key):
+    return int(str(page_key).split("-")[0])
+
+
+def stitch_pages(page_texts):
+    """Joins per-page OCR text in page order with '--- Page X ---' markers."""
+    sections = []
+    for page_key in sorted(page_texts, key=_page_sort_key):
+        marker = f"--- Pages {page_key} ---" if isinstance(page_key, str) else f"--- Page {page_key} ---"
+        sections.append(f"{marker}\n\n{page_texts[page_key]}")
+    return "\n\n".join(sections)
+
+
+def perform_parallel_ocr(pdf_bytes, display_name, client=None, pages_per_range=None,
+                         max_workers=None, max_attempts=OCR_MAX_ATTEMPTS, progress_callback=None,
+                         cache=None, use_cache=True, page_numbers=None):
+    """OCRs a PDF as concurrent page ranges, retrying only the ranges that failed.
+
+    `client` is an OcrBackend, or anything exposing the `google.generativeai` file/generate
+    API (upload_file, GenerativeModel, delete_file) for the Gemini backend. Range size and
+    concurrency default to the backend's own. `progress_callback(done, total)` is
+    called from the calling thread as ranges finish. Results are cached per document
+    and per page; only pages missing from the cache are sent to the API.
+    `page_numbers` (1-based) OCRs only those pages, e.g. the scanned pages of an
+    otherwise digital PDF; the whole-document cache is then neither read nor written.
+    """
+    from pypdf import PdfReader
+
+    backend = as_ocr_backend(client)
+    pages_per_range = pages_per_range or backend.pages_per_range
+    max_workers = max_workers or backend.max_workers
+    cache = (cache or get_ocr_cache()) if use_cache else None
+    whole_document = page_numbers is None
+    if cache is not None and whole_document:
+        cached_text = get_cached_document_ocr(pdf_bytes, cache, backend.cache_tag)
+        if cached_text is not None:
+            return OcrResult(cached_text, {}, [])
+
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    if whole_document:
+        page_numbers = range(1, len(reader.pages) + 1)
+    page_keys = {page_number: page_cache_key(reader.pages[page_number - 1], backend.cache_tag) for page_number in page_numbers}
+    page_texts = {}
+    if cache is not None:
+        found = cache.get_many(page_keys.values())
+        for page_number, key in page_keys.items():
+            if key in found:
+                page_texts[page_number] = found[key].decode("utf-8")
+
+    missing_pages = [page_number for page_number in page_keys if page_number not in page_texts]
+    ranges = split_pdf_ranges(pdf_bytes, pages_per_range, page_numbers=missing_pages, reader=reader)
+    pending = ranges
+    done = 0
+    errors = {}
+    for attempt in range(max_attempts):
+        if not pending:
+            break
+        if attempt:
+            time.sleep(min(30, 2 ** attempt))  # Give a struggling API a moment before retrying
+        failed = []
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending)))) as executor:
+            # Each range runs in a copy of this context, so its spans nest under the caller's
+            futures = {
+                executor.submit(contextvars.copy_context().run, backend.ocr_range, page_range, display_name): page_range
+                for page_range in pending
+            }
+            for future in as_completed(futures):
+                page_range = futures[future]
+                try:
+                    range_texts = future.result()
+                    page_texts.update(range_texts)
+                    if cache is not None:
+                        # Only cleanly separated pages can be reused on their own
+                        cache.set_many({page_keys[key]: text.encode("utf-8") for key, text in range_texts.items() if isinstance(key, int)})
+                    done += 1
+                    errors.pop(page_range.first_page, None)
+                except Exception as e:
+                    errors[page_range.first_page] = e
+                    failed.append(page_range)
+                    continue
+                if progress_callback:
+                    try:
+                        progress_callback(done, len(ranges))
+                    except BaseException:
+                        for other in futures:  # The caller gave up (e.g. a cancelled job): don't start queued ranges
+                            other.cancel()
+                        raise
+        pending = failed
+
+    for page_range in pending:
+        page_texts[f"{page_range.first_page}-{page_range.last_page}" if page_range.page_count > 1 else page_range.first_page] = (
+            f"[OCR failed for {page_range.label}: {errors.get(page_range.first_page)}]"
+        )
+    text = stitch_pages(page_texts)
+    if cache is not None and not pending and whole_document:
+        store_document_ocr(pdf_bytes, text, cache, backend.cache_tag)
+    return OcrResult(text, page_texts, pending)
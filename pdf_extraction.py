@@ -0,0 +1,172 @@
+import io
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context, shared_memory
+
+# --- PDF text extraction configuration ---
+PDF_EXTRACT_WORKERS = int(os.getenv("STUDY_AI_PDF_WORKERS", str(min(8, os.cpu_count() or 1))))
+PDF_PAGES_PER_TASK = int(os.getenv("STUDY_AI_PDF_PAGES_PER_TASK", "16"))
+PDF_PARALLEL_MIN_PAGES = 48  # Below this, starting worker processes costs more than it saves
+PDF_TASKS_IN_FLIGHT_PER_WORKER = 2  # Caps how many extracted pages wait in memory for the consumer
+PDF_SCANNED_PAGE_MAX_CHARS = int(os.getenv("STUDY_AI_SCANNED_PAGE_MAX_CHARS", "50"))  # Fewer characters than this, plus an image: scanned
+PDF_IMAGE_SEARCH_DEPTH = 3  # How deep to follow form XObjects nested in each other when looking for images
+
+_worker_reader = None
+_worker_pdf_name = None
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _reader_for(shm_name, size):
+    """Runs in a worker process: ranges of the same PDF reuse one reader over a copy of the shared bytes."""
+    global _worker_reader, _worker_pdf_name
+    if _worker_pdf_name != shm_name:
+        from pypdf import PdfReader
+        block = shared_memory.SharedMemory(name=shm_name)  # Spawned workers share the parent's resource tracker
+        try:
+            pdf_bytes = bytes(block.buf[:size])
+        finally:
+            block.close()
+        _worker_reader, _worker_pdf_name = PdfReader(io.BytesIO(pdf_bytes)), shm_name
+    return _worker_reader
+
+
+def _get_pool():
+    """The process-wide extraction pool, started on first use and kept for the life of the server."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned workers: forking a process that runs Streamlit's or uvicorn's threads is unsafe
+            _pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS, mp_context=get_context("spawn"))
+        return _pool
+
+
+def _discard_pool(executor):
+    """Drops a broken pool (a worker died) so the next PDF gets a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is executor:
+            _pool = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _has_images(resources, depth=PDF_IMAGE_SEARCH_DEPTH):
+    """Whether a page (or form) draws an image XObject; reads the resource dictionaries, never the pixels."""
+    xobjects = resources.get_object().get("/XObject") if resources else None
+    if not xobjects:
+        return False
+    for xobject in xobjects.get_object().values():
+        xobject = xobject.get_object()
+        subtype = xobject.get("/Subtype")
+        if subtype == "/Image":
+            return True
+        if subtype == "/Form" and depth > 0 and _has_images(xobject.get("/Resources"), depth - 1):
+            return True
+    return False
+
+
+def is_scanned_page(text, has_images):
+    """A page whose text layer is (nearly) empty but which shows an image is most likely a scan.
+
+    Blank pages have no image and are left alone, so OCR is only paid for pages that can yield text.
+    """
+    return has_images and len(text.strip()) < PDF_SCANNED_PAGE_MAX_CHARS
+
+
+def _extract_range(first_page, last_page, reader=None, shm_name=None, size=0):
+    """(text, has_images) of pages `first_page`..`last_page` (0-based, exclusive end); text as in PyPDFLoader's plain mode.
+
+    In a worker process the PDF is read from the shared memory block `shm_name` (`size` bytes).
+    """
+    reader = reader or _reader_for(shm_name, size)
+    results = []
+    for number in range(first_page, last_page):
+        page = reader.pages[number]
+        text = page.extract_text() or ""
+        try:
+            has_images = _has_images(page.get("/Resources"))
+        except Exception:  # A broken resource tree only costs us the classification
+            has_images = False
+        results.append((text, has_images))
+    return results
+
+
+def _page_label(reader, number):
+    try:
+        return reader.page_labels[number]
+    except Exception:  # Malformed /PageLabels trees are common; the printed number is only cosmetic
+        return str(number + 1)
+
+
+def iter_pdf_pages(pdf_bytes, source_name, workers=PDF_EXTRACT_WORKERS, pages_per_task=PDF_PAGES_PER_TASK):
+    """Yields one LangChain Document per page of an in-memory PDF, in page order, as soon as it is extracted.
+
+    Large PDFs are cut into ranges of `pages_per_task` pages extracted by the shared process
+    pool (pypdf is pure Python, so threads would not use more than one core). The PDF bytes
+    are placed once in a shared memory block that each worker reads when it starts on this
+    PDF, instead of being pickled into every task or written to disk. At most
+    `PDF_TASKS_IN_FLIGHT_PER_WORKER` ranges per worker are queued or waiting to be consumed,
+    which bounds memory however long the document is. Page metadata matches PyPDFLoader's
+    (`page` is 0-based), so citations look the same as before; pages that look scanned
+    (see `is_scanned_page`) are flagged with `scanned=True` for targeted OCR.
+    """
+    from langchain_core.documents import Document
+    from pypdf import PdfReader
+
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    page_count = len(reader.pages)
+
+    def page_document(number, extracted):
+        text, has_images = extracted
+        metadata = {"source": source_name, "page": number, "page_label": _page_label(reader, number), "total_pages": page_count}
+        if is_scanned_page(text, has_images):
+            metadata["scanned"] = True
+        return Document(page_content=text, metadata=metadata)
+
+    if workers <= 1 or page_count < PDF_PARALLEL_MIN_PAGES:
+        for number in range(page_count):
+            yield page_document(number, _extract_range(number, number + 1, reader)[0])
+        return
+
+    ranges = deque((first, min(first + pages_per_task, page_count)) for first in range(0, page_count, pages_per_task))
+    in_flight = deque()
+    block = None
+    try:
+        block = shared_memory.SharedMemory(create=True, size=len(pdf_bytes))
+        block.buf[:len(pdf_bytes)] = pdf_bytes
+        executor = _get_pool()
+
+        def submit_next():
+            first, last = ranges.popleft()
+            in_flight.append((first, executor.submit(_extract_range, first, last, shm_name=block.name, size=len(pdf_bytes))))
+
+        for _ in range(min(len(ranges), workers * PDF_TASKS_IN_FLIGHT_PER_WORKER)):
+            submit_next()
+        while in_flight:
+            first, future = in_flight.popleft()
+            try:
+                extracted_pages = future.result()
+            except BrokenProcessPool:
+                _discard_pool(executor)
+                raise
+            if ranges:
+                submit_next()
+            for offset, extracted in enumerate(extracted_pages):
+                yield page_document(first + offset, extracted)
+    finally:
+        # Also reached when the consumer stops early (a cancelled job): queued ranges are dropped
+        for _, future in in_flight:
+            future.cancel()
+        for _, future in in_flight:
+            if not future.cancelled():
+                try:
+                    future.exception()  # Wait for ranges already running: they may still be reading the block
+                except BaseException:
+                    pass
+        if block is not None:
+            block.close()
+            block.unlink()
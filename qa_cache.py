@@ -0,0 +1,110 @@
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from disk_cache import DiskLRUCache
+from embedding_cache import decode_vector, encode_vector
+
+# --- Chat answer cache configuration ---
+ANSWER_CACHE_FILE = "answers.sqlite3"
+ANSWER_CACHE_MAX_BYTES = int(os.getenv("STUDY_AI_ANSWER_CACHE_MAX_MB", "256")) * 1024 * 1024
+ANSWER_CACHE_TTL_S = int(os.getenv("STUDY_AI_ANSWER_CACHE_TTL_HOURS", "168")) * 3600
+ANSWER_SIMILARITY_THRESHOLD = float(os.getenv("STUDY_AI_ANSWER_SIMILARITY", "0.95"))  # Cosine similarity for a near-duplicate hit
+MAX_QUESTIONS_PER_DOCUMENT = 200  # Size of the per-document list scanned for near-duplicates
+
+
+def normalize_question(question):
+    """Lowercases, collapses whitespace and drops trailing punctuation: 'What is ATP ?' -> 'what is atp'."""
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip(" ?!.")
+
+
+class AnswerCache:
+    """First-turn chat answers per document, found by exact or near-duplicate question.
+
+    Only questions asked without prior chat history may be stored or served: a follow-up's
+    answer depends on the conversation, not just on the question text.
+    """
+
+    def __init__(self, store, similarity_threshold=ANSWER_SIMILARITY_THRESHOLD, ttl_seconds=ANSWER_CACHE_TTL_S):
+        self.store = store
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+
+    def _answer_key(self, document_hash, normalized):
+        return f"answer:{document_hash}:{hashlib.sha256(normalized.encode('utf-8')).hexdigest()}"
+
+    def _index_key(self, document_hash):
+        return f"questions:{document_hash}"
+
+    def _load(self, key):
+        raw = self.store.get(key)
+        if raw is None:
+            return None
+        entry = json.loads(raw.decode("utf-8"))
+        if entry["created"] < time.time() - self.ttl_seconds:
+            return None
+        return entry
+
+    def has_entries(self, document_hash):
+        return self.store.get(self._index_key(document_hash)) is not None
+
+    def lookup(self, document_hash, question, embed_query=None):
+        """Returns (entry, similarity) for a cached answer, or (None, None).
+
+        Tries the exact normalized question first; if `embed_query` is given, falls back
+        to the most similar earlier question above the similarity threshold.
+        """
+        normalized = normalize_question(question)
+        entry = self._load(self._answer_key(document_hash, normalized))
+        if entry is not None:
+            return entry, 1.0
+        if embed_query is None or not self.has_entries(document_hash):
+            return None, None
+
+        import numpy as np
+
+        index = json.loads(self.store.get(self._index_key(document_hash)).decode("utf-8"))
+        if not index:
+            return None, None
+        query_vector = np.asarray(embed_query(question), dtype=np.float32)
+        matrix = np.stack([np.asarray(decode_vector(base64.b64decode(item["embedding"])), dtype=np.float32) for item in index])
+        similarities = matrix @ query_vector / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query_vector) + 1e-9)
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            return None, None
+        entry = self._load(index[best]["key"])
+        return (entry, float(similarities[best])) if entry is not None else (None, None)
+
+    def add(self, document_hash, question, answer, sources, embedding=None):
+        """Stores a first-turn answer. `sources` is a list of {"page_content", "metadata"} dicts."""
+        normalized = normalize_question(question)
+        key = self._answer_key(document_hash, normalized)
+        entry = {"question": question, "answer": answer, "sources": sources, "created": time.time()}
+        self.store.set(key, json.dumps(entry, default=str).encode("utf-8"))
+        if embedding is None:
+            return
+        with self._lock:
+            raw_index = self.store.get(self._index_key(document_hash))
+            index = json.loads(raw_index.decode("utf-8")) if raw_index else []
+            index = [item for item in index if item["key"] != key]
+            index.append({"key": key, "embedding": base64.b64encode(encode_vector(embedding)).decode("ascii")})
+            self.store.set(self._index_key(document_hash), json.dumps(index[-MAX_QUESTIONS_PER_DOCUMENT:]).encode("utf-8"))
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    """Returns the process-wide chat answer cache."""
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = AnswerCache(DiskLRUCache(ANSWER_CACHE_FILE, ANSWER_CACHE_MAX_BYTES))
+        return _answer_cache
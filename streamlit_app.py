@@ -1,31 +1,51 @@
-try:
-    __import__('pysqlite3')
-    import sys
-    sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
-    print("Successfully switched to pysqlite3-binary.")
-except ImportError:
-    print("pysqlite3-binary not found, using system sqlite3. This might cause issues with ChromaDB if system sqlite3 is too old.")
-except KeyError:
-    print("sqlite3 module already replaced or manipulated. Assuming pysqlite3-binary is in use if installed.")
+import time
+_script_started = time.perf_counter() # Measures this script run (cold start or rerun)
 
 import streamlit as st
-# LangChain imports for the Study Buddy section
-from langchain_google_genai import GoogleGenerativeAI as LangChainGoogleGenerativeAI
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
-from langchain_core.documents import Document # Import Document for manual creation
-from langchain.prompts import PromptTemplate
 # Standard Python imports
 import os
-import tempfile
 import hashlib
-import time
+import uuid
 import json # For validating/parsing JSON output from LLM
+# Local helpers
+import study_tools
+from study_tools import (
+    SECTION_SUMMARIES_NOTE, build_chat_prompt, cached_tool_output, forget_document,
+    generate_custom_explanation, generate_flashcards, generate_items_by_section, generate_mindmap,
+    generate_practice_questions_with_guidance, index_document, is_blocked_output, item_coverage_options, lookup_first_answer,
+    mindmap_outline, needs_map_reduce_summary, needs_sectioned_items, open_study_selection, regeneration_nonce,
+    remember_first_answer, remember_tool_output, retrieve_for_question, run_ocr, summarize_sections, summary_prompt, tool_cache_key,
+)
+from vector_registry import get_vector_registry
+from document_library import DEFAULT_LIBRARY, get_document_library, selection_key
+from llm_streaming import CompletionStream, invoke_completion
+import telemetry
+from corpus import estimate_tokens
+from chat_memory import ChatMemory
+from context_packer import tool_budget
+from ocr import OCR_BACKEND_LABELS, get_cached_document_ocr, get_ocr_backend, ocr_backend_names
+from jobs import CANCELLED as JOB_CANCELLED, DONE as JOB_DONE, FAILED as JOB_FAILED, get_job_runner
+from generation_cache import is_error_output, llm_identity
+
+# LangChain, Chroma and google.generativeai are heavy to import, so they are imported inside
+# the cached factories / features below. Streamlit reruns this script on every interaction,
+# but the factories run once per server process. The tools themselves live in study_tools.py,
+# shared with the HTTP API (api.py).
+
+@st.cache_resource(show_spinner=False)
+def get_genai(api_key):
+    """Imports and configures google.generativeai once per process (used directly for OCR)."""
+    return study_tools.create_genai(api_key)
 
-# --- OCR Specific Imports (using Gemini directly) ---
-import google.generativeai as genai
+@st.cache_resource(show_spinner="Loading AI models...")
+def get_study_models(api_key):
+    """Builds the LangChain LLM and embedding clients once per process."""
+    return study_tools.create_study_models(api_key)
+
+@st.cache_resource(show_spinner=False)
+def get_process_run_counter():
+    """Process-wide counter used to tell the cold start apart from warm reruns."""
+    return {"runs": 0}
 
 # --- App Configuration & Title ---
 st.set_page_config(page_title="ULTIMATE Study AI", layout="wide")
@@ -41,20 +61,23 @@ if not GEMINI_API_KEY:
     st.error("🔴 API Key (GOOGLE_API_KEY_GEMINI) not found. Please set it. All features will be disabled.")
     st.stop()
 
-genai.configure(api_key=GEMINI_API_KEY)
-
 # --- Initialize LLM and Embeddings ---
+# Created on first use by a Study AI feature (see load_study_models below), not on every rerun
 llm_studybuddy = None
 llm_studybuddy2 = None
 llm_qna = None
 embeddings_studybuddy = None
-try:
-    llm_studybuddy = LangChainGoogleGenerativeAI(model="gemini-3-flash-preview", temperature=0.7, google_api_key=GEMINI_API_KEY) # Lower temp for structured output
-    llm_studybuddy2 = LangChainGoogleGenerativeAI(model="gemini-3-flash-preview", temperature=1, google_api_key=GEMINI_API_KEY) 
-    llm_qna = LangChainGoogleGenerativeAI(model="gemini-3-flash-preview", temperature=0.7, google_api_key=GEMINI_API_KEY)
-    embeddings_studybuddy = GoogleGenerativeAIEmbeddings(model="models/gemini-embedding-001", task_type="retrieval_document", google_api_key=GEMINI_API_KEY)
-except Exception as e:
-    st.sidebar.error(f"Error initializing AI models: {e}")
+
+def load_study_models():
+    global llm_studybuddy, llm_studybuddy2, llm_qna, embeddings_studybuddy
+    try:
+        models = get_study_models(GEMINI_API_KEY)
+        llm_studybuddy = models["llm_studybuddy"]
+        llm_studybuddy2 = models["llm_studybuddy2"]
+        llm_qna = models["llm_qna"]
+        embeddings_studybuddy = models["embeddings_studybuddy"]
+    except Exception as e:
+        st.sidebar.error(f"Error initializing AI models: {e}")
 
 # --- Session State Management ---
 # ... (all existing session state variables remain the same) ...
@@ -65,11 +88,21 @@ if 'ocr_file_name' not in st.session_state:
 if 'vector_store' not in st.session_state:
     st.session_state.vector_store = None
 if 'processed_file_hash' not in st.session_state:
-    st.session_state.processed_file_hash = None
+    st.session_state.processed_file_hash = None # Content hash of the selected documents, keys the output caches
+if 'study_selection' not in st.session_state:
+    st.session_state.study_selection = None # Which library documents are open; the chat belongs to this selection
 if 'documents_for_direct_use' not in st.session_state:
     st.session_state.documents_for_direct_use = None
+if 'corpus' not in st.session_state:
+    st.session_state.corpus = None # DocumentCorpus of the selected library documents: joined text, offsets and counts
+if 'library_inputs_seen' not in st.session_state:
+    st.session_state.library_inputs_seen = set() # (library, content hash) of inputs already checked against the library
+if 'upload_hashes' not in st.session_state:
+    st.session_state.upload_hashes = {} # Uploaded file_id -> MD5, so reruns don't re-hash the bytes
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
+if 'chat_memory' not in st.session_state:
+    st.session_state.chat_memory = ChatMemory() # Rolling summary + verbatim window that bounds the history sent per prompt
 if 'current_doc_chat_hash' not in st.session_state:
     st.session_state.current_doc_chat_hash = None
 if 'last_used_sources' not in st.session_state: 
@@ -81,6 +114,45 @@ if 'mindmap_json_canvas' not in st.session_state:
     st.session_state.mindmap_json_canvas = ""
 
 
+# --- Background jobs ---
+# OCR, ingestion and long summaries run on the process-wide job runner, so reruns neither
+# abandon nor repeat them. The session only keeps job ids; a fragment polls for progress.
+JOB_POLL_INTERVAL_S = 1.0
+if 'active_jobs' not in st.session_state:
+    st.session_state.active_jobs = {} # Slot -> (job id, context needed to use its result)
+
+def start_job(slot, key, fn, args=(), context=None, reuse_result=True, supersede=None):
+    job_id = get_job_runner().submit(slot.split(":")[0], key, fn, *args, reuse_result=reuse_result, supersede=supersede)
+    st.session_state.active_jobs[slot] = (job_id, context or {})
+
+def take_finished_job(slot):
+    """Returns (job, context) once the slot's job has finished, and forgets the slot; None while it runs."""
+    entry = st.session_state.active_jobs.get(slot)
+    if entry is None:
+        return None
+    job = get_job_runner().get(entry[0])
+    if job is not None and not job.is_finished:
+        return None
+    del st.session_state.active_jobs[slot]
+    return (job, entry[1]) if job is not None else None # Jobs expire after STUDY_AI_JOB_RESULT_TTL_S
+
+@st.fragment(run_every=JOB_POLL_INTERVAL_S)
+def show_job_progress(slot, label, on_cancel=None):
+    """Polls a job; when it finishes the whole app reruns so the result can be used."""
+    entry = st.session_state.active_jobs.get(slot)
+    job = get_job_runner().get(entry[0]) if entry else None
+    if job is None:
+        return
+    if job.is_finished:
+        st.rerun()
+    st.progress(job.fraction, text=f"{label}: {job.message}")
+    if st.button("Cancel", key=f"cancel_job_{slot}"):
+        get_job_runner().cancel(job.id)
+        del st.session_state.active_jobs[slot]
+        if on_cancel:
+            on_cancel()
+        st.rerun()
+
 # =============================================
 # SECTION 1: OCR PDF (Using Gemini Multimodal)
 # =============================================
@@ -88,50 +160,72 @@ if 'mindmap_json_canvas' not in st.session_state:
 st.sidebar.markdown("---")
 st.sidebar.header("📄 OCR Scanned PDF")
 ocr_uploaded_file = st.sidebar.file_uploader("Upload a scanned PDF for OCR", type="pdf", key="gemini_ocr_uploader")
+ocr_backend_name = st.sidebar.selectbox(
+    "OCR engine",
+    ocr_backend_names(),
+    format_func=lambda name: OCR_BACKEND_LABELS.get(name, name),
+    key="ocr_backend",
+    help="Gemini is the most accurate and formats the text as markdown. EasyOCR runs on this server's CPU: "
+         "no API quota, plain text. Also used for scanned pages found while adding PDFs to the library."
+)
 
-def perform_ocr_with_gemini(pdf_file_uploader_object):
-    try:
-        st.sidebar.write("Uploading PDF to API...")
-        uploaded_gemini_file = genai.upload_file(
-            path=pdf_file_uploader_object,
-            display_name=pdf_file_uploader_object.name,
-            mime_type=pdf_file_uploader_object.type
-        )
-        st.sidebar.write(f"File '{uploaded_gemini_file.display_name}' uploaded. URI: {uploaded_gemini_file.uri}. Mime Type: {pdf_file_uploader_object.type}")
-        st.sidebar.write("Extracting text with AI...")
-        model_ocr = genai.GenerativeModel(model_name="gemini-3-flash-preview")
-        prompt = [
-            "Please perform OCR on the provided PDF document and extract all text content and format it in markdown, with bold headings and leave lines wherever required.",
-            "Present the extracted text clearly. If there are multiple pages, try to indicate page breaks with something like '--- Page X ---' if possible, or just provide the continuous text.",
-            "Focus solely on extracting the text as accurately as possible from the document and formatting it properly.",
-            uploaded_gemini_file 
-        ]
-        response = model_ocr.generate_content(prompt, request_options={"timeout": 600})
-        try:
-            genai.delete_file(uploaded_gemini_file.name)
-            st.sidebar.write(f"Temporary file '{uploaded_gemini_file.display_name}' deleted from API.")
-        except Exception as e_delete:
-            st.sidebar.warning(f"Could not delete temporary file from API: {e_delete}")
-        return response.text
-    except Exception as e:
-        st.sidebar.error(f"OCR Error: {e}")
-        if 'uploaded_gemini_file' in locals() and hasattr(uploaded_gemini_file, 'name'):
-            try: genai.delete_file(uploaded_gemini_file.name)
-            except: pass
-        return None
+def selected_ocr_backend():
+    return get_ocr_backend(ocr_backend_name, get_genai(GEMINI_API_KEY))
+
+def run_ocr_job(job, genai, pdf_bytes, pdf_name, mime_type, parallel, backend):
+    """Background job: returns {"text", "from_cache", "failed_ranges"} for one PDF."""
+    return run_ocr(genai, pdf_bytes, pdf_name, mime_type, parallel=parallel, progress=job.report, backend=backend)
+
+def set_ocr_output(text, pdf_name):
+    st.session_state.ocr_text_output = text
+    st.session_state.ocr_file_name = f"ocr_of_{os.path.splitext(pdf_name)[0]}.txt"
+    st.session_state.ocr_text_hash = hashlib.md5(text.encode('utf-8')).hexdigest() # Hashed once, not every rerun
+
+# The OCR job outlives reruns: its result is picked up by whichever run sees it finish
+finished_ocr = take_finished_job("ocr")
+if finished_ocr:
+    ocr_job, ocr_context = finished_ocr
+    if ocr_job.status == JOB_DONE and ocr_job.result["text"]:
+        set_ocr_output(ocr_job.result["text"], ocr_context["pdf_name"])
+        if ocr_job.result["from_cache"]:
+            st.sidebar.caption("⚡ Served from the OCR cache.")
+        if ocr_job.result["failed_ranges"]:
+            st.sidebar.warning(f"OCR failed for {', '.join(ocr_job.result['failed_ranges'])} after retries. The rest of the document was extracted.")
+        st.sidebar.success("OCR Complete!")
+    elif ocr_job.status == JOB_CANCELLED:
+        st.sidebar.info("OCR cancelled.")
+    else:
+        st.sidebar.error(f"OCR Error: {ocr_job.error}" if ocr_job.error else "OCR failed or no text was extracted.")
 
 if ocr_uploaded_file is not None:
-    if st.sidebar.button("✨ Perform OCR", key="gemini_ocr_button"):
+    # Someone already OCR'd this exact PDF: fill the result straight from the cache
+    if st.session_state.get("ocr_cache_checked_file_id") != (ocr_uploaded_file.file_id, ocr_backend_name):
+        st.session_state.ocr_cache_checked_file_id = (ocr_uploaded_file.file_id, ocr_backend_name)
+        cached_ocr_text = get_cached_document_ocr(ocr_uploaded_file.getvalue(), cache_tag=selected_ocr_backend().cache_tag)
+        if cached_ocr_text:
+            set_ocr_output(cached_ocr_text, ocr_uploaded_file.name)
+            st.sidebar.success("⚡ Loaded a cached OCR result for this PDF.")
+
+    parallel_ocr = ocr_backend_name != "gemini" or st.sidebar.checkbox(
+        "Split into page ranges (faster for large scans)",
+        value=True,
+        key="parallel_ocr_mode",
+        help="OCRs groups of pages concurrently and retries only the groups that fail, instead of one long request for the whole file."
+    ) # Local OCR always works in page ranges
+    if st.sidebar.button("✨ Perform OCR", key="gemini_ocr_button", disabled="ocr" in st.session_state.active_jobs):
         st.session_state.ocr_text_output = None 
         st.session_state.ocr_file_name = None
-        with st.spinner("Performing OCR with AI... This may take a while for large files."):
-            extracted_text = perform_ocr_with_gemini(ocr_uploaded_file)
-            if extracted_text:
-                st.session_state.ocr_text_output = extracted_text
-                st.session_state.ocr_file_name = f"ocr_of_{os.path.splitext(ocr_uploaded_file.name)[0]}.txt"
-                st.sidebar.success("OCR Complete!")
-            else:
-                st.sidebar.error("OCR failed or no text was extracted.")
+        ocr_pdf_bytes = ocr_uploaded_file.getvalue()
+        # Runs in the background: other widgets stay usable, and identical PDFs share one job
+        start_job(
+            "ocr", ("ocr", hashlib.md5(ocr_pdf_bytes).hexdigest(), parallel_ocr, ocr_backend_name), run_ocr_job,
+            args=(get_genai(GEMINI_API_KEY), ocr_pdf_bytes, ocr_uploaded_file.name, ocr_uploaded_file.type, parallel_ocr, ocr_backend_name),
+            context={"pdf_name": ocr_uploaded_file.name}
+        )
+
+if "ocr" in st.session_state.active_jobs:
+    with st.sidebar:
+        show_job_progress("ocr", "OCR")
 
 if st.session_state.ocr_text_output:
     st.sidebar.subheader("OCR Result:")
@@ -144,6 +238,9 @@ if st.session_state.ocr_text_output:
     )
     with st.sidebar.expander("Preview OCR Text (First 1000 Chars)"):
         st.text(st.session_state.ocr_text_output[:1000] + "...")
+    if st.sidebar.button("📚 Use OCR Text in Study AI", key="ocr_to_study_button"):
+        # Runs before the input method radio is created, so its state can still be set here
+        st.session_state.study_input_method = "Use OCR Result"
 
 # =============================================
 # SECTION 2: Study Buddy Q&A and Tools
@@ -151,8 +248,17 @@ if st.session_state.ocr_text_output:
 st.sidebar.markdown("---")
 st.sidebar.header("🧠 Study AI Tools")
 
+def remember_pasted_text_hash():
+    """Hashes pasted text only when it changes, instead of on every rerun."""
+    st.session_state.pasted_text_hash = hashlib.md5(st.session_state.study_text_paste.encode('utf-8')).hexdigest()
+
 # Tab selection for input method
-input_method = st.sidebar.radio("Input Method:", ["Upload File", "Paste Text"], horizontal=True)
+input_method_options = ["Upload File", "Paste Text"]
+if st.session_state.ocr_text_output:
+    input_method_options.append("Use OCR Result")
+if st.session_state.get("study_input_method") not in input_method_options:
+    st.session_state.study_input_method = "Upload File"
+input_method = st.sidebar.radio("Input Method:", input_method_options, horizontal=True, key="study_input_method")
 
 study_uploaded_file = None
 pasted_text_input = None
@@ -163,7 +269,7 @@ if input_method == "Upload File":
         "Upload TEXT-READABLE PDF or TXT", 
         type=["pdf", "txt"], 
         key="study_uploader",
-        help="If your PDF is scanned, please use the 'OCR Scanned PDF' section above first."
+        help="Scanned pages of a PDF are OCRed while it is added, with the engine chosen under 'OCR engine'."
     )
     if study_uploaded_file:
         processing_source_name = study_uploaded_file.name
@@ -172,311 +278,282 @@ elif input_method == "Paste Text":
     pasted_text_input = st.sidebar.text_area(
         "Paste your study text here:", 
         height=300, 
-        key="study_text_paste"
+        key="study_text_paste",
+        on_change=remember_pasted_text_hash
     )
     if pasted_text_input:
         processing_source_name = "Pasted Text"
 
+elif input_method == "Use OCR Result":
+    # The OCR text goes straight into ingestion, no download/re-upload round trip
+    pasted_text_input = st.session_state.ocr_text_output
+    processing_source_name = st.session_state.ocr_file_name or "OCR Result"
+    st.sidebar.caption(f"Using OCR text from '{processing_source_name}'.")
+
 # Check if we have valid input from either source
 has_input = (study_uploaded_file is not None) or (pasted_text_input is not None and pasted_text_input.strip() != "")
 
+def add_to_library(job, library, library_name, doc_id, doc_name, file_bytes, file_type, pasted_text, embeddings, edited_content_hash=None,
+                   ocr_client=None, edit_sequence=None):
+    """Background job: embeds one input into the persistent library (see study_tools.index_document)."""
+    return index_document(
+        library, library_name, doc_id, doc_name, file_bytes, file_type, pasted_text, embeddings,
+        edited_content_hash=edited_content_hash, progress=job.report, ocr_client=ocr_client, edit_sequence=edit_sequence
+    )
+
+def start_library_job(doc_id, doc_name, file_bytes, file_type, pasted_text, edited_content_hash=None):
+    # Each edit is numbered when submitted and replaces the previous edit's job: only the newest text is written
+    edit_sequence = library.next_edit_sequence() if edited_content_hash else None
+    start_job(
+        f"ingest:{doc_id}", ("ingest", library_name, doc_id, edited_content_hash, edit_sequence), add_to_library,
+        args=(library, library_name, doc_id, doc_name, file_bytes, file_type, pasted_text, embeddings_studybuddy, edited_content_hash,
+              selected_ocr_backend() if file_type == "application/pdf" else None, # Scanned pages are OCRed on the way in
+              edit_sequence),
+        context={"doc_id": doc_id, "name": doc_name, "edited": bool(edited_content_hash), "seen_key": (library_name, doc_id)},
+        reuse_result=False, # A finished ingestion may have been undone since (document removed): index again
+        supersede=("edit", doc_id) if edited_content_hash else None
+    )
+
+def release_study_view():
+    if st.session_state.vector_store is not None:
+        st.session_state.vector_store.release()
+    st.session_state.vector_store = None
+    st.session_state.documents_for_direct_use = None
+    st.session_state.corpus = None
+
+def reset_study_state():
+    release_study_view()
+    st.session_state.chat_history = []
+    st.session_state.chat_memory.reset()
+    st.session_state.last_used_sources = []
+    st.session_state.mindmap_keywords_list = ""
+    st.session_state.mindmap_json_canvas = ""
+
+library = get_document_library()
+library_name = st.sidebar.text_input(
+    "Library:", value=DEFAULT_LIBRARY, key="library_name",
+    help="Documents stay indexed in this library across sessions. Use your own name to keep a separate library."
+).strip() or DEFAULT_LIBRARY
+
+# Only Study AI features need the LangChain clients; OCR-only visits never load them
+if has_input or st.session_state.get("library_selection"):
+    load_study_models()
+
 if has_input and GEMINI_API_KEY and llm_studybuddy and embeddings_studybuddy:
     
-    # Calculate hash based on input type
+    # Calculate hash based on input type (memoized: reruns must not re-hash the whole document)
     if study_uploaded_file:
-        file_bytes = study_uploaded_file.getvalue()
-        current_file_hash = hashlib.md5(file_bytes).hexdigest()
+        if study_uploaded_file.file_id not in st.session_state.upload_hashes:
+            st.session_state.upload_hashes[study_uploaded_file.file_id] = hashlib.md5(study_uploaded_file.getvalue()).hexdigest()
+        current_file_hash = st.session_state.upload_hashes[study_uploaded_file.file_id]
     else:
-        # Use hash of pasted text
-        current_file_hash = hashlib.md5(pasted_text_input.encode('utf-8')).hexdigest()
-
-    if current_file_hash != st.session_state.processed_file_hash:
-        st.sidebar.info(f"Processing '{processing_source_name}' for Study AI...")
-        st.session_state.vector_store = None
-        st.session_state.documents_for_direct_use = None
-        st.session_state.chat_history = [] 
-        st.session_state.current_doc_chat_hash = current_file_hash 
-        st.session_state.last_used_sources = []
-        st.session_state.mindmap_keywords_list = ""
-        st.session_state.mindmap_json_canvas = ""
-        
-        try:
-            documents = []
-            
-            if study_uploaded_file:
-                # Handle File Upload
-                with tempfile.NamedTemporaryFile(delete=False, suffix=f".{study_uploaded_file.name.split('.')[-1]}") as tmp_file:
-                    tmp_file.write(file_bytes)
-                    tmp_file_path = tmp_file.name
-                
-                if study_uploaded_file.type == "application/pdf":
-                    loader = PyPDFLoader(tmp_file_path)
-                else:
-                    loader = TextLoader(tmp_file_path, encoding='utf-8')
-                
-                documents = loader.load()
-                
-                # Check for empty PDF content
-                if study_uploaded_file.type == "application/pdf" and (not documents or not any(doc.page_content.strip() for doc in documents)):
-                    st.sidebar.error("Uploaded PDF has no extractable text. Use OCR section first.")
-                    os.remove(tmp_file_path)
-                    st.session_state.processed_file_hash = None
-                    # Stop further processing
-                    documents = []
-                
-                if 'tmp_file_path' in locals() and os.path.exists(tmp_file_path):
-                    os.remove(tmp_file_path)
+        if input_method == "Use OCR Result" and st.session_state.get("ocr_text_hash"):
+            current_file_hash = st.session_state.ocr_text_hash
+        elif input_method == "Paste Text" and st.session_state.get("pasted_text_hash"):
+            current_file_hash = st.session_state.pasted_text_hash
+        else:
+            # Use hash of pasted text
+            current_file_hash = hashlib.md5(pasted_text_input.encode('utf-8')).hexdigest()
 
-            else:
-                # Handle Pasted Text - Create Document object manually
-                documents = [Document(page_content=pasted_text_input, metadata={"source": "Pasted Text"})]
-
-            if documents:
-                st.session_state.documents_for_direct_use = documents
-                text_splitter = RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=300)
-                texts = text_splitter.split_documents(documents)
-                valid_texts = [text for text in texts if text.page_content and text.page_content.strip()]
-                
-                if not valid_texts:
-                    st.sidebar.error("No valid text chunks after splitting for Study Buddy.")
-                else:
-                    with st.spinner("Creating embeddings for Study AI..."):
-                        st.session_state.vector_store = Chroma.from_documents(documents=valid_texts, embedding=embeddings_studybuddy)
-                    st.session_state.processed_file_hash = current_file_hash
-                    st.sidebar.success(f"✅ '{processing_source_name}' ready for Study AI!")
-
-        except Exception as e:
-            st.sidebar.error(f"Error processing Study AI content: {e}")
-            if 'tmp_file_path' in locals() and os.path.exists(tmp_file_path): os.remove(tmp_file_path)
-            st.session_state.vector_store = None
-            st.session_state.documents_for_direct_use = None
-            st.session_state.processed_file_hash = None
-            st.session_state.chat_history = []
-            st.session_state.current_doc_chat_hash = None
-            st.session_state.last_used_sources = []
-            st.session_state.mindmap_keywords_list = ""
-            st.session_state.mindmap_json_canvas = ""
-
-# --- Backend Function for Practice Question Generation ---
-# ... (generate_practice_questions_with_guidance function remains the same) ...
-def generate_practice_questions_with_guidance(subject_name, document_text, example_qa_style_guide, llm):
-    PRACTICE_QUESTION_PROMPT_TEMPLATE = """You are an expert AI assistant tasked with generating practice questions for a {subject_name} exam, based ONLY on the provided "Document Text". Your goal is to emulate the style, type, and difficulty of the "Example Questions and Answers" provided for style guidance.
-Instructions:
-1.  Carefully review the "Document Text".
-2.  Carefully review the "Example Questions and Answers" to understand the desired style, question types, and answer format for {subject_name}.
-3.  Generate as many new and distinct practice questions based on the "Document Text" as you can.
-4.  The generated questions should be similar in nature to the provided examples.
-5.  For each question you generate, provide an answer based *strictly* on the information within the "Document Text".
-6.  Output Format:
-    *   Each question-answer pair must be on a new line and leave a line between two pairs.
-    *   Separate the question from its answer using ONLY ">>" (two greater-than signs with no spaces around them).
-    *   The entire output should be formatted in Markdown.
-    *   Do NOT number the questions.
-Example Questions and Answers for {subject_name} (Follow this style):
-{example_questions_and_answers}
-Document Text:
-{document_text}
-Generated Practice Questions for {subject_name} (question>>answer format):
-"""
-    formatted_prompt = PRACTICE_QUESTION_PROMPT_TEMPLATE.format(
-        subject_name=subject_name,
-        document_text=document_text,
-        example_questions_and_answers=example_qa_style_guide if example_qa_style_guide.strip() else "No specific style examples provided by user. Generate general questions suitable for the subject, inferring common question types for the specified subject based on the document text."
+    if input_method == "Paste Text":
+        # Pasted notes are one library document that is re-indexed in place as it is edited
+        if 'pasted_doc_id' not in st.session_state:
+            st.session_state.pasted_doc_id = f"pasted-{uuid.uuid4().hex[:16]}"
+            st.session_state.pasted_doc_name = f"Pasted Text ({time.strftime('%Y-%m-%d %H:%M')})"
+        pasted_doc_id = st.session_state.pasted_doc_id
+        if st.session_state.get("pasted_indexed") != (library_name, current_file_hash):
+            st.session_state.pasted_indexed = (library_name, current_file_hash)
+            start_library_job(pasted_doc_id, st.session_state.pasted_doc_name, None, None, pasted_text_input, edited_content_hash=current_file_hash)
+
+    # Each other input is added to the library once; it then joins the current selection
+    elif (library_name, current_file_hash) not in st.session_state.library_inputs_seen:
+        st.session_state.library_inputs_seen.add((library_name, current_file_hash))
+        if not library.has_document(library_name, current_file_hash):
+            start_library_job(
+                current_file_hash,
+                study_uploaded_file.name if study_uploaded_file else processing_source_name,
+                study_uploaded_file.getvalue() if study_uploaded_file else None,
+                study_uploaded_file.type if study_uploaded_file else None,
+                pasted_text_input
+            )
+        else:
+            st.session_state.library_selection = list(dict.fromkeys(st.session_state.get("library_selection", []) + [current_file_hash]))
+
+def forget_library_input(context):
+    """After a cancelled indexing job, lets the same input be submitted again."""
+    st.session_state.library_inputs_seen.discard(context["seen_key"])
+    if context["edited"]:
+        st.session_state.pasted_indexed = None
+
+# Indexing jobs keep running across reruns (and after the input widget is cleared); finished ones join the selection
+for ingest_slot in [slot for slot in st.session_state.active_jobs if slot.startswith("ingest:")]:
+    finished_ingest = take_finished_job(ingest_slot)
+    if finished_ingest is None:
+        if ingest_slot in st.session_state.active_jobs:
+            ingest_context = st.session_state.active_jobs[ingest_slot][1]
+            with st.sidebar:
+                show_job_progress(
+                    ingest_slot, f"Indexing '{ingest_context['name']}'",
+                    on_cancel=lambda context=ingest_context: forget_library_input(context)
+                )
+        continue
+    ingest_job, ingest_context = finished_ingest
+    if ingest_job.status == JOB_DONE:
+        stats = ingest_job.result
+        if stats.get("superseded"):
+            continue # A newer edit of the same text was written first; its own job reports it
+        if ingest_context["edited"]:
+            st.sidebar.caption(f"✏️ Re-indexed: {stats['added']} new chunks, {stats['removed']} removed, {stats['kept']} unchanged.")
+            get_vector_registry().invalidate(lambda key, doc_id=ingest_context["doc_id"]: doc_id in key[1])
+            st.session_state.study_view_stale = True # Reopen the selection with the new text, keeping the chat
+        elif stats["hits"]:
+            st.sidebar.caption(f"♻️ Reused {stats['hits']} cached embeddings, embedded {stats['misses']} new chunks.")
+        if stats.get("ocr_pages"):
+            st.sidebar.caption(f"🔍 OCRed {stats['ocr_pages']} scanned page(s); the other pages used their text layer.")
+        st.sidebar.success(f"✅ '{ingest_context['name']}' added to the library!")
+        st.session_state.library_selection = list(dict.fromkeys(st.session_state.get("library_selection", []) + [ingest_context["doc_id"]]))
+    elif ingest_job.status == JOB_FAILED:
+        st.sidebar.error(ingest_job.error)
+
+def remove_from_library(doc_id):
+    """Button callback: runs before the widgets are drawn, so the selection can still be changed."""
+    forget_document(library, st.session_state.library_name.strip() or DEFAULT_LIBRARY, doc_id)
+    st.session_state.library_selection = [selected for selected in st.session_state.get("library_selection", []) if selected != doc_id]
+    st.session_state.library_inputs_seen = {seen for seen in st.session_state.library_inputs_seen if seen[1] != doc_id}
+    if doc_id == st.session_state.get("pasted_doc_id"):
+        st.session_state.pasted_indexed = None # Editing the notes again adds them back
+
+# --- Library: pick the documents chat and the tools work on ---
+library_documents = library.list_documents(library_name)
+library_names = {doc["doc_id"]: doc["name"] for doc in library_documents}
+st.session_state.library_selection = [doc_id for doc_id in st.session_state.get("library_selection", []) if doc_id in library_names]
+if library_documents:
+    selected_doc_ids = st.sidebar.multiselect(
+        "Study from:", list(library_names), format_func=library_names.get, key="library_selection",
+        help="Chat and every tool only use the selected documents."
     )
+    with st.sidebar.expander(f"🗂️ Manage Library ({len(library_documents)} documents)"):
+        for doc in library_documents:
+            name_col, remove_col = st.columns([4, 1])
+            name_col.markdown(f"**{doc['name']}**")
+            name_col.caption(f"{doc['page_count']} pages, {doc['chunk_count']} chunks, {doc['char_count']:,} characters")
+            remove_col.button("🗑️", key=f"remove_doc_{doc['doc_id']}", help="Remove from library", on_click=remove_from_library, args=(doc["doc_id"],))
+else:
+    selected_doc_ids = []
+
+current_selection = selection_key(selected_doc_ids) if selected_doc_ids else None
+if current_selection is None:
+    if st.session_state.study_selection is not None:
+        reset_study_state()
+        st.session_state.processed_file_hash = None
+        st.session_state.study_selection = None
+elif (current_selection != st.session_state.study_selection or st.session_state.get("study_view_stale")) and GEMINI_API_KEY and embeddings_studybuddy:
+    if current_selection != st.session_state.study_selection:
+        reset_study_state()
+        st.session_state.current_doc_chat_hash = current_selection
+    else:
+        release_study_view() # A selected document was edited: new text, same conversation
+    st.session_state.study_view_stale = False
     try:
-        response = llm.invoke(formatted_prompt)
-        return response
-    except Exception as e:
-        if "response was blocked" in str(e).lower() or "safety settings" in str(e).lower():
-            st.warning("The response was blocked due to safety settings. Try rephrasing style guidance or check document content.")
-            return "Response blocked due to safety settings. Please check your input or document content."
-        return f"Error generating practice questions: {e}"
-
-# --- Backend Function for Custom Explanations ---
-# ... (generate_custom_explanation function remains the same) ...
-def generate_custom_explanation(document_text, explanation_style, llm):
-    common_instructions = """
-    Your goal is to explain the core concepts from the provided "Document Text" in an engaging way.
-    Ensure ALL concepts from the text are covered.
-    Use vivid metaphors and analogies to aid understanding.
-    The explanation should be detailed and formatted in Markdown.
-    Base your explanation SOLELY on the provided "Document Text".
-    """
-    style_specific_prompts = {
-        "brainrot": f""" {common_instructions}
-            Role: You are a super-online Gen Z tutor who explains things with maximum "brainrot" and internet slang, but still makes it make sense.
-            Style:
-            - Keep it relatively short, like a quick, punchy explainer but cover all major concepts.
-            - Use current Gen Z slang, internet memes, and "brainrot" terminology (e.g., "rizz", "no cap", "it's giving...", "sus", "delulu", "based", "sigma", "gyatt" if contextually (and hilariously inappropriately) relevant, "skibidi", "fanum tax" – use these creatively and where they might (absurdly) fit an analogy).
-            - Make the metaphors and analogies extremely online and relatable to internet culture.
-            - It should be funny, a bit unhinged, but ultimately help someone "get" the concepts through the absurdity.
-            - Don't be afraid to be a little chaotic, but ensure the core information is still conveyed.
-            Document Text:
-            ```
-            {{document_text}}
-            ```
-            "Brainrot" Explanation (covering all major concepts with slang, metaphors, and analogies):
-        """,
-        "normal": f""" {common_instructions}
-            Role: You are a clear and patient educator.
-            Style:
-            - The explanation should be comprehensive but concise, it should cover all major concepts in an easily digestable format.
-            - Use clear, easy-to-understand language.
-            - Employ insightful metaphors and analogies to clarify complex points.
-            - Maintain a helpful and encouraging tone.
-            Document Text:
-            ```
-            {{document_text}}
-            ```
-            Normal Explanation (covering all major concepts with clear metaphors and analogies):
-        """
-    }
-    selected_prompt_template = style_specific_prompts.get(explanation_style.lower(), style_specific_prompts["normal"])
-    formatted_prompt = selected_prompt_template.format(document_text=document_text)
-    try:
-        response = llm.invoke(formatted_prompt)
-        return response
-    except Exception as e:
-        if "response was blocked" in str(e).lower() or "safety settings" in str(e).lower():
-            st.warning("The explanation response was blocked due to safety settings. The document content might be triggering filters.")
-            return "Response blocked due to safety settings. Please check the document content."
-        return f"Error generating explanation: {e}"
-
-# --- NEW: Backend Functions for Mindmap Generation ---
-def extract_keywords_for_mindmap(document_text, llm):
-    """Extracts keywords and a central topic for mindmap generation."""
-    prompt = f"""
-    Based on the following Document Text, identify the main central topic and up to 10-15 key related concepts, terms, or sub-topics.
-    The goal is to gather elements for creating a mind map.
-    List the central topic first, then the related keywords.
-    Format the output as:
-    Central Topic: [Your identified central topic]
-    Keywords:
-    - Keyword 1
-    - Keyword 2
-    - Keyword 3
-    ...
-
-    Document Text:
-    ```
-    {document_text}
-    ```
-
-    Extracted Central Topic and Keywords:
-    """
-    try:
-        response = llm.invoke(prompt)
-        # Basic parsing (can be made more robust)
-        lines = response.strip().split('\n')
-        central_topic = "Unknown Central Topic"
-        keywords = []
-        parsing_keywords = False
-        for line in lines:
-            if line.lower().startswith("central topic:"):
-                central_topic = line.split(":", 1)[1].strip()
-            elif line.lower().startswith("keywords:"):
-                parsing_keywords = True
-            elif parsing_keywords and line.startswith("- "):
-                keywords.append(line[2:].strip())
-        if not keywords and central_topic == "Unknown Central Topic" and response.strip(): # Fallback if parsing fails
-            return "Central Topic: Document Analysis\nKeywords:\n- " + "\n- ".join(response.strip().split('\n')[:10]), central_topic, response.strip().split('\n')[:10]
-
-
-        return response, central_topic, keywords # Return raw response, parsed central_topic, and parsed keywords
+        # Sessions studying the same selection share one index, built by whichever session got there first
+        shared_store = open_study_selection(library, library_name, selected_doc_ids, embeddings_studybuddy)
+        st.session_state.vector_store = shared_store
+        st.session_state.documents_for_direct_use = shared_store.documents
+        st.session_state.corpus = shared_store.corpus
+        st.session_state.processed_file_hash = shared_store.corpus.content_hash # Content identity for the output caches
+        st.session_state.study_selection = current_selection
     except Exception as e:
-        return f"Error extracting keywords: {e}", None, []
-
-
-def generate_json_canvas_from_keywords(central_topic, keywords, llm, example_canvas_json_str):
-    """Generates JSON Canvas from keywords, guided by an example structure."""
-    # Create a simplified list of keywords for the prompt to keep it manageable
-    keyword_list_for_prompt = "- " + "\n- ".join(keywords) # Use up to 10 keywords for canvas generation
-
-    prompt = f"""
-    You are an AI assistant that helps create mind maps in JSON Canvas format.
-    Your task is to take a Central Topic and a list of Related Keywords and structure them into a valid JSON Canvas object containing 'nodes' and 'edges'.
-
-    **Instructions for JSON Canvas Output:**
-    1.  The mindmap should be interconnected with small explanations of relationships between the connected keywords. the mindmap should resemble how neurons are connected in the brain. Group related and unconnected nodes into a list
-    2.  This JSON object MUST contain two top-level keys: "nodes" (an array of node objects) and "edges" (an array of edge objects).
-    3.  **Nodes:**
-        *   Each node object must have:
-            *   `"id"`: A unique string identifier (e.g., "node_topic", "node_keyword1"). Make them descriptive based on the text.
-            *   `"x"`, `"y"`: Integer coordinates. Try to arrange keywords around the central topic. For example, central topic at (0,0), keywords at (200,0), (-200,0), (0,200), (0,-200), (150,150) etc. Vary these.
-            *   `"width"`: Integer (e.g., 250).
-            *   `"height"`: Integer (e.g., 60).
-            *   `"type"`: Always set to `"text"`.
-            *   `"text"`: The actual keyword or central topic string.
-    4.  **Edges:**
-        *   Each edge object must have:
-            *   `"id"`: A unique string identifier (e.g., "edge_topic_keyword1").
-            *   `"fromNode"`: The `id` of the starting node (usually a keyword node or the central topic).
-            *   `"toNode"`: The `id` of the ending node (usually the central topic if connecting keywords to it, or another keyword).
-            *   `"label"` (optional): A short string describing the relationship (e.g., "relates to", "is part of", "leads to"). If unsure, omit or use a generic label.
-        *   Ensure all keywords are connected to the central topic, or form a logical structure.
-    5.  Use EVERY SINGLE keyword provided in the Related Keywords list.
-    **Example of the desired JSON Canvas structure (DO NOT just copy this, adapt it based on the provided keywords):**
-    ```json
-    {example_canvas_json_str}
-    ```
-
-    **Now, generate the JSON Canvas for the following:**
-
-    Central Topic: {central_topic}
-
-    Related Keywords:
-    {keyword_list_for_prompt}
-
-    Strictly adhere to the JSON format. Ensure all quotes are correctly escaped if necessary within text fields (though unlikely for keywords).
-    The output should be ONLY the JSON object, starting with `{{` and ending with `}}`.
-    ---
-    JSON Canvas Output:
-    """
-    try:
-        response = llm.invoke(prompt)
-        # Attempt to clean and validate the JSON
-        # LLMs can sometimes add ```json ... ``` markdown, so strip it
-        cleaned_response = response.strip()
-        if cleaned_response.startswith("```json"):
-            cleaned_response = cleaned_response[7:]
-        if cleaned_response.startswith("```"): # General ```
-             cleaned_response = cleaned_response[3:]
-        if cleaned_response.endswith("```"):
-            cleaned_response = cleaned_response[:-3]
-        
-        # Validate JSON
-        json.loads(cleaned_response) # This will raise an error if not valid JSON
-        return cleaned_response
-    except json.JSONDecodeError as e_json:
-        st.error(f"LLM returned invalid JSON for mindmap: {e_json}")
-        st.text_area("Problematic LLM Output (JSON Canvas):", cleaned_response, height=200)
-        return f'{{"error": "Failed to generate valid JSON for mindmap. LLM output was not valid JSON.", "details": "{str(e_json).replace("\"", "'")}", "raw_output": "{cleaned_response.replace("\"", "'")}"}}' # Return error JSON
-    except Exception as e:
-        return f'{{"error": "Error generating JSON canvas: {str(e).replace("\"", "'")}"}}'
+        st.sidebar.error(f"Error opening the selected documents: {e}")
+        reset_study_state()
+        st.session_state.processed_file_hash = None
+        st.session_state.study_selection = None
+        st.session_state.current_doc_chat_hash = None
+
+def show_first_token_latency(completion):
+    """Shows how long the user waited for the first token of a streamed answer."""
+    if completion.ttft_s is not None:
+        st.caption(f"⏱️ First token after {completion.ttft_s:.2f}s · full answer after {completion.total_s:.2f}s")
+
+
+def current_tool_cache_key(tool, llm, **options):
+    """Generation cache key for a tool run on the current document."""
+    return tool_cache_key(st.session_state.processed_file_hash, tool, llm, **options)
+
+def warn_if_blocked(text):
+    if is_blocked_output(text):
+        st.warning("The response was blocked due to safety settings. Try rephrasing your input or check the document content.")
+
+def regenerate_checkbox(tool):
+    return st.checkbox(
+        "🔄 Regenerate (ignore cached result)",
+        key=f"regenerate_{tool}_{st.session_state.processed_file_hash}",
+        help="Results are cached per document and options. Tick this to ask the AI for a fresh answer."
+    )
+
+def pack_tool_context(tool):
+    """Fits the current document into the tool's token budget and tells the user what was included."""
+    packed = study_tools.packed_tool_context(st.session_state.corpus, tool)
+    st.caption(("📦 " if packed.is_complete else "📦 ⚠️ ") + packed.report())
+    return packed
+
+def run_section_summary_job(job, llm, corpus):
+    """Background job: the map-reduce part of summarizing a document too long for one prompt."""
+    return summarize_sections(llm, corpus, progress=job.report)
+
+def run_sectioned_items_job(job, llm, corpus, tool, options, cache_key):
+    """Background job: flashcards or practice questions from every section of the document, merged and cached."""
+    result = generate_items_by_section(llm, corpus, tool, progress=job.report, **options)
+    remember_tool_output(cache_key, result["text"], llm)
+    return result
+
+def whole_document_checkbox(tool):
+    corpus = st.session_state.corpus
+    return st.checkbox(
+        "📚 Cover the whole document (section by section)",
+        value=bool(corpus) and needs_sectioned_items(corpus, tool),
+        key=f"whole_document_{tool}_{st.session_state.processed_file_hash}",
+        help="Generates from every section of the document in parallel, then merges the results and removes near-duplicates. "
+             "On by default when the document is longer than one prompt can hold."
+    )
+
+def show_sectioned_items_report(result):
+    st.caption(
+        f"📚 {result['item_count']} items from {result['section_count']} sections, "
+        f"{result['duplicates_removed']} near-duplicates removed."
+    )
+    if result["failed_sections"]:
+        st.warning(f"Generation failed for {', '.join(result['failed_sections'])}. The other sections were used.")
+
+def show_cached_notice():
+    st.caption("⚡ Served from cache. Tick 'Regenerate' for a fresh answer.")
 
 
 # --- Main Interaction Area for Study Buddy Tools ---
 if st.session_state.get('vector_store') and st.session_state.get('documents_for_direct_use') and GEMINI_API_KEY and llm_qna and llm_studybuddy:
     st.markdown("---")
-    if st.session_state.current_doc_chat_hash != st.session_state.processed_file_hash:
+    if st.session_state.current_doc_chat_hash != st.session_state.study_selection:
         st.session_state.chat_history = []
-        st.session_state.current_doc_chat_hash = st.session_state.processed_file_hash
+        st.session_state.chat_memory.reset()
+        st.session_state.current_doc_chat_hash = st.session_state.study_selection
         st.session_state.last_used_sources = []
         st.session_state.mindmap_keywords_list = ""
         st.session_state.mindmap_json_canvas = ""
         
-    header_file_name = "your document"
-    # Logic to handle naming when input is pasted text vs file
-    if study_uploaded_file and hasattr(study_uploaded_file, 'name'):
-        if st.session_state.processed_file_hash == hashlib.md5(study_uploaded_file.getvalue()).hexdigest():
-            header_file_name = study_uploaded_file.name
-    elif pasted_text_input:
-        if st.session_state.processed_file_hash == hashlib.md5(pasted_text_input.encode('utf-8')).hexdigest():
-            header_file_name = "Pasted Text"
+    # The corpus remembers which upload / pasted text it was built from
+    corpus = st.session_state.corpus
+    header_file_name = corpus.source_name if corpus else "your document"
             
     st.header(f"🛠️ Study Tools for: {header_file_name}")
+    if corpus:
+        st.caption(f"{corpus.page_count} page(s) · {corpus.char_count:,} characters · ~{corpus.token_count:,} tokens · {len(corpus.chunk_ids)} chunks")
     
-    query_type_key_suffix = st.session_state.processed_file_hash or "default_study_tools"
+    query_type_key_suffix = st.session_state.study_selection or "default_study_tools"
+
+    # Streaming shows the answer as it is generated instead of after a long spinner
+    stream_responses = st.sidebar.toggle("⚡ Stream AI responses", value=True, key="stream_responses")
+    ttft_stats = telemetry.summarize("llm.ttft_s")
+    if ttft_stats["count"]:
+        st.sidebar.caption(f"First-token latency: p50 {ttft_stats['p50']:.2f}s · p95 {ttft_stats['p95']:.2f}s ({ttft_stats['count']} calls)")
     
     tool_options = ["Chat & Ask Questions", 
                     "Generate Practice Questions",
@@ -499,18 +576,34 @@ if st.session_state.get('vector_store') and st.session_state.get('documents_for_
             sources = item.get("sources") 
             with st.chat_message(role):
                 st.markdown(content)
+                prompt_size = item.get("prompt_size")
+                if prompt_size:
+                    history_note = f"history ~{prompt_size['history_tokens']:,}"
+                    if prompt_size["summary_tokens"]:
+                        history_note += f" incl. summary ~{prompt_size['summary_tokens']:,}"
+                    st.caption(f"Prompt: ~{prompt_size['prompt_tokens']:,} tokens ({history_note}, {prompt_size['verbatim_messages']} recent messages verbatim).")
                 if role == "ai" and sources: 
                     with st.expander("📚 View Sources Used", expanded=False):
                         for i, source_doc in enumerate(sources):
                             page_label = source_doc.metadata.get('page', 'N/A')
-                            st.caption(f"Source {i+1} (Page: {page_label}):")
+                            doc_label = source_doc.metadata.get('doc_name')
+                            st.caption(f"Source {i+1} ({doc_label + ', ' if doc_label else ''}Page: {page_label}):")
                             st.markdown(f"> {source_doc.page_content[:300]}...") 
                             st.markdown("---")
+                        cached_from = item.get("cached_from")
+                        if cached_from:
+                            match_label = "same question" if cached_from["similarity"] >= 1.0 else f"similar question \"{cached_from['question']}\", similarity {cached_from['similarity']:.2f}"
+                            st.caption(f"Answered from cache ({match_label}).")
+                        retrieval = item.get("retrieval")
+                        if retrieval:
+                            retrieval_label = "keyword match, no embedding call" if retrieval["path"] == "lexical" else "keyword + semantic search"
+                            st.caption(f"Retrieved in {retrieval['latency_s'] * 1000:.0f} ms ({retrieval_label}).")
         
         user_question = st.chat_input("Ask a follow-up question or a new question...", key=f"chat_input_{query_type_key_suffix}")
 
         if st.button("Clear Chat History", key=f"clear_chat_{query_type_key_suffix}"):
             st.session_state.chat_history = []
+            st.session_state.chat_memory.reset()
             st.session_state.last_used_sources = []
             st.rerun()
 
@@ -519,45 +612,42 @@ if st.session_state.get('vector_store') and st.session_state.get('documents_for_
             with st.chat_message("user"): 
                 st.markdown(user_question)
 
-            with st.spinner("Thinking..."):
-                history_for_prompt_list = [f"Previous {item['role']}: {item['content']}" for item in st.session_state.chat_history[:-1]]
-                history_for_prompt = "\n".join(history_for_prompt_list)
-                
-                retriever = st.session_state.vector_store.as_retriever(search_type="similarity", search_kwargs={"k": 3})
-                
-                prompt_template_chat_qa = """You are an helpful expert in all fields of study and the best generalist on earth who understands everything well. Use the following pieces of context from a document AND the preceding chat history to answer the user's current question.
-                Provide a explanatory and elaborative answer based SOLELY on the provided context and chat history.
-                If the question is a follow-up, use the chat history to understand the context of the follow-up.
-                If you don't know the answer from the context, just say that you don't know, don't try to make up an answer.
-                Explain the concepts clearly and show your thinking.
-
-                Chat History (if any):
-                {chat_history}
-
-                Retrieved Context from Document:
-                {context}
+            # Only a first question can be answered from the cache: a follow-up's answer depends on the chat so far
+            is_first_turn = len(st.session_state.chat_history) == 1
+            if is_first_turn:
+                cached_answer, similarity = lookup_first_answer(st.session_state.processed_file_hash, user_question, embeddings_studybuddy)
+                if cached_answer is not None:
+                    from langchain_core.documents import Document
+                    cached_sources = [Document(page_content=source["page_content"], metadata=source["metadata"]) for source in cached_answer["sources"]]
+                    st.session_state.last_used_sources = cached_sources
+                    st.session_state.chat_history.append({
+                        "role": "ai", "content": cached_answer["answer"], "sources": cached_sources,
+                        "cached_from": {"question": cached_answer["question"], "similarity": similarity},
+                    })
+                    st.rerun()
 
-                User's Current Question: {question}
-                
-                Elaborative Answer:""" # Your updated prompt
-                CHAT_QA_PROMPT = PromptTemplate(
-                    template=prompt_template_chat_qa, input_variables=["chat_history", "context", "question"]
-                )
+            with st.spinner("Thinking..."), telemetry.span("chat_turn", first_turn=is_first_turn):
+                # Older turns come from the rolling summary, so the prompt stops growing with the conversation
+                history_for_prompt, history_stats = st.session_state.chat_memory.prompt_history(st.session_state.chat_history[:-1])
                 
                 try:
-                    retrieved_docs = retriever.invoke(user_question) 
+                    retrieved_docs, retrieval_info = retrieve_for_question(st.session_state.vector_store, user_question)
                     st.session_state.last_used_sources = retrieved_docs 
 
-                    context_for_prompt = "\n\n".join([doc.page_content for doc in retrieved_docs])
-                    
-                    full_chat_prompt_str = CHAT_QA_PROMPT.format(
-                        chat_history=history_for_prompt if history_for_prompt else "No previous chat history for this question.",
-                        context=context_for_prompt,
-                        question=user_question
-                    )
+                    full_chat_prompt_str = build_chat_prompt(user_question, retrieved_docs, history_for_prompt)
                     
-                    ai_response_text = llm_qna.invoke(full_chat_prompt_str)
-                    st.session_state.chat_history.append({"role": "ai", "content": ai_response_text, "sources": retrieved_docs})
+                    if stream_responses:
+                        with st.chat_message("ai"):
+                            completion = CompletionStream(llm_qna, full_chat_prompt_str, "chat")
+                            ai_response_text = st.write_stream(completion)
+                    else:
+                        ai_response_text = invoke_completion(llm_qna, full_chat_prompt_str, "chat")
+                    prompt_size = dict(history_stats, prompt_tokens=estimate_tokens(full_chat_prompt_str))
+                    telemetry.record("chat.prompt_tokens", prompt_size["prompt_tokens"])
+                    st.session_state.chat_history.append({"role": "ai", "content": ai_response_text, "sources": retrieved_docs, "retrieval": retrieval_info, "prompt_size": prompt_size})
+                    st.session_state.chat_memory.schedule_compaction(st.session_state.chat_history, llm_qna)
+                    if is_first_turn:
+                        remember_first_answer(st.session_state.processed_file_hash, user_question, ai_response_text, retrieved_docs, embeddings_studybuddy)
                     st.rerun()
 
                 except Exception as e:
@@ -578,21 +668,77 @@ if st.session_state.get('vector_store') and st.session_state.get('documents_for_
             key=f"pq_style_guidance_{query_type_key_suffix}",
             help="Provide 2-3 examples in the 'question>>answer' format to guide the AI's style for the selected subject. Leave blank for general style."
         )
-        if st.button("Generate Questions", key=f"pq_generate_button_{query_type_key_suffix}"):
+        regenerate_pq = regenerate_checkbox("practice_questions")
+        whole_document_pq = whole_document_checkbox("practice_questions")
+        pq_job_slot = f"practice_questions:{query_type_key_suffix}"
+        # Kept in session state so the questions survive the next widget interaction
+        pq_session_key = f"practice_questions_text_{query_type_key_suffix}"
+        pq_report_key = f"practice_questions_report_{query_type_key_suffix}"
+        if st.button("Generate Questions", key=f"pq_generate_button_{query_type_key_suffix}", disabled=pq_job_slot in st.session_state.active_jobs):
+            st.session_state[pq_session_key] = ""
+            st.session_state[pq_report_key] = None
             if st.session_state.get('documents_for_direct_use'):
-                with st.spinner(f"Generating {selected_subject_for_pq} practice questions..."):
-                    all_doc_text = "\n".join([doc.page_content for doc in st.session_state.documents_for_direct_use])
-                    document_context_for_questions = all_doc_text[:700000] 
-                    questions_text = generate_practice_questions_with_guidance(
-                        subject_name=selected_subject_for_pq,
-                        document_text=document_context_for_questions,
-                        example_qa_style_guide=style_guidance_text,
-                        llm=llm_studybuddy 
+                pq_cache_key = current_tool_cache_key(
+                    "practice_questions", llm_studybuddy,
+                    subject=selected_subject_for_pq,
+                    style_guide_hash=hashlib.md5(style_guidance_text.encode('utf-8')).hexdigest(),
+                    token_budget=tool_budget("practice_questions"),
+                    **item_coverage_options(whole_document_pq)
+                )
+                questions_text = cached_tool_output(pq_cache_key, regenerate_pq)
+                if questions_text:
+                    st.session_state[pq_session_key] = questions_text
+                    show_cached_notice()
+                elif whole_document_pq:
+                    # One prompt per section, run in parallel in a background job
+                    start_job(
+                        pq_job_slot, ("practice_question_sections", pq_cache_key, regeneration_nonce(regenerate_pq)),
+                        run_sectioned_items_job, args=(
+                            llm_studybuddy, corpus, "practice_questions",
+                            {"subject_name": selected_subject_for_pq, "example_qa_style_guide": style_guidance_text, "regenerate": regenerate_pq},
+                            pq_cache_key
+                        )
                     )
-                    st.markdown("### Generated Practice Questions:")
-                    st.markdown(questions_text) 
+                else:
+                    with st.spinner(f"Generating {selected_subject_for_pq} practice questions..."), telemetry.span("tool", tool="practice_questions"):
+                        document_context_for_questions = pack_tool_context("practice_questions").text
+                        questions_text = generate_practice_questions_with_guidance(
+                            subject_name=selected_subject_for_pq,
+                            document_text=document_context_for_questions,
+                            example_qa_style_guide=style_guidance_text,
+                            llm=llm_studybuddy,
+                            stream=stream_responses
+                        )
+                        if stream_responses:
+                            # Render tokens live; the stored text is displayed below once complete
+                            pq_placeholder = st.empty()
+                            with pq_placeholder.container():
+                                st.write_stream(questions_text)
+                            pq_placeholder.empty()
+                            show_first_token_latency(questions_text)
+                            questions_text = questions_text.text
+                        warn_if_blocked(questions_text)
+                        st.session_state[pq_session_key] = questions_text
+                        remember_tool_output(pq_cache_key, questions_text, llm_studybuddy)
             else:
                 st.warning("Please upload and process a document first before generating questions.")
+
+        finished_pq = take_finished_job(pq_job_slot)
+        if finished_pq:
+            pq_job, _ = finished_pq
+            if pq_job.status == JOB_DONE:
+                st.session_state[pq_session_key] = pq_job.result["text"]
+                st.session_state[pq_report_key] = pq_job.result
+            elif pq_job.status == JOB_FAILED:
+                st.error(f"Error generating practice questions: {pq_job.error}")
+        elif pq_job_slot in st.session_state.active_jobs:
+            show_job_progress(pq_job_slot, "Generating practice questions")
+
+        if st.session_state.get(pq_session_key):
+            st.markdown("### Generated Practice Questions:")
+            if st.session_state.get(pq_report_key):
+                show_sectioned_items_report(st.session_state[pq_report_key])
+            st.markdown(st.session_state[pq_session_key])
     elif query_type == "Create Explanation":
         st.subheader("💡 Create Custom Explanation")
         explanation_style_selected = st.selectbox(
@@ -600,18 +746,37 @@ if st.session_state.get('vector_store') and st.session_state.get('documents_for_
             ("Normal", "Brainrot"),
             key=f"exp_style_select_{query_type_key_suffix}"
         )
+        regenerate_explanation = regenerate_checkbox("explanation")
         if st.button("Generate Explanation", key=f"exp_generate_button_{query_type_key_suffix}"):
             if st.session_state.get('documents_for_direct_use'):
-                with st.spinner(f"Generating '{explanation_style_selected}' style explanation..."):
-                    all_doc_text = "\n".join([doc.page_content for doc in st.session_state.documents_for_direct_use])
-                    document_context_for_explanation = all_doc_text[:700000] 
-                    explanation_text = generate_custom_explanation(
-                        document_text=document_context_for_explanation,
-                        explanation_style=explanation_style_selected,
-                        llm=llm_studybuddy2
-                    )
-                    st.markdown(f"### {explanation_style_selected} Explanation:")
+                # llm_studybuddy2 runs at temperature 1, so a few different explanations are kept and rotated
+                explanation_cache_key = current_tool_cache_key(
+                    "explanation", llm_studybuddy2,
+                    style=explanation_style_selected,
+                    token_budget=tool_budget("explanation")
+                )
+                explanation_text = cached_tool_output(explanation_cache_key, regenerate_explanation)
+                st.markdown(f"### {explanation_style_selected} Explanation:")
+                if explanation_text:
                     st.markdown(explanation_text)
+                    show_cached_notice()
+                else:
+                    with st.spinner(f"Generating '{explanation_style_selected}' style explanation..."), telemetry.span("tool", tool="explanation"):
+                        document_context_for_explanation = pack_tool_context("explanation").text
+                        explanation_text = generate_custom_explanation(
+                            document_text=document_context_for_explanation,
+                            explanation_style=explanation_style_selected,
+                            llm=llm_studybuddy2,
+                            stream=stream_responses
+                        )
+                        if stream_responses:
+                            st.write_stream(explanation_text)
+                            show_first_token_latency(explanation_text)
+                            explanation_text = explanation_text.text
+                        else:
+                            st.markdown(explanation_text)
+                        warn_if_blocked(explanation_text)
+                        remember_tool_output(explanation_cache_key, explanation_text, llm_studybuddy2)
             else:
                 st.warning("Please upload and process a document first before generating an explanation.")
     
@@ -624,117 +789,102 @@ if st.session_state.get('vector_store') and st.session_state.get('documents_for_
             st.session_state.mindmap_json_canvas = ""   # Clear previous
 
             if st.session_state.get('documents_for_direct_use'):
-                with st.spinner("Step 1: Extracting keywords..."):
-                    all_doc_text = "\n".join([doc.page_content for doc in st.session_state.documents_for_direct_use])
-                    document_context_for_mindmap = all_doc_text[:500000] # Adjust context as needed
-
-                    raw_keywords_output, central_topic, keywords = extract_keywords_for_mindmap(
-                        document_text=document_context_for_mindmap,
-                        llm=llm_studybuddy
-                    )
-                    st.session_state.mindmap_keywords_list = raw_keywords_output # Store the raw list with central topic
-
-                if central_topic and keywords:
-                    st.markdown("### Extracted Keywords:")
-                    st.markdown(st.session_state.mindmap_keywords_list) # Show the extracted list
-                    st.markdown("---")
-
-                    with st.spinner("Step 2: Generating JSON Canvas Mindmap... (This can be slow and experimental)"):
-                        # Provide the example JSON canvas string directly in the call
-                        example_canvas_str = """
-                        {
-                        "nodes": [
-                        {"id":"node_photosynthesis_center","x":-50,"y":-150,"width":280,"height":60,"type":"text","text":"Photosynthesis (Central Topic)"},
-                        {"id":"node_sunlight","x":-350,"y":-300,"width":200,"height":50,"type":"text","text":"Sunlight (Input)"},
-                        {"id":"node_water","x":-350,"y":-50,"width":200,"height":50,"type":"text","text":"Water (Input)"},
-                        {"id":"node_co2","x":250,"y":-300,"width":250,"height":50,"type":"text","text":"Carbon Dioxide (Input)"},
-                        {"id":"node_chlorophyll","x":-50,"y":-20,"width":250,"height":50,"type":"text","text":"Chlorophyll (Catalyst/Location)"},
-                        {"id":"node_glucose","x":-350,"y":100,"width":200,"height":50,"type":"text","text":"Glucose (Output)"},
-                        {"id":"node_oxygen","x":250,"y":100,"width":200,"height":50,"type":"text","text":"Oxygen (Output)"}
-                        ],
-                        "edges": [
-                        {"id":"edge_sun_photo","fromNode":"node_sunlight","toNode":"node_photosynthesis_center","label":"is required for"},
-                        {"id":"edge_water_photo","fromNode":"node_water","toNode":"node_photosynthesis_center","label":"is required for"},
-                        {"id":"edge_co2_photo","fromNode":"node_co2","toNode":"node_photosynthesis_center","label":"is required for"},
-                        {"id":"edge_chloro_photo","fromNode":"node_chlorophyll","toNode":"node_photosynthesis_center","label":"is site of / uses"},
-                        {"id":"edge_photo_glucose","fromNode":"node_photosynthesis_center","toNode":"node_glucose","label":"produces"},
-                        {"id":"edge_photo_oxygen","fromNode":"node_photosynthesis_center","toNode":"node_oxygen","label":"produces"}
-                        ]
-                        }                        """
-                        json_canvas_output = generate_json_canvas_from_keywords(
-                            central_topic=central_topic,
-                            keywords=keywords,
-                            llm=llm_studybuddy2, # Use LLM with Higher temperature
-                            example_canvas_json_str=example_canvas_str
-                        )
-                        st.session_state.mindmap_json_canvas = json_canvas_output
-                elif raw_keywords_output and "Error extracting keywords:" in raw_keywords_output:
-                    st.error(raw_keywords_output) # Show error from keyword extraction
+                # One model call for the topics and their links; the canvas layout is computed locally
+                with st.spinner("Generating mindmap..."), telemetry.span("tool", tool="mindmap"):
+                    mindmap = generate_mindmap(pack_tool_context("mindmap").text, llm_studybuddy)
+                if mindmap.get("error"):
+                    st.error(mindmap["error"])
+                    if mindmap.get("raw_output"):
+                        st.text_area("Problematic LLM Output:", mindmap["raw_output"], height=200)
                 else:
-                    st.warning("Could not extract enough information to generate a mindmap.")
+                    st.session_state.mindmap_keywords_list = mindmap_outline(mindmap)
+                    st.session_state.mindmap_json_canvas = json.dumps(mindmap["canvas"])
             else:
                 st.warning("Please upload and process a document first.")
 
-        if st.session_state.mindmap_keywords_list and not st.session_state.mindmap_json_canvas : # If keywords were extracted but mindmap not yet shown (e.g. after button click)
-            if "Error extracting keywords:" not in st.session_state.mindmap_keywords_list and \
-               "Unknown Central Topic" not in st.session_state.mindmap_keywords_list : # Avoid showing if only error
-                st.markdown("### Extracted Keywords:")
-                st.markdown(st.session_state.mindmap_keywords_list)
-                st.markdown("---")
-
+        if st.session_state.mindmap_keywords_list:
+            st.markdown("### Extracted Keywords:")
+            st.markdown(st.session_state.mindmap_keywords_list)
+            st.markdown("---")
 
         if st.session_state.mindmap_json_canvas:
             st.markdown("### JSON Canvas Mindmap Data:")
             
-            # Attempt to pretty-print if it's valid JSON, otherwise show raw
-            try:
-                parsed_json = json.loads(st.session_state.mindmap_json_canvas)
-                pretty_json_canvas = json.dumps(parsed_json, indent=2)
-                is_valid_json_for_download = True
-            except json.JSONDecodeError:
-                pretty_json_canvas = st.session_state.mindmap_json_canvas # Show raw if not valid
-                is_valid_json_for_download = False
-                st.warning("The generated mindmap data is not valid JSON. Download might not work as expected in canvas tools.")
-
+            # Laid out locally, so the canvas is always valid JSON
+            pretty_json_canvas = json.dumps(json.loads(st.session_state.mindmap_json_canvas), indent=2)
             st.text_area("JSON Canvas Output (for copying or inspection):", pretty_json_canvas, height=300, key=f"mindmap_json_output_{query_type_key_suffix}")
-            
-            if is_valid_json_for_download:
-                mindmap_file_name = f"mindmap_{header_file_name.replace(' ', '_').split('.')[0]}.canvas"
-                st.download_button(
-                    label="📥 Download Mindmap (.canvas file)",
-                    data=pretty_json_canvas.encode('utf-8'),
-                    file_name=mindmap_file_name,
-                    mime="application/json", # .canvas files are essentially JSON
-                    key=f"download_mindmap_{query_type_key_suffix}"
-                )
+
+            mindmap_file_name = f"mindmap_{header_file_name.replace(' ', '_').split('.')[0]}.canvas"
+            st.download_button(
+                label="📥 Download Mindmap (.canvas file)",
+                data=pretty_json_canvas.encode('utf-8'),
+                file_name=mindmap_file_name,
+                mime="application/json", # .canvas files are essentially JSON
+                key=f"download_mindmap_{query_type_key_suffix}"
+            )
             st.info("You can import this .canvas file into Obsidian or other compatible JSON Canvas tools.")
     # --- End NEW Section ---
     
     elif query_type == "Generate Flashcards (Term>>Definition)":
         # ... (Flashcard logic remains the same) ...
-        if st.button("Generate Flashcards", key=f"flashcard_button_{query_type_key_suffix}"):
-            with st.spinner("Generating flashcards..."):
-                all_doc_text = "\n".join([doc.page_content for doc in st.session_state.documents_for_direct_use])
-                context_limit_flashcards = 300000 
-                prompt_template_flashcards = f"""
-                Based ONLY on the following text, identify key words and their meanings.
-                Format each as 'Word>>Meaning'. Each flashcard should be on a new line.
-                Examples:
-                - 'Photosynthesis>>The process by which green plants use sunlight to synthesize foods with the help of chlorophyll.'
-                - 'Mitosis>>A type of cell division that results in two daughter cells each having the same number and kind of chromosomes as the parent nucleus.'
-                - 'Oblivious>>Unaware or unconcerned about what is happening around one.'
-                Text:
-                ---
-                {all_doc_text[:context_limit_flashcards]}
-                ---
-                Flashcards:
-                """
-                try:
-                    response_text = llm_studybuddy.invoke(prompt_template_flashcards)
-                    st.subheader("Flashcards:")
-                    st.text_area("Copy these flashcards:", response_text, height=400, key=f"flashcard_output_{query_type_key_suffix}")
-                except Exception as e:
-                    st.error(f"Error generating flashcards: {e}")
+        regenerate_flashcards = regenerate_checkbox("flashcards")
+        whole_document_flashcards = whole_document_checkbox("flashcards")
+        flashcards_job_slot = f"flashcards:{query_type_key_suffix}"
+        # Kept in session state so the cards survive the next widget interaction
+        flashcards_session_key = f"flashcards_text_{query_type_key_suffix}"
+        flashcards_report_key = f"flashcards_report_{query_type_key_suffix}"
+        if st.button("Generate Flashcards", key=f"flashcard_button_{query_type_key_suffix}", disabled=flashcards_job_slot in st.session_state.active_jobs):
+            st.session_state[flashcards_session_key] = ""
+            st.session_state[flashcards_report_key] = None
+            flashcards_cache_key = current_tool_cache_key(
+                "flashcards", llm_studybuddy, token_budget=tool_budget("flashcards"), **item_coverage_options(whole_document_flashcards)
+            )
+            response_text = cached_tool_output(flashcards_cache_key, regenerate_flashcards)
+            if response_text:
+                st.session_state[flashcards_session_key] = response_text
+                show_cached_notice()
+            elif whole_document_flashcards:
+                # One prompt per section, run in parallel in a background job
+                start_job(
+                    flashcards_job_slot, ("flashcard_sections", flashcards_cache_key, regeneration_nonce(regenerate_flashcards)),
+                    run_sectioned_items_job, args=(llm_studybuddy, corpus, "flashcards", {"regenerate": regenerate_flashcards}, flashcards_cache_key)
+                )
+            else:
+                with st.spinner("Generating flashcards..."), telemetry.span("tool", tool="flashcards"):
+                    document_context_for_flashcards = pack_tool_context("flashcards").text
+                    if stream_responses:
+                        # Show cards as they arrive, then swap in the copyable text area
+                        flashcard_placeholder = st.empty()
+                        completion = generate_flashcards(document_context_for_flashcards, llm_studybuddy, stream=True)
+                        with flashcard_placeholder.container():
+                            st.write_stream(completion)
+                        flashcard_placeholder.empty()
+                        show_first_token_latency(completion)
+                        response_text = completion.text
+                    else:
+                        response_text = generate_flashcards(document_context_for_flashcards, llm_studybuddy)
+                    if is_error_output(response_text):
+                        st.error(response_text)
+                    else:
+                        remember_tool_output(flashcards_cache_key, response_text, llm_studybuddy)
+                        st.session_state[flashcards_session_key] = response_text
+
+        finished_flashcards = take_finished_job(flashcards_job_slot)
+        if finished_flashcards:
+            flashcards_job, _ = finished_flashcards
+            if flashcards_job.status == JOB_DONE:
+                st.session_state[flashcards_session_key] = flashcards_job.result["text"]
+                st.session_state[flashcards_report_key] = flashcards_job.result
+            elif flashcards_job.status == JOB_FAILED:
+                st.error(f"Error generating flashcards: {flashcards_job.error}")
+        elif flashcards_job_slot in st.session_state.active_jobs:
+            show_job_progress(flashcards_job_slot, "Generating flashcards")
+
+        if st.session_state.get(flashcards_session_key):
+            st.subheader("Flashcards:")
+            if st.session_state.get(flashcards_report_key):
+                show_sectioned_items_report(st.session_state[flashcards_report_key])
+            st.text_area("Copy these flashcards:", st.session_state[flashcards_session_key], height=400, key=f"flashcard_output_{query_type_key_suffix}")
     
     elif query_type == "Summarize Document":
         # ... (Summarize Document logic remains the same) ...
@@ -743,35 +893,69 @@ if st.session_state.get('vector_store') and st.session_state.get('documents_for_
             st.session_state[summary_session_key] = ""
 
         summary_length = st.selectbox("Select summary length:", ("Short", "Medium", "Detailed"), key=f"summary_length_{query_type_key_suffix}")
-        if st.button("Summarize", key=f"summary_button_{query_type_key_suffix}"):
+        regenerate_summary = regenerate_checkbox("summary")
+        summary_job_slot = f"summary:{query_type_key_suffix}"
+
+        def write_summary(document_context_for_summary, summary_source_note, length, summary_cache_key):
+            prompt_template_summary = summary_prompt(document_context_for_summary, length, summary_source_note)
+            if stream_responses:
+                # Render tokens live; the stored text is displayed below once complete
+                summary_placeholder = st.empty()
+                completion = CompletionStream(llm_studybuddy, prompt_template_summary, "summary")
+                with summary_placeholder.container():
+                    response_text_summary = st.write_stream(completion)
+                summary_placeholder.empty()
+                show_first_token_latency(completion)
+            else:
+                response_text_summary = invoke_completion(llm_studybuddy, prompt_template_summary, "summary")
+            st.session_state[summary_session_key] = response_text_summary
+            remember_tool_output(summary_cache_key, response_text_summary, llm_studybuddy)
+
+        if st.button("Summarize", key=f"summary_button_{query_type_key_suffix}", disabled=summary_job_slot in st.session_state.active_jobs):
             st.session_state[summary_session_key] = "" 
-            with st.spinner("Summarizing..."):
+            with st.spinner("Summarizing..."), telemetry.span("tool", tool="summary"):
                 if st.session_state.get('documents_for_direct_use'):
-                    all_doc_text = "\n".join([doc.page_content for doc in st.session_state.documents_for_direct_use])
-                    context_limit_summary = 500000
-                    length_instruction = {
-                        "Short": "Provide a very brief, one-paragraph executive summary.",
-                        "Medium": "Provide a multi-paragraph summary covering the main sections and key arguments.",
-                        "Detailed": "Provide an elaborative summary, breaking down complex topics and highlighting all major sections, arguments, examples, and conclusions found in the text. Go over ALL concepts and ideas presented in the text"
-                    }
-                    prompt_template_summary = f"""
-                    Based ONLY on the following text, {length_instruction[summary_length]}
-                    Format the output in Markdown.
-                    Text:
-                    ---
-                    {all_doc_text[:context_limit_summary]}
-                    ---
-                    {summary_length} Summary (Formatted in Markdown):
-                    """
-                    try:
-                        response_text_summary = llm_studybuddy.invoke(prompt_template_summary)
-                        st.session_state[summary_session_key] = response_text_summary
-                    except Exception as e:
-                        st.error(f"Error generating summary: {e}")
-                        st.session_state[summary_session_key] = f"Error generating summary: {e}"
+                    summary_cache_key = current_tool_cache_key("summary", llm_studybuddy, length=summary_length, token_budget=tool_budget("summary"))
+                    cached_summary = cached_tool_output(summary_cache_key, regenerate_summary)
+                    if cached_summary:
+                        st.session_state[summary_session_key] = cached_summary
+                        show_cached_notice()
+                    elif needs_map_reduce_summary(corpus):
+                        # Too long for one prompt: summarize sections in parallel in a background job, then reduce
+                        start_job(
+                            summary_job_slot, ("summary_sections", corpus.content_hash, llm_identity(llm_studybuddy)),
+                            run_section_summary_job, args=(llm_studybuddy, corpus),
+                            context={"length": summary_length, "cache_key": summary_cache_key}
+                        )
+                    else:
+                        try:
+                            write_summary(pack_tool_context("summary").text, "", summary_length, summary_cache_key)
+                        except Exception as e:
+                            st.error(f"Error generating summary: {e}")
+                            st.session_state[summary_session_key] = f"Error generating summary: {e}"
                 else:
                     st.warning("No document loaded to summarize.")
                     st.session_state[summary_session_key] = "No document loaded to summarize."
+
+        finished_summary = take_finished_job(summary_job_slot)
+        if finished_summary:
+            summary_job, summary_context = finished_summary
+            if summary_job.status == JOB_DONE:
+                st.caption(f"📦 Long document: summarized {summary_job.result['section_count']} sections in parallel, then combined them.")
+                try:
+                    write_summary(
+                        summary_job.result["context"],
+                        SECTION_SUMMARIES_NOTE,
+                        summary_context["length"], summary_context["cache_key"]
+                    )
+                except Exception as e:
+                    st.error(f"Error generating summary: {e}")
+                    st.session_state[summary_session_key] = f"Error generating summary: {e}"
+            elif summary_job.status == JOB_FAILED:
+                st.error(f"Error generating summary: {summary_job.error}")
+                st.session_state[summary_session_key] = f"Error generating summary: {summary_job.error}"
+        elif summary_job_slot in st.session_state.active_jobs:
+            show_job_progress(summary_job_slot, "Summarizing long document")
         
         if st.session_state.get(summary_session_key):
             st.subheader(f"{summary_length} Summary:")
@@ -800,7 +984,50 @@ if st.session_state.get('vector_store') and st.session_state.get('documents_for_
 elif not GEMINI_API_KEY:
     st.warning("AI features are disabled as the API Key is not provided.")
 else:
-    st.info("👋 Upload a text-readable document in the sidebar to use the Study AI tools. For scanned PDFs, use the OCR section first.")
+    st.info("👋 Upload a document in the sidebar to use the Study AI tools. Scanned PDF pages are OCRed while the document is added.")
+
+# --- Performance panel: where the time of recent work went, stage by stage ---
+if st.sidebar.toggle("📊 Performance panel", value=False, key="show_performance_panel", help="Per-stage timings (load, split, embed, index, retrieve, prompt build, LLM, OCR) of recent work in this server process."):
+    with st.sidebar.expander("📊 Stage timings", expanded=True):
+        stage_rows = telemetry.stage_summary()
+        if stage_rows:
+            st.dataframe(
+                [{"Stage": row["stage"], "Count": row["count"], "p50 ms": round(row["p50_s"] * 1000),
+                  "p95 ms": round(row["p95_s"] * 1000), "Last ms": round(row["last_s"] * 1000)} for row in stage_rows],
+                hide_index=True
+            )
+            last_root = next((item for item in reversed(telemetry.recent_spans()) if item.parent_id is None), None)
+            if last_root:
+                st.caption(f"Last {last_root.name}: {last_root.duration_s * 1000:.0f} ms")
+                for item in telemetry.trace_spans(last_root.trace_id):
+                    if item is not last_root:
+                        counts = ", ".join(f"{key} {value:,}" for key, value in item.attributes.items() if key in ("chars", "chunks", "pages", "texts", "prompt_tokens", "output_tokens") and value)
+                        st.caption(f"· {item.name}: {item.duration_s * 1000:.0f} ms" + (f" ({counts})" if counts else ""))
+            st.download_button(
+                "📥 Download spans (JSON lines)", telemetry.export_spans_jsonl().encode("utf-8"),
+                file_name="study_ai_spans.jsonl", mime="application/x-ndjson", key="download_spans"
+            )
+        else:
+            st.caption("No timings recorded yet.")
 
 st.sidebar.markdown("---")
 st.sidebar.caption("Created by Yashraj.")
+
+# --- Startup / rerun latency ---
+# st.rerun() and st.stop() end a run early, so only runs that reach the end are measured.
+run_counter = get_process_run_counter()
+run_counter["runs"] += 1
+if run_counter["runs"] == 1:
+    run_kind = "cold_start"
+elif not st.session_state.get("_session_has_run"):
+    run_kind = "session_start"
+else:
+    run_kind = "rerun"
+st.session_state._session_has_run = True
+script_run_s = time.perf_counter() - _script_started
+telemetry.record("app.script_run_s", script_run_s, kind=run_kind)
+rerun_stats = telemetry.summarize("app.script_run_s", kind="rerun")
+st.sidebar.caption(
+    f"⏱️ This run: {script_run_s * 1000:.0f} ms ({run_kind.replace('_', ' ')})"
+    + (f" · warm rerun p50 {rerun_stats['p50'] * 1000:.0f} ms" if rerun_stats["count"] else "")
+)
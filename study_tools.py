@@ -0,0 +1,780 @@
+"""UI-independent core of Study AI, shared by the Streamlit app and the HTTP API.
+
+Everything here works on plain values (bytes, strings, DocumentCorpus, LangChain clients)
+and reports progress through callbacks, so it can run in a script run, a background job
+or a request handler. Both front ends use the same on-disk caches and document library.
+"""
+import json
+import sys
+import threading
+import uuid
+
+import telemetry
+from context_packer import pack_context, tool_budget
+from corpus import estimate_tokens
+from embedding_cache import CachedEmbeddings, EmbeddingPrefetcher
+from generation_cache import generation_key, get_generation_cache, is_error_output, max_variants_for
+from hybrid_retrieval import HybridRetriever
+from item_generation import ITEM_SECTION_TOKENS, SectionedItemGenerator
+from llm_streaming import CompletionStream, invoke_completion
+from mindmap_layout import layout_mindmap
+from ocr import GeminiOcrBackend, get_cached_document_ocr, get_ocr_backend, perform_parallel_ocr, store_document_ocr
+from pdf_extraction import iter_pdf_pages
+from qa_cache import get_answer_cache
+from summarizer import MapReduceSummarizer
+from vector_registry import get_vector_registry
+
+# --- Models ---
+LLM_MODEL_NAME = "gemini-3-flash-preview"
+OCR_SINGLE_REQUEST_MODEL_NAME = "gemini-3-flash-preview"
+EMBEDDING_MODEL_NAME = "models/gemini-embedding-001"
+EMBEDDING_CACHE_NAMESPACE = f"{EMBEDDING_MODEL_NAME}|retrieval_document"  # Shared by chunk and query vectors in the embedding cache
+
+# Chunking parameters are part of the shared index key: the same file split differently is a different index
+STUDY_CHUNK_SIZE = 1500
+STUDY_CHUNK_OVERLAP = 300
+CHAT_RETRIEVAL_K = 3
+
+_sqlite_swap_lock = threading.Lock()
+_sqlite_swapped = False
+
+
+class StudyIngestionError(Exception):
+    """Raised when an input can't be turned into a Study AI index; the message is shown to the user."""
+
+
+def use_pysqlite3_for_chroma():
+    """Swaps in pysqlite3-binary before ChromaDB is first imported (system sqlite3 may be too old)."""
+    global _sqlite_swapped
+    with _sqlite_swap_lock:
+        if _sqlite_swapped:
+            return True
+        _sqlite_swapped = True
+        try:
+            __import__('pysqlite3')
+            sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+            print("Successfully switched to pysqlite3-binary.")
+        except ImportError:
+            print("pysqlite3-binary not found, using system sqlite3. This might cause issues with ChromaDB if system sqlite3 is too old.")
+        except KeyError:
+            print("sqlite3 module already replaced or manipulated. Assuming pysqlite3-binary is in use if installed.")
+        return True
+
+
+def create_genai(api_key):
+    """Imports and configures google.generativeai (used directly for OCR)."""
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    return genai
+
+
+def create_study_models(api_key):
+    """Builds the LangChain LLM and embedding clients."""
+    from langchain_google_genai import GoogleGenerativeAI as LangChainGoogleGenerativeAI
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    return {
+        "llm_studybuddy": LangChainGoogleGenerativeAI(model=LLM_MODEL_NAME, temperature=0.7, google_api_key=api_key), # Lower temp for structured output
+        "llm_studybuddy2": LangChainGoogleGenerativeAI(model=LLM_MODEL_NAME, temperature=1, google_api_key=api_key),
+        "llm_qna": LangChainGoogleGenerativeAI(model=LLM_MODEL_NAME, temperature=0.7, google_api_key=api_key),
+        "embeddings_studybuddy": GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL_NAME, task_type="retrieval_document", google_api_key=api_key),
+    }
+
+
+# =============================================
+# OCR
+# =============================================
+
+def perform_ocr_with_gemini(genai, pdf_bytes, pdf_name, mime_type="application/pdf", progress=None):
+    """OCRs the whole PDF in one request. `progress(done, total, message)` gets status updates."""
+    import io
+
+    progress = progress or (lambda done=None, total=None, message=None: None)
+    uploaded_gemini_file = None
+    try:
+        progress(message="Uploading PDF to API...")
+        with telemetry.span("ocr.upload", bytes=len(pdf_bytes)):
+            uploaded_gemini_file = genai.upload_file(
+                path=io.BytesIO(pdf_bytes),
+                display_name=pdf_name,
+                mime_type=mime_type
+            )
+        progress(message="Extracting text with AI...")
+        with telemetry.span("ocr.generate", model=OCR_SINGLE_REQUEST_MODEL_NAME) as generate_span:
+            model_ocr = genai.GenerativeModel(model_name=OCR_SINGLE_REQUEST_MODEL_NAME)
+            prompt = [
+                "Please perform OCR on the provided PDF document and extract all text content and format it in markdown, with bold headings and leave lines wherever required.",
+                "Present the extracted text clearly. If there are multiple pages, try to indicate page breaks with something like '--- Page X ---' if possible, or just provide the continuous text.",
+                "Focus solely on extracting the text as accurately as possible from the document and formatting it properly.",
+                uploaded_gemini_file
+            ]
+            response = model_ocr.generate_content(prompt, request_options={"timeout": 600})
+            generate_span.set(output_chars=len(response.text))
+        return response.text
+    finally:
+        if uploaded_gemini_file is not None and hasattr(uploaded_gemini_file, 'name'):
+            try:
+                with telemetry.span("ocr.delete"):
+                    genai.delete_file(uploaded_gemini_file.name)
+            except Exception as e_delete: print(f"Could not delete temporary file from API: {e_delete}")
+
+
+def run_ocr(genai, pdf_bytes, pdf_name, mime_type="application/pdf", parallel=True, progress=None, backend="gemini"):
+    """OCRs a PDF through the OCR caches; returns {"text", "from_cache", "failed_ranges"}.
+
+    `backend` names the OCR engine (see ocr.ocr_backend_names). Only Gemini can take the
+    whole file in one request; other backends always work in page ranges.
+    """
+    with telemetry.span("ocr", bytes=len(pdf_bytes), parallel=parallel, backend=backend) as ocr_span:
+        result = _run_ocr(get_ocr_backend(backend, genai), genai, pdf_bytes, pdf_name, mime_type, parallel, progress)
+        ocr_span.set(from_cache=result["from_cache"], output_chars=len(result["text"] or ""), failed_ranges=len(result["failed_ranges"]))
+        return result
+
+
+def _run_ocr(ocr_backend, genai, pdf_bytes, pdf_name, mime_type, parallel, progress):
+    extracted_text = get_cached_document_ocr(pdf_bytes, cache_tag=ocr_backend.cache_tag)
+    if extracted_text:
+        return {"text": extracted_text, "from_cache": True, "failed_ranges": []}
+    if parallel or not isinstance(ocr_backend, GeminiOcrBackend):
+        # OCRs page ranges concurrently; only ranges that fail are retried
+        # Page-level caching happens inside: only uncached pages are sent to the API
+        if progress:
+            progress(message="Splitting PDF into page ranges...")
+        result = perform_parallel_ocr(
+            pdf_bytes, pdf_name, client=ocr_backend,
+            progress_callback=(lambda done, total: progress(done, total, f"{done}/{total} page ranges done")) if progress else None
+        )
+        return {"text": result.text, "from_cache": False, "failed_ranges": [page_range.label for page_range in result.failed_ranges]}
+    extracted_text = perform_ocr_with_gemini(genai, pdf_bytes, pdf_name, mime_type, progress=progress)
+    if extracted_text:
+        store_document_ocr(pdf_bytes, extracted_text)
+    return {"text": extracted_text, "from_cache": False, "failed_ranges": []}
+
+
+# =============================================
+# Ingestion and the document library
+# =============================================
+
+def ocr_scanned_pages(genai, pdf_bytes, pdf_name, pages, progress=None):
+    """OCRs only the given (scanned) pages of a PDF and puts their text into the page Documents.
+
+    The cost scales with the number of scanned pages, not the length of the PDF. OCRed
+    pages get `ocr=True` in their metadata; a page whose OCR failed keeps its extracted text.
+    """
+    page_numbers = [page.metadata["page"] + 1 for page in pages]
+    pages_by_number = dict(zip(page_numbers, pages))
+    if progress:
+        progress(0, len(page_numbers), f"OCR of {len(page_numbers)} scanned page(s)...")
+    progress_callback = (lambda done, total: progress(done, total, f"OCR of scanned pages: {done}/{total} ranges")) if progress else None
+    with telemetry.span("ocr", pages=len(page_numbers), targeted=True):
+        result = perform_parallel_ocr(pdf_bytes, pdf_name, client=genai, progress_callback=progress_callback, page_numbers=page_numbers)
+    failed_pages = {
+        number for page_range in result.failed_ranges for number in range(page_range.first_page, page_range.last_page + 1)
+    }
+    for page_key, text in result.page_texts.items():
+        if isinstance(page_key, str):
+            # The model merged a range it was asked to keep apart: the text goes on its first page
+            first, last = (int(number) for number in page_key.split("-"))
+            keys = [number for number in range(first, last + 1) if number in pages_by_number]
+            texts = [text] + [""] * (len(keys) - 1)
+        else:
+            keys, texts = [page_key], [text]
+        for number, page_text in zip(keys, texts):
+            if number in failed_pages:
+                continue
+            page = pages_by_number[number]
+            page.page_content = page_text
+            page.metadata["ocr"] = True
+
+
+def load_study_input(file_bytes, file_name, file_type, pasted_text, on_chunks=None, progress=None, ocr_client=None):
+    """Loads and splits one input into (pages, chunks), ready to be added to the library.
+
+    PDFs are read from memory and split page by page as pages come out of the parallel
+    extractor; `on_chunks(chunks)` receives each page's chunks straight away, so embedding
+    can start before the last page is read. Pages that look scanned are OCRed with
+    `ocr_client` (an OcrBackend, or the configured google.generativeai module) once extraction is done, and
+    their text takes the place of the empty text layer, in page order.
+    """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    from langchain_core.documents import Document # Import Document for manual creation
+
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=STUDY_CHUNK_SIZE, chunk_overlap=STUDY_CHUNK_OVERLAP)
+
+    def split_page(page):
+        # The splitter never joins text across documents, so page-by-page splitting gives the same chunks
+        page_chunks = [text for text in text_splitter.split_documents([page]) if text.page_content and text.page_content.strip()]
+        if on_chunks and page_chunks:
+            on_chunks(page_chunks)
+        return page_chunks
+
+    if file_bytes is not None and file_type == "application/pdf":
+        documents, chunks_by_page, scanned_positions = [], [], []
+        with telemetry.span("load", file_type=file_type, bytes=len(file_bytes)) as load_span:
+            for page in iter_pdf_pages(file_bytes, file_name):
+                if page.metadata.get("scanned") and ocr_client is not None:
+                    scanned_positions.append(len(documents))
+                    chunks_by_page.append([])  # Split once its OCR text is in
+                else:
+                    chunks_by_page.append(split_page(page))
+                documents.append(page)
+                if progress:
+                    total_pages = page.metadata["total_pages"]
+                    progress(len(documents), total_pages, f"Read page {len(documents)}/{total_pages}")
+            load_span.set(pages=len(documents), chars=sum(len(doc.page_content) for doc in documents), scanned=len(scanned_positions))
+
+        if scanned_positions:
+            ocr_scanned_pages(ocr_client, file_bytes, file_name, [documents[position] for position in scanned_positions], progress)
+            for position in scanned_positions:
+                chunks_by_page[position] = split_page(documents[position])
+        valid_texts = [chunk for page_chunks in chunks_by_page for chunk in page_chunks]
+
+        # Check for empty PDF content (scanned pages were OCRed above when a client was given)
+        if not any(doc.page_content.strip() for doc in documents):
+            raise StudyIngestionError("Uploaded PDF has no extractable text. Use OCR section first.")
+    else:
+        if file_bytes is not None:
+            with telemetry.span("load", file_type=file_type, bytes=len(file_bytes)):
+                text = file_bytes.decode("utf-8")
+        else:
+            text = pasted_text
+        documents = [Document(page_content=text, metadata={"source": file_name or "Pasted Text"})]
+
+        with telemetry.span("split", pages=len(documents), chunk_size=STUDY_CHUNK_SIZE) as split_span:
+            texts = text_splitter.split_documents(documents)
+            valid_texts = [text for text in texts if text.page_content and text.page_content.strip()]
+            split_span.set(chunks=len(valid_texts), chars=sum(len(text.page_content) for text in valid_texts))
+    if not valid_texts:
+        raise StudyIngestionError("No valid text chunks after splitting for Study Buddy.")
+    return documents, valid_texts
+
+
+def index_document(library, library_name, doc_id, doc_name, file_bytes, file_type, pasted_text, embeddings,
+                   edited_content_hash=None, progress=None, ocr_client=None, edit_sequence=None):
+    """Embeds one input into the persistent library and returns the embedding stats.
+
+    With `edited_content_hash`, `doc_id` is an existing document being re-indexed after an
+    edit: only its changed chunks are embedded, and the write is dropped if an edit with a
+    later `edit_sequence` (see DocumentLibrary.next_edit_sequence) was already written. Other
+    documents are left untouched.
+    With `ocr_client`, scanned pages of a PDF are OCRed on the way in (see `load_study_input`).
+    """
+    use_pysqlite3_for_chroma()
+    with telemetry.span("ingest", doc_id=doc_id, edited=bool(edited_content_hash)):
+        return _index_document(library, library_name, doc_id, doc_name, file_bytes, file_type, pasted_text, embeddings,
+                               edited_content_hash, progress, ocr_client, edit_sequence)
+
+
+def _index_document(library, library_name, doc_id, doc_name, file_bytes, file_type, pasted_text, embeddings,
+                    edited_content_hash, progress, ocr_client, edit_sequence):
+    try:
+        if not edited_content_hash and library.is_indexed(doc_id):
+            # Another library already indexed this content: its pages, chunks and vectors are reused as they are.
+            # Extracting again would also skip the OCR of scanned pages, leaving a scanned PDF with no text.
+            library.add_document(library_name, doc_id, doc_name, [], [], embeddings, EMBEDDING_CACHE_NAMESPACE)
+            return {"added": 0, "removed": 0, "kept": 0, "hits": 0, "misses": 0, "ocr_pages": 0}
+        if progress:
+            progress(message="Reading and splitting...")
+        # A new PDF starts embedding while later pages are still being extracted
+        prefetcher = None
+        new_pdf = file_type == "application/pdf" and not edited_content_hash
+        if new_pdf:
+            prefetcher = EmbeddingPrefetcher(CachedEmbeddings(embeddings, EMBEDDING_CACHE_NAMESPACE))
+        try:
+            documents, chunks = load_study_input(
+                file_bytes, doc_name, file_type, pasted_text,
+                on_chunks=(lambda page_chunks: prefetcher.add([chunk.page_content for chunk in page_chunks])) if prefetcher else None,
+                progress=progress, ocr_client=ocr_client if new_pdf else None
+            )
+            if prefetcher:
+                if progress:
+                    progress(message="Embedding the last pages...")
+                prefetched = prefetcher.finish()
+        except BaseException:
+            if prefetcher:
+                prefetcher.cancel()
+            raise
+        # Chunks that were embedded before (by anyone, in any session) come from the on-disk cache
+        # Misses are embedded in concurrent, rate-limited batches; progress is reported per batch
+        progress_callback = (lambda done, total: progress(done, total, f"Embedded batch {done}/{total}")) if progress else None
+        if edited_content_hash:
+            return library.update_document(
+                library_name, doc_id, doc_name, documents, chunks, edited_content_hash,
+                embeddings, EMBEDDING_CACHE_NAMESPACE, progress_callback=progress_callback, edit_sequence=edit_sequence
+            )
+        stats = library.add_document(
+            library_name, doc_id, doc_name, documents, chunks,
+            embeddings, EMBEDDING_CACHE_NAMESPACE, progress_callback=progress_callback
+        )
+        if prefetcher:
+            # The write found the prefetched vectors in the cache; they were misses when embedded
+            stats["hits"] = max(0, stats["hits"] - prefetched["misses"])
+            stats["misses"] += prefetched["misses"]
+        stats["ocr_pages"] = sum(1 for doc in documents if doc.metadata.get("ocr"))
+        return stats
+    except StudyIngestionError:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"Error processing Study AI content: {e}") from e
+
+
+def open_study_selection(library, library_name, doc_ids, embeddings):
+    """Returns a shared handle (SharedVectorStore) on the selected documents; call `release()` when done.
+
+    Sessions and API requests studying the same selection share one index, built by
+    whichever got there first.
+    """
+    use_pysqlite3_for_chroma()
+    registry_key = (library_name, tuple(sorted(doc_ids)), STUDY_CHUNK_SIZE, STUDY_CHUNK_OVERLAP, EMBEDDING_MODEL_NAME)
+    return get_vector_registry().acquire(
+        registry_key,
+        lambda: library.open_selection(library_name, doc_ids, CachedEmbeddings(embeddings, EMBEDDING_CACHE_NAMESPACE))
+    )
+
+
+def forget_document(library, library_name, doc_id):
+    """Removes a document from a library and drops every cached selection that contains it."""
+    library.remove_document(library_name, doc_id)
+    get_vector_registry().invalidate(lambda key: doc_id in key[1])
+
+
+# =============================================
+# Generation cache helpers
+# =============================================
+
+def tool_cache_key(document_hash, tool, llm, **options):
+    """Generation cache key for a tool run on a document (or selection) content hash."""
+    return generation_key(document_hash, tool, options, llm)
+
+
+def regeneration_nonce(regenerate):
+    """Part of a generation job's key, so a regenerate request never joins an earlier (finished) job."""
+    return uuid.uuid4().hex if regenerate else None
+
+
+def cached_tool_output(cache_key, regenerate=False):
+    if regenerate:
+        return None
+    return get_generation_cache().get(cache_key)
+
+
+def remember_tool_output(cache_key, text, llm):
+    if not is_error_output(text):
+        get_generation_cache().add(cache_key, text, max_variants=max_variants_for(llm))
+
+
+def packed_tool_context(corpus, tool):
+    """The document text for a tool prompt, fitted to the tool's token budget (a PackedContext)."""
+    with telemetry.span("prompt_build", tool=tool) as build_span:
+        packed = pack_context(corpus, tool_budget(tool))
+        build_span.set(chars=len(packed.text), complete=packed.is_complete)
+        return packed
+
+
+def is_blocked_output(text):
+    return text.startswith("Response blocked")
+
+
+# =============================================
+# Chat
+# =============================================
+
+CHAT_QA_PROMPT_TEMPLATE = """You are an helpful expert in all fields of study and the best generalist on earth who understands everything well. Use the following pieces of context from a document AND the preceding chat history to answer the user's current question.
+                Provide a explanatory and elaborative answer based SOLELY on the provided context and chat history.
+                If the question is a follow-up, use the chat history to understand the context of the follow-up.
+                If you don't know the answer from the context, just say that you don't know, don't try to make up an answer.
+                Explain the concepts clearly and show your thinking.
+
+                Chat History (if any):
+                {chat_history}
+
+                Retrieved Context from Document:
+                {context}
+
+                User's Current Question: {question}
+
+                Elaborative Answer:"""
+
+
+def retrieve_for_question(study_index, question, k=CHAT_RETRIEVAL_K):
+    """Returns (retrieved chunks, retrieval info) from a selection handle."""
+    retriever = HybridRetriever(study_index, study_index.lexical_index, k=k)
+    retrieved_docs = retriever.invoke(question)
+    return retrieved_docs, retriever.last_run
+
+
+def build_chat_prompt(question, retrieved_docs, history_text):
+    with telemetry.span("prompt_build", tool="chat") as build_span:
+        prompt = CHAT_QA_PROMPT_TEMPLATE.format(
+            chat_history=history_text if history_text else "No previous chat history for this question.",
+            context="\n\n".join(doc.page_content for doc in retrieved_docs),
+            question=question
+        )
+        build_span.set(chars=len(prompt), tokens=estimate_tokens(prompt), history_chars=len(history_text or ""))
+        return prompt
+
+
+def lookup_first_answer(document_hash, question, embeddings):
+    """Cached answer to a first question about a document: (entry, similarity) or (None, None).
+
+    Follow-ups must never be looked up here: their answer depends on the conversation.
+    """
+    query_embedder = CachedEmbeddings(embeddings, EMBEDDING_CACHE_NAMESPACE)
+    try:
+        entry, similarity = get_answer_cache().lookup(document_hash, question, embed_query=query_embedder.embed_query)
+    except Exception as e:
+        print(f"Answer cache lookup failed, answering normally: {e}")
+        return None, None
+    if entry is not None:
+        telemetry.record("chat.answer_cache", 1, match="exact" if similarity >= 1.0 else "similar")
+    return entry, similarity
+
+
+def remember_first_answer(document_hash, question, answer, retrieved_docs, embeddings):
+    if is_error_output(answer):
+        return
+    telemetry.record("chat.answer_cache", 0, match="miss")
+    query_embedder = CachedEmbeddings(embeddings, EMBEDDING_CACHE_NAMESPACE)
+    get_answer_cache().add(
+        document_hash, question, answer,
+        [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in retrieved_docs],
+        embedding=query_embedder.embed_query(question),
+    )
+
+
+# =============================================
+# Practice questions, explanations, flashcards, summaries
+# =============================================
+
+def _blocked_or_error(e, tool_label):
+    if "response was blocked" in str(e).lower() or "safety settings" in str(e).lower():
+        return "Response blocked due to safety settings. Please check your input or document content."
+    return f"Error generating {tool_label}: {e}"
+
+
+def _complete(llm, prompt, tool, tool_label, stream):
+    """A CompletionStream when streaming, else the text; errors become a readable message either way."""
+    on_error = lambda e: _blocked_or_error(e, tool_label)
+    if stream: # Caller renders the tokens as they arrive
+        return CompletionStream(llm, prompt, tool, on_error=on_error)
+    try:
+        return invoke_completion(llm, prompt, tool)
+    except Exception as e:
+        return on_error(e)
+
+
+PRACTICE_QUESTION_PROMPT_TEMPLATE = """You are an expert AI assistant tasked with generating practice questions for a {subject_name} exam, based ONLY on the provided "Document Text". Your goal is to emulate the style, type, and difficulty of the "Example Questions and Answers" provided for style guidance.
+Instructions:
+1.  Carefully review the "Document Text".
+2.  Carefully review the "Example Questions and Answers" to understand the desired style, question types, and answer format for {subject_name}.
+3.  Generate as many new and distinct practice questions based on the "Document Text" as you can.
+4.  The generated questions should be similar in nature to the provided examples.
+5.  For each question you generate, provide an answer based *strictly* on the information within the "Document Text".
+6.  Output Format:
+    *   Each question-answer pair must be on a new line and leave a line between two pairs.
+    *   Separate the question from its answer using ONLY ">>" (two greater-than signs with no spaces around them).
+    *   The entire output should be formatted in Markdown.
+    *   Do NOT number the questions.
+Example Questions and Answers for {subject_name} (Follow this style):
+{example_questions_and_answers}
+Document Text:
+{document_text}
+Generated Practice Questions for {subject_name} (question>>answer format):
+"""
+
+
+def practice_questions_prompt(subject_name, document_text, example_qa_style_guide):
+    return PRACTICE_QUESTION_PROMPT_TEMPLATE.format(
+        subject_name=subject_name,
+        document_text=document_text,
+        example_questions_and_answers=example_qa_style_guide if example_qa_style_guide.strip() else "No specific style examples provided by user. Generate general questions suitable for the subject, inferring common question types for the specified subject based on the document text."
+    )
+
+
+def generate_practice_questions_with_guidance(subject_name, document_text, example_qa_style_guide, llm, stream=False):
+    formatted_prompt = practice_questions_prompt(subject_name, document_text, example_qa_style_guide)
+    return _complete(llm, formatted_prompt, "practice_questions", "practice questions", stream)
+
+
+EXPLANATION_COMMON_INSTRUCTIONS = """
+    Your goal is to explain the core concepts from the provided "Document Text" in an engaging way.
+    Ensure ALL concepts from the text are covered.
+    Use vivid metaphors and analogies to aid understanding.
+    The explanation should be detailed and formatted in Markdown.
+    Base your explanation SOLELY on the provided "Document Text".
+    """
+EXPLANATION_STYLE_PROMPTS = {
+    "brainrot": f""" {EXPLANATION_COMMON_INSTRUCTIONS}
+            Role: You are a super-online Gen Z tutor who explains things with maximum "brainrot" and internet slang, but still makes it make sense.
+            Style:
+            - Keep it relatively short, like a quick, punchy explainer but cover all major concepts.
+            - Use current Gen Z slang, internet memes, and "brainrot" terminology (e.g., "rizz", "no cap", "it's giving...", "sus", "delulu", "based", "sigma", "gyatt" if contextually (and hilariously inappropriately) relevant, "skibidi", "fanum tax" – use these creatively and where they might (absurdly) fit an analogy).
+            - Make the metaphors and analogies extremely online and relatable to internet culture.
+            - It should be funny, a bit unhinged, but ultimately help someone "get" the concepts through the absurdity.
+            - Don't be afraid to be a little chaotic, but ensure the core information is still conveyed.
+            Document Text:
+            ```
+            {{document_text}}
+            ```
+            "Brainrot" Explanation (covering all major concepts with slang, metaphors, and analogies):
+        """,
+    "normal": f""" {EXPLANATION_COMMON_INSTRUCTIONS}
+            Role: You are a clear and patient educator.
+            Style:
+            - The explanation should be comprehensive but concise, it should cover all major concepts in an easily digestable format.
+            - Use clear, easy-to-understand language.
+            - Employ insightful metaphors and analogies to clarify complex points.
+            - Maintain a helpful and encouraging tone.
+            Document Text:
+            ```
+            {{document_text}}
+            ```
+            Normal Explanation (covering all major concepts with clear metaphors and analogies):
+        """
+}
+
+
+def generate_custom_explanation(document_text, explanation_style, llm, stream=False):
+    selected_prompt_template = EXPLANATION_STYLE_PROMPTS.get(explanation_style.lower(), EXPLANATION_STYLE_PROMPTS["normal"])
+    formatted_prompt = selected_prompt_template.format(document_text=document_text)
+    return _complete(llm, formatted_prompt, "explanation", "explanation", stream)
+
+
+FLASHCARDS_PROMPT_TEMPLATE = """
+                    Based ONLY on the following text, identify key words and their meanings.
+                    Format each as 'Word>>Meaning'. Each flashcard should be on a new line.
+                    Examples:
+                    - 'Photosynthesis>>The process by which green plants use sunlight to synthesize foods with the help of chlorophyll.'
+                    - 'Mitosis>>A type of cell division that results in two daughter cells each having the same number and kind of chromosomes as the parent nucleus.'
+                    - 'Oblivious>>Unaware or unconcerned about what is happening around one.'
+                    Text:
+                    ---
+                    {document_text}
+                    ---
+                    Flashcards:
+                    """
+
+
+def generate_flashcards(document_text, llm, stream=False):
+    return _complete(llm, FLASHCARDS_PROMPT_TEMPLATE.format(document_text=document_text), "flashcards", "flashcards", stream)
+
+
+# Sectioned generation: every section of the corpus gets its own prompt, so long books are covered to the end
+SECTIONED_ITEM_TOOLS = {"flashcards": "flashcards", "practice_questions": "practice questions"}
+ITEM_SEPARATORS = {"flashcards": "\n", "practice_questions": "\n\n"}  # Matches the line spacing each prompt asks for
+
+
+def needs_sectioned_items(corpus, tool):
+    """Whether a single prompt would leave part of the corpus out of this tool's items."""
+    return corpus.token_count > tool_budget(tool)
+
+
+def item_coverage_options(whole_document):
+    """Extra cache-key options of a sectioned run, so its output is cached apart from the single-prompt one."""
+    return {"coverage": "sections", "section_tokens": ITEM_SECTION_TOKENS} if whole_document else {}
+
+
+def generate_items_by_section(llm, corpus, tool, progress=None, subject_name="General", example_qa_style_guide="", regenerate=False):
+    """Flashcards or practice questions for the whole corpus, one prompt per section, merged without near-duplicates.
+
+    Returns {"text", "item_count", "section_count", "duplicates_removed", "failed_sections"};
+    `text` uses the same 'front>>back' lines as the single-prompt tools.
+    """
+    if tool == "flashcards":
+        build_prompt = lambda text: FLASHCARDS_PROMPT_TEMPLATE.format(document_text=text)
+    else:
+        build_prompt = lambda text: practice_questions_prompt(subject_name, text, example_qa_style_guide)
+    def report_item_progress(done, total):
+        if progress:
+            progress(done, total, f"Generating {SECTIONED_ITEM_TOOLS[tool]}: section {done}/{total}")
+    result = SectionedItemGenerator(llm).generate(corpus, build_prompt, tool, progress_callback=report_item_progress, regenerate=regenerate)
+    if not result["items"]:
+        reason = "; ".join(result["failed_sections"][:3]) or "the model returned no 'front>>back' lines"
+        raise RuntimeError(f"No {SECTIONED_ITEM_TOOLS[tool]} were generated: {reason}")
+    return {
+        "text": ITEM_SEPARATORS[tool].join(result["items"]),
+        "item_count": len(result["items"]),
+        "section_count": result["section_count"],
+        "duplicates_removed": result["duplicates_removed"],
+        "failed_sections": result["failed_sections"],
+    }
+
+
+SUMMARY_LENGTH_INSTRUCTIONS = {
+    "Short": "Provide a very brief, one-paragraph executive summary.",
+    "Medium": "Provide a multi-paragraph summary covering the main sections and key arguments.",
+    "Detailed": "Provide an elaborative summary, breaking down complex topics and highlighting all major sections, arguments, examples, and conclusions found in the text. Go over ALL concepts and ideas presented in the text"
+}
+SECTION_SUMMARIES_NOTE = "The text below consists of summaries of every section of a long document, in order. Write the summary of the whole document from them."
+
+
+def summary_prompt(document_text, length, source_note=""):
+    return f"""
+            {source_note}
+            Based ONLY on the following text, {SUMMARY_LENGTH_INSTRUCTIONS[length]}
+            Format the output in Markdown.
+            Text:
+            ---
+            {document_text}
+            ---
+            {length} Summary (Formatted in Markdown):
+            """
+
+
+def needs_map_reduce_summary(corpus):
+    return corpus.token_count > tool_budget("summary")
+
+
+def summarize_sections(llm, corpus, progress=None):
+    """The map-reduce part of summarizing a document too long for one prompt.
+
+    Returns {"context", "section_count"}; `context` is then summarized with `summary_prompt`
+    and SECTION_SUMMARIES_NOTE.
+    """
+    summarizer = MapReduceSummarizer(llm)
+    def report_summary_progress(stage, done, total):
+        if progress:
+            label = "Summarizing sections" if stage == "section_summary" else "Combining section summaries"
+            progress(done, total, f"{label}: {done}/{total}")
+    section_summaries = summarizer.map(corpus, progress_callback=report_summary_progress)
+    return {"context": summarizer.reduce(section_summaries, progress_callback=report_summary_progress), "section_count": len(section_summaries)}
+
+
+# =============================================
+# Mindmap
+# =============================================
+
+MINDMAP_MAX_TOPICS = 20
+
+MINDMAP_PROMPT_TEMPLATE = """Based on the following Document Text, identify the main central topic and 10-15 key related concepts, terms, or sub-topics, and how they relate to each other.
+The goal is to gather elements for creating a mind map. The layout is computed separately: do not output positions or sizes.
+
+Return ONLY a JSON object, without markdown fences or any other text, of exactly this shape:
+{{"central_topic": "...", "topics": ["...", "..."], "edges": [{{"from": "...", "to": "...", "label": "..."}}]}}
+
+Rules:
+- "topics": the key concepts, at most 6 words each, without repeating the central topic.
+- "edges": each "from" and "to" is the central topic or one of the topics, written exactly as above; "label" is a short phrase for the relationship (e.g. "produces", "is part of", "leads to").
+- Connect every topic to the central topic or to another topic, and add links between topics wherever the document relates them.
+
+Document Text:
+```
+{document_text}
+```
+
+JSON:"""
+
+# Gemini's JSON output mode: the reply is exactly one object of this shape (Schema proto field names)
+MINDMAP_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": {
+        "type_": "OBJECT",
+        "properties": {
+            "central_topic": {"type_": "STRING"},
+            "topics": {"type_": "ARRAY", "items": {"type_": "STRING"}},
+            "edges": {
+                "type_": "ARRAY",
+                "items": {
+                    "type_": "OBJECT",
+                    "properties": {"from": {"type_": "STRING"}, "to": {"type_": "STRING"}, "label": {"type_": "STRING"}},
+                    "required": ["from", "to"],
+                },
+            },
+        },
+        "required": ["central_topic", "topics", "edges"],
+    },
+}
+
+
+def _load_mindmap_json(text):
+    """The graph object of a reply: all of it in JSON mode, else the first object with a central topic.
+
+    The fallback scans every "{" with a JSON decoder, so prose around the object (even
+    prose containing braces) doesn't break it.
+    """
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError as e:
+        error = e
+    decoder = json.JSONDecoder()
+    start = text.find("{")
+    while start != -1:
+        try:
+            data, _ = decoder.raw_decode(text, start)
+            if isinstance(data, dict) and "central_topic" in data:
+                return data
+        except json.JSONDecodeError:
+            pass
+        start = text.find("{", start + 1)
+    raise ValueError(f"no JSON object in the response ({error})")
+
+
+def parse_mindmap_graph(response):
+    """Validates the model's topics-and-edges JSON.
+
+    Returns {"central_topic", "topics", "edges"} with edges as (from, to, label) node
+    indices (0 is the central topic). Unknown endpoints, self-loops and repeated links
+    are dropped, and a topic left unconnected is linked to the central topic.
+    Raises ValueError when there is no usable graph.
+    """
+    data = _load_mindmap_json(response.strip())
+    if not isinstance(data, dict):
+        raise ValueError("the response is not a JSON object")
+    central_topic = str(data.get("central_topic") or "").strip()
+    if not central_topic:
+        raise ValueError("no central topic")
+
+    index_by_name = {central_topic.lower(): 0}
+    topics = []
+    for topic in data.get("topics") or []:
+        topic = str(topic).strip()
+        if topic and topic.lower() not in index_by_name and len(topics) < MINDMAP_MAX_TOPICS:
+            topics.append(topic)
+            index_by_name[topic.lower()] = len(topics)
+    if not topics:
+        raise ValueError("no topics")
+
+    edges, linked_pairs = [], set()
+    for edge in data.get("edges") or []:
+        if not isinstance(edge, dict):
+            continue
+        source = index_by_name.get(str(edge.get("from", "")).strip().lower())
+        target = index_by_name.get(str(edge.get("to", "")).strip().lower())
+        if source is None or target is None or source == target or frozenset((source, target)) in linked_pairs:
+            continue
+        linked_pairs.add(frozenset((source, target)))
+        edges.append((source, target, str(edge.get("label") or "").strip()))
+    linked = {node for pair in linked_pairs for node in pair}
+    edges.extend((0, index, "") for index in range(1, len(topics) + 1) if index not in linked)
+    return {"central_topic": central_topic, "topics": topics, "edges": edges}
+
+
+def generate_mindmap(document_text, llm):
+    """One LLM call in JSON mode for the concept graph, then a local layout into JSON Canvas.
+
+    Returns {"central_topic", "topics", "edges", "canvas"}; on failure a dict with an
+    "error" key (and the raw model output when it could not be parsed).
+    """
+    try:
+        response = invoke_completion(
+            llm, MINDMAP_PROMPT_TEMPLATE.format(document_text=document_text), "mindmap", generation_config=MINDMAP_GENERATION_CONFIG
+        )
+    except Exception as e:
+        return {"error": _blocked_or_error(e, "mindmap")}
+    try:
+        graph = parse_mindmap_graph(response)
+    except ValueError as e:  # json.JSONDecodeError included
+        return {"error": "Failed to read the mindmap topics from the model's answer.", "details": str(e), "raw_output": response}
+    with telemetry.span("mindmap_layout", nodes=len(graph["topics"]) + 1, edges=len(graph["edges"])):
+        graph["canvas"] = layout_mindmap(graph["central_topic"], graph["topics"], graph["edges"])
+    return graph
+
+
+def mindmap_outline(mindmap):
+    """The central topic, topics and relationships of a generated mindmap as markdown."""
+    names = [mindmap["central_topic"]] + mindmap["topics"]
+    lines = [f"**Central Topic:** {mindmap['central_topic']}", "", "**Keywords:**"]
+    lines.extend(f"- {topic}" for topic in mindmap["topics"])
+    relationships = [f"- {names[source]} → *{label}* → {names[target]}" for source, target, label in mindmap["edges"] if label]
+    if relationships:
+        lines.extend(["", "**Relationships:**"] + relationships)
+    return "\n".join(lines)
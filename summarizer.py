@@ -0,0 +1,161 @@
+import contextvars
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import telemetry
+from corpus import estimate_tokens
+from generation_cache import get_generation_cache, llm_identity
+
+# --- Map-reduce summarization configuration ---
+SUMMARY_SECTION_TOKENS = int(os.getenv("STUDY_AI_SUMMARY_SECTION_TOKENS", "30000"))
+SUMMARY_REDUCE_TOKENS = int(os.getenv("STUDY_AI_SUMMARY_REDUCE_TOKENS", "100000"))
+SUMMARY_MAX_WORKERS = int(os.getenv("STUDY_AI_SUMMARY_WORKERS", "6"))
+SECTION_PROMPT_VERSION = "v1"  # Bump when SECTION_SUMMARY_PROMPT changes so cached section summaries are dropped
+
+SECTION_SUMMARY_PROMPT = """
+You are summarizing one section of a longer document. Your summary will be combined with the summaries of the other sections to produce the final summary, so be thorough.
+Keep every key concept, definition, formula, date, argument, example and conclusion in this section. Do not add anything that is not in the text.
+Format the output as Markdown bullet points grouped under short bold headings.
+Section ({location}):
+---
+{text}
+---
+Section Summary:
+"""
+
+COMBINE_SUMMARIES_PROMPT = """
+The following are summaries of consecutive parts of a long document. Merge them into one summary of all these parts.
+Keep every key concept, definition, formula, date, argument, example and conclusion. Remove repetition. Do not add anything that is not in the summaries.
+Format the output as Markdown bullet points grouped under short bold headings.
+Summaries:
+---
+{text}
+---
+Combined Summary:
+"""
+
+
+class Section:
+    """Consecutive chunks of the corpus summarized together in the map step."""
+
+    def __init__(self, chunks, chunk_ids):
+        self.chunks = chunks
+        self.chunk_ids = chunk_ids
+        self.text = "\n".join(chunk.page_content for chunk in chunks)
+
+    @property
+    def location(self):
+        pages = [chunk.metadata.get("page") for chunk in self.chunks if chunk.metadata.get("page") is not None]
+        if not pages:
+            return "part of the text"
+        first, last = min(pages) + 1, max(pages) + 1  # PyPDFLoader pages are 0-based
+        return f"page {first}" if first == last else f"pages {first}-{last}"
+
+
+def build_sections(corpus, section_tokens=SUMMARY_SECTION_TOKENS):
+    """Groups the corpus chunks, in order, into sections of about `section_tokens` tokens."""
+    sections = []
+    current_chunks, current_ids, current_tokens = [], [], 0
+    for chunk, chunk_id in zip(corpus.chunks, corpus.chunk_ids):
+        tokens = estimate_tokens(chunk.page_content)
+        if current_chunks and current_tokens + tokens > section_tokens:
+            sections.append(Section(current_chunks, current_ids))
+            current_chunks, current_ids, current_tokens = [], [], 0
+        current_chunks.append(chunk)
+        current_ids.append(chunk_id)
+        current_tokens += tokens
+    if current_chunks:
+        sections.append(Section(current_chunks, current_ids))
+    return sections
+
+
+class MapReduceSummarizer:
+    """Summarizes documents too long for one prompt.
+
+    Map: every section is summarized concurrently by a bounded worker pool; section
+    summaries are cached by the hashes of the section's chunks and don't depend on the
+    requested summary length, so switching Short/Medium/Detailed reuses them.
+    Reduce: summaries are merged in groups until they fit SUMMARY_REDUCE_TOKENS; the
+    caller then runs the final, length-specific prompt (and can stream it).
+    """
+
+    def __init__(self, llm, cache=None, max_workers=SUMMARY_MAX_WORKERS,
+                 section_tokens=SUMMARY_SECTION_TOKENS, reduce_tokens=SUMMARY_REDUCE_TOKENS):
+        self.llm = llm
+        self.cache = cache or get_generation_cache()
+        self.max_workers = max_workers
+        self.section_tokens = section_tokens
+        self.reduce_tokens = reduce_tokens
+
+    def _cache_key(self, kind, parts):
+        model_name, temperature = llm_identity(self.llm)
+        digest = hashlib.sha256(
+            "\0".join([kind, SECTION_PROMPT_VERSION, str(model_name), str(temperature)] + list(parts)).encode("utf-8")
+        ).hexdigest()
+        return f"{kind}:{digest}"
+
+    def _summarize(self, kind, cache_parts, prompt):
+        key = self._cache_key(kind, cache_parts)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        with telemetry.span("llm", tool=kind, streamed=False, prompt_chars=len(prompt), prompt_tokens=estimate_tokens(prompt)) as llm_span:
+            summary = self.llm.invoke(prompt)
+            llm_span.set(output_chars=len(summary))
+        self.cache.add(key, summary)
+        return summary
+
+    def _run_concurrently(self, jobs, progress_callback, stage):
+        """Runs (cache_parts, prompt) jobs on the pool and returns results in job order."""
+        results = [None] * len(jobs)
+        if not jobs:
+            return results
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(jobs)))) as executor:
+            futures = {
+                executor.submit(contextvars.copy_context().run, self._summarize, stage, cache_parts, prompt): index
+                for index, (cache_parts, prompt) in enumerate(jobs)
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                results[futures[future]] = future.result()
+                if progress_callback:
+                    try:
+                        progress_callback(stage, done, len(jobs))
+                    except BaseException:
+                        for pending in futures:  # The caller gave up (e.g. a cancelled job): don't start queued sections
+                            pending.cancel()
+                        raise
+        return results
+
+    def map(self, corpus, progress_callback=None):
+        """Returns one summary per section, in document order."""
+        started = time.perf_counter()
+        sections = build_sections(corpus, self.section_tokens)
+        jobs = [
+            (section.chunk_ids, SECTION_SUMMARY_PROMPT.format(location=section.location, text=section.text))
+            for section in sections
+        ]
+        summaries = self._run_concurrently(jobs, progress_callback, "section_summary")
+        telemetry.record("summary.map_s", time.perf_counter() - started, sections=len(sections))
+        return [(section.location, summary) for section, summary in zip(sections, summaries)]
+
+    def reduce(self, located_summaries, progress_callback=None):
+        """Merges section summaries until they fit the reduce budget; returns the combined text."""
+        texts = [f"**Summary of {location}:**\n{summary}" for location, summary in located_summaries]
+        while estimate_tokens("\n\n".join(texts)) > self.reduce_tokens and len(texts) > 1:
+            groups, current, current_tokens = [], [], 0
+            for text in texts:
+                tokens = estimate_tokens(text)
+                if current and current_tokens + tokens > self.reduce_tokens // 2:
+                    groups.append(current)
+                    current, current_tokens = [], 0
+                current.append(text)
+                current_tokens += tokens
+            if current:
+                groups.append(current)
+            if len(groups) == len(texts):
+                break  # Every summary is already its own group; merging further can't shrink anything
+            jobs = [(group, COMBINE_SUMMARIES_PROMPT.format(text="\n\n".join(group))) for group in groups]
+            texts = self._run_concurrently(jobs, progress_callback, "combine_summaries")
+        return "\n\n".join(texts)
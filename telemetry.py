@@ -0,0 +1,166 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+# --- In-process metrics ---
+# Latency measurements from every session served by this process, kept in a bounded ring buffer.
+MAX_EVENTS = 5000
+MAX_SPANS = 5000
+TRACE_FILE = os.getenv("STUDY_AI_TRACE_FILE")  # Finished spans are appended here as JSON lines when set
+
+_events = deque(maxlen=MAX_EVENTS)
+_events_lock = threading.Lock()
+_spans = deque(maxlen=MAX_SPANS)
+_spans_lock = threading.Lock()
+_current_span = contextvars.ContextVar("study_ai_span", default=None)
+
+
+def record(name, value, **attributes):
+    """Records one measurement, e.g. record("llm.ttft_s", 1.4, tool="summary")."""
+    with _events_lock:
+        _events.append({"name": name, "value": value, "time": time.time(), "attributes": attributes})
+
+
+def values(name, **attributes):
+    """Returns recorded values for `name`, oldest first, optionally filtered by attribute values."""
+    with _events_lock:
+        events = list(_events)
+    return [
+        event["value"] for event in events
+        if event["name"] == name and all(event["attributes"].get(k) == v for k, v in attributes.items())
+    ]
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize(name, **attributes):
+    samples = values(name, **attributes)
+    return {
+        "count": len(samples),
+        "p50": percentile(samples, 50),
+        "p95": percentile(samples, 95),
+        "last": samples[-1] if samples else None,
+    }
+
+
+# --- Tracing spans ---
+# One span per pipeline stage (load, split, embed, index, retrieve, prompt_build, llm, ocr.*),
+# nested by trace. The field names follow the OpenTelemetry span data model, so exported
+# lines can be loaded by OTLP/JSON tooling with little conversion.
+
+class Span:
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.status = "ok"
+        self.start_time = time.time()
+        self.end_time = None
+        self._started = time.perf_counter()
+        self.duration_s = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error=None):
+        """Finishes the span (once) and stores it; `error` marks it failed."""
+        if self.duration_s is not None:
+            return
+        self.duration_s = time.perf_counter() - self._started
+        self.end_time = self.start_time + self.duration_s
+        if error is not None:
+            self.status = "error"
+            self.attributes["error"] = f"{error.__class__.__name__}: {error}"
+        _finish_span(self)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id, "span_id": self.span_id, "parent_span_id": self.parent_id,
+            "name": self.name, "start_time_unix_nano": int(self.start_time * 1e9),
+            "end_time_unix_nano": int(self.end_time * 1e9) if self.end_time else None,
+            "duration_s": self.duration_s, "status": self.status, "attributes": self.attributes,
+        }
+
+
+def current_span():
+    return _current_span.get()
+
+
+def start_span(name, parent=None, **attributes):
+    """A span that is not made current, for work that ends elsewhere (a stream) or runs in a worker thread.
+
+    Call `end()` on it when done. `parent` defaults to the current span of the calling thread.
+    """
+    return Span(name, parent or _current_span.get(), attributes)
+
+
+@contextmanager
+def span(name, parent=None, **attributes):
+    """Times the block as a span; spans opened inside it (same thread) become its children.
+
+    Exceptions mark the span failed; control flow exceptions (a Streamlit rerun, a cancelled
+    job) just end it.
+    """
+    current = start_span(name, parent, **attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.end(error=e)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+
+def _finish_span(finished):
+    with _spans_lock:
+        _spans.append(finished)
+    record("span.duration_s", finished.duration_s, stage=finished.name)
+    if TRACE_FILE:
+        try:
+            with _spans_lock, open(TRACE_FILE, "a", encoding="utf-8") as trace_file:
+                trace_file.write(json.dumps(finished.to_dict(), default=str) + "\n")
+        except OSError as e:
+            print(f"Could not export span to {TRACE_FILE}: {e}")
+
+
+def recent_spans(limit=None):
+    with _spans_lock:
+        spans = list(_spans)
+    return spans[-limit:] if limit else spans
+
+
+def export_spans_jsonl(spans=None):
+    """The given (default: all recent) spans as JSON lines, one span per line."""
+    return "".join(json.dumps(item.to_dict(), default=str) + "\n" for item in (spans if spans is not None else recent_spans()))
+
+
+def trace_spans(trace_id):
+    """The recent spans of one trace, in start order."""
+    return sorted((item for item in recent_spans() if item.trace_id == trace_id), key=lambda item: item.start_time)
+
+
+def stage_summary():
+    """Per-stage duration percentiles over the recent spans, slowest p95 first."""
+    durations = {}
+    for item in recent_spans():
+        durations.setdefault(item.name, []).append(item.duration_s)
+    rows = [
+        {"stage": name, "count": len(samples), "p50_s": percentile(samples, 50), "p95_s": percentile(samples, 95), "last_s": samples[-1]}
+        for name, samples in durations.items()
+    ]
+    return sorted(rows, key=lambda row: row["p95_s"], reverse=True)
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+# Set before the app modules are imported: tests never touch the real caches
+os.environ["STUDY_AI_CACHE_DIR"] = tempfile.mkdtemp(prefix="study_ai_tests_")
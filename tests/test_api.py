@@ -0,0 +1,60 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+api = pytest.importorskip("api")
+
+
+def test_timed_out_worker_keeps_the_client_slot_until_it_finishes(monkeypatch):
+    monkeypatch.setattr(api, "API_TIMEOUT_S", 0.05)
+    release_worker = threading.Event()
+
+    async def timed_out_request():
+        slot = api.ClientSlot("client-a")
+        try:
+            await api.run_with_timeout(release_worker.wait, 5, slot=slot)
+        finally:
+            slot.release()
+
+    with pytest.raises(api.HTTPException) as raised:
+        asyncio.run(timed_out_request())
+    assert raised.value.status_code == 504
+    # The handler has returned, but its worker thread still runs: the slot stays taken
+    assert api.limiter._active.get("client-a") == 1
+
+    release_worker.set()
+    for _ in range(100):
+        if "client-a" not in api.limiter._active:
+            break
+        time.sleep(0.01)
+    assert "client-a" not in api.limiter._active
+
+
+def test_stream_that_hangs_before_its_first_token_times_out(monkeypatch):
+    monkeypatch.setattr(api, "API_TIMEOUT_S", 0.05)
+    release_model = threading.Event()
+
+    def hanging_completion():
+        release_model.wait(5)
+        yield "late"
+
+    async def read_stream():
+        slot = api.ClientSlot("client-b")
+        response = api.ndjson_stream(hanging_completion(), slot)
+        slot.release()  # The handler returns; the stream holds the slot
+        lines = [line async for line in response.body_iterator]
+        # The model call still runs in its worker thread: the slot stays taken until it returns
+        held_after_timeout = api.limiter._active.get("client-b")
+        release_model.set()
+        for _ in range(100):
+            if "client-b" not in api.limiter._active:
+                break
+            await asyncio.sleep(0.01)
+        return lines, held_after_timeout
+
+    lines, held_after_timeout = asyncio.run(read_stream())
+    assert lines == ['{"error": "Timed out after 0s."}\n']
+    assert held_after_timeout == 1
+    assert "client-b" not in api.limiter._active
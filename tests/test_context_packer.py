@@ -0,0 +1,44 @@
+from langchain_core.documents import Document
+
+from context_packer import pack_context, split_text
+from corpus import DocumentCorpus
+
+
+def make_corpus(page_texts):
+    documents = [Document(page_content=text, metadata={"page": number}) for number, text in enumerate(page_texts)]
+    return DocumentCorpus(documents, documents, "hash", "book.pdf")
+
+
+def numbered_words(prefix, count):
+    return " ".join(f"{prefix}{number}." for number in range(count))
+
+
+def test_split_text_pieces_do_not_overlap_and_rebuild_the_text():
+    text = numbered_words("w", 2000)
+    pieces = split_text(text, 500)
+    assert "".join(pieces) == text
+    assert all(len(piece) <= 500 for piece in pieces)
+
+
+def test_oversized_pages_are_split_so_every_page_is_represented():
+    corpus = make_corpus([numbered_words("a", 5000), numbered_words("b", 5000)])
+    packed = pack_context(corpus, budget_tokens=4000)
+
+    assert packed.omitted == []
+    assert packed.included == [1, 2]
+    assert packed.partial == [1, 2]
+    assert "a0." in packed.text and "b4999." in packed.text
+    assert "[... part of page 1 omitted for length ...]" in packed.text
+    assert "[... part of page 2 omitted for length ...]" in packed.text
+    assert packed.used_tokens <= 4000
+    assert "only part of pages 1-2" in packed.report()
+
+
+def test_single_page_document_is_packed_without_repeating_text():
+    corpus = make_corpus([numbered_words("w", 20000)])
+    packed = pack_context(corpus, budget_tokens=4000)
+
+    sent_words = [word for word in packed.text.split() if word.startswith("w")]
+    assert len(sent_words) == len(set(sent_words))
+    assert "w0." in sent_words and "w19999." in sent_words
+    assert packed.section_label == "section" and packed.omitted
@@ -0,0 +1,65 @@
+import threading
+
+from langchain_core.documents import Document
+
+from benchmarks.fakes import FakeEmbeddings
+from document_library import DocumentLibrary
+from jobs import CANCELLED, DONE, JobRunner
+
+
+class FakeCollection:
+    """Stands in for the Chroma collection: keeps the ids of the stored chunks."""
+
+    def __init__(self):
+        self.ids = set()
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self.ids.update(ids)
+
+    def delete(self, ids):
+        self.ids.difference_update(ids)
+
+
+def edit(text):
+    pages = [Document(page_content=text, metadata={"source": "Pasted Text"})]
+    return pages, [Document(page_content=part, metadata={}) for part in text.split(". ")]
+
+
+def test_an_older_edit_written_last_is_dropped(tmp_path):
+    library = DocumentLibrary(catalog_file=str(tmp_path / "library.sqlite3"))
+    collection = FakeCollection()
+    library._collection = lambda: collection
+    embeddings = FakeEmbeddings(latency_s=0, per_text_s=0)
+    first, second = library.next_edit_sequence(), library.next_edit_sequence()
+
+    # The second edit's job reaches the write first, then the slow first one
+    library.update_document("notes", "pasted-1", "Notes", *edit("Second version. Newer text"), "hash-2", embeddings, "test",
+                            edit_sequence=second)
+    stale = library.update_document("notes", "pasted-1", "Notes", *edit("First version. Older text"), "hash-1", embeddings, "test",
+                                    edit_sequence=first)
+
+    assert stale["superseded"]
+    assert library.list_documents("notes")[0]["content_hash"] == "hash-2"
+    assert {key.split(":")[0] for key in collection.ids} == {"pasted-1"} and len(collection.ids) == 2
+    pages = [row[0] for row in library._conn.execute("SELECT text FROM pages WHERE doc_id = ?", ("pasted-1",))]
+    assert pages == ["Second version. Newer text"]
+
+
+def test_a_newer_edit_cancels_the_unfinished_job_of_the_previous_one():
+    runner = JobRunner(max_workers=2)
+    started, release = threading.Event(), threading.Event()
+
+    def slow_edit(job):
+        started.set()
+        release.wait(5)
+        job.report(message="Embedding...")  # Where a cancelled job stops
+        return "old"
+
+    old_id = runner.submit("ingest", ("ingest", 1), slow_edit, supersede=("edit", "pasted-1"))
+    started.wait(5)
+    new_id = runner.submit("ingest", ("ingest", 2), lambda job: "new", supersede=("edit", "pasted-1"))
+    release.set()
+    runner._executor.shutdown(wait=True)
+
+    assert runner.get(old_id).status == CANCELLED
+    assert runner.get(new_id).status == DONE
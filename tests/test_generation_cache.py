@@ -0,0 +1,23 @@
+import threading
+
+from disk_cache import DiskLRUCache
+from generation_cache import GenerationCache
+
+
+def test_concurrent_adds_to_one_key_keep_every_variant():
+    # Two stores on one file stand in for two processes (Streamlit and the API) sharing the cache
+    caches = [GenerationCache(DiskLRUCache("generations_race.sqlite3", 1 << 20)) for _ in range(2)]
+    start = threading.Barrier(8)
+
+    def regenerate(worker):
+        start.wait()
+        for attempt in range(10):
+            caches[worker % 2].add("summary:doc", f"variant {worker}-{attempt}", max_variants=100)
+
+    threads = [threading.Thread(target=regenerate, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert caches[0].variant_count("summary:doc") == 80
@@ -0,0 +1,48 @@
+import json
+
+import pytest
+
+from study_tools import MINDMAP_GENERATION_CONFIG, generate_mindmap, parse_mindmap_graph
+
+GRAPH = {
+    "central_topic": "Photosynthesis",
+    "topics": ["Chlorophyll", "Glucose"],
+    "edges": [{"from": "Photosynthesis", "to": "Glucose", "label": "produces"}],
+}
+
+
+class RecordingLLM:
+    model, temperature = "fake-llm", 0.7
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.invoke_kwargs = None
+
+    def invoke(self, prompt, **kwargs):
+        self.invoke_kwargs = kwargs
+        return self.reply
+
+
+def test_mindmap_is_requested_in_json_mode():
+    llm = RecordingLLM(json.dumps(GRAPH))
+    mindmap = generate_mindmap("Plants make glucose from light.", llm)
+
+    assert llm.invoke_kwargs == {"generation_config": MINDMAP_GENERATION_CONFIG}
+    assert mindmap["topics"] == ["Chlorophyll", "Glucose"]
+    assert (0, 2, "produces") in mindmap["edges"]
+    assert "canvas" in mindmap
+
+
+def test_reply_with_text_and_braces_around_the_json_is_still_read():
+    reply = f"Here is the map {{as requested}}:\n```json\n{json.dumps(GRAPH)}\n```\nUse it with {{care}}."
+    graph = parse_mindmap_graph(reply)
+
+    assert graph["central_topic"] == "Photosynthesis"
+    assert graph["edges"] == [(0, 2, "produces"), (0, 1, "")]
+
+
+def test_truncated_reply_is_reported():
+    with pytest.raises(ValueError):
+        parse_mindmap_graph(json.dumps(GRAPH)[:40])
+    mindmap = generate_mindmap("text", RecordingLLM(json.dumps(GRAPH)[:40]))
+    assert "error" in mindmap and mindmap["raw_output"]
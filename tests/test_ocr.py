@@ -0,0 +1,97 @@
+"""Page-range OCR against the local stand-in for the Gemini file/generate API (benchmarks/fakes.py)."""
+import io
+import re
+import threading
+
+import pytest
+from pypdf import PdfWriter
+
+import ocr
+from benchmarks.fakes import FakeGenAI, _FakeGenerativeModel
+from study_tools import perform_ocr_with_gemini
+
+
+def blank_pdf(page_count):
+    writer = PdfWriter()
+    for _ in range(page_count):
+        writer.add_blank_page(width=612, height=792)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+class FlakyGenAI(FakeGenAI):
+    """FakeGenAI whose generate_content fails for ranges starting at `failing_pages`, `failures` times each."""
+
+    def __init__(self, failing_pages, failures):
+        super().__init__(latency_s=0, per_page_s=0, words_per_page=20)
+        self.remaining = {page: failures for page in failing_pages}
+        self.prompts = []
+        self._fail_lock = threading.Lock()
+
+    def GenerativeModel(self, model_name=None):
+        client = self
+
+        class Model(_FakeGenerativeModel):
+            def generate_content(self, prompt, request_options=None):
+                instructions = " ".join(part for part in prompt if isinstance(part, str))
+                first_page = int(re.search(r"pages? (\d+)[-\d]* of the original document", instructions).group(1))
+                with client._fail_lock:
+                    client.prompts.append(first_page)
+                    if client.remaining.get(first_page, 0) > 0:
+                        client.remaining[first_page] -= 1
+                        raise TimeoutError("deadline exceeded")
+                return super().generate_content(prompt, request_options)
+
+        return Model(self, model_name)
+
+
+@pytest.fixture(autouse=True)
+def no_retry_backoff(monkeypatch):
+    monkeypatch.setattr(ocr.time, "sleep", lambda seconds: None)
+
+
+def test_ranges_are_stitched_in_page_order_and_uploads_deleted():
+    client = FakeGenAI(latency_s=0, per_page_s=0, words_per_page=20)
+    result = ocr.perform_parallel_ocr(blank_pdf(7), "scan.pdf", client=client, pages_per_range=3, use_cache=False)
+
+    assert result.failed_ranges == []
+    assert sorted(result.page_texts) == list(range(1, 8))
+    markers = re.findall(r"^--- Page (\d+) ---$", result.text, flags=re.MULTILINE)
+    assert markers == [str(page) for page in range(1, 8)]
+    assert client.counter.calls == 3  # Pages 1-3, 4-6 and 7
+    assert client.live_files == set()
+
+
+def test_only_failed_ranges_are_retried_and_their_uploads_deleted():
+    client = FlakyGenAI(failing_pages=[4], failures=1)
+    result = ocr.perform_parallel_ocr(blank_pdf(7), "scan.pdf", client=client, pages_per_range=3, use_cache=False)
+
+    assert result.failed_ranges == []
+    assert sorted(client.prompts) == [1, 4, 4, 7]
+    assert sorted(result.page_texts) == list(range(1, 8))
+    assert client.live_files == set()
+
+
+def test_range_failing_every_attempt_is_reported():
+    client = FlakyGenAI(failing_pages=[4], failures=10)
+    result = ocr.perform_parallel_ocr(blank_pdf(7), "scan.pdf", client=client, pages_per_range=3, max_attempts=2, use_cache=False)
+
+    assert [page_range.label for page_range in result.failed_ranges] == ["pages 4-6"]
+    assert "--- Pages 4-6 ---" in result.text
+    assert "[OCR failed for pages 4-6: deadline exceeded]" in result.text
+    assert "--- Page 7 ---" in result.text
+    assert client.live_files == set()
+
+
+def test_single_request_ocr_deletes_the_upload_when_generation_fails():
+    client = FakeGenAI(latency_s=0, per_page_s=0)
+
+    class FailingModel:
+        def generate_content(self, prompt, request_options=None):
+            raise TimeoutError("deadline exceeded")
+
+    client.GenerativeModel = lambda model_name=None: FailingModel()
+    with pytest.raises(TimeoutError):
+        perform_ocr_with_gemini(client, blank_pdf(2), "scan.pdf")
+    assert client.live_files == set()
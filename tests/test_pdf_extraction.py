@@ -0,0 +1,40 @@
+import io
+import os
+
+from pypdf import PdfWriter
+
+import pdf_extraction
+
+
+def blank_pdf(page_count):
+    writer = PdfWriter()
+    for _ in range(page_count):
+        writer.add_blank_page(width=612, height=792)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def shared_blocks():
+    # Only the PDF blocks: the pool's own semaphores live in /dev/shm too
+    return {name for name in os.listdir("/dev/shm") if name.startswith("psm_")} if os.path.isdir("/dev/shm") else set()
+
+
+def test_parallel_extraction_matches_serial_and_frees_the_shared_block():
+    pdf_bytes = blank_pdf(pdf_extraction.PDF_PARALLEL_MIN_PAGES + 5)
+    before = shared_blocks()
+
+    parallel = list(pdf_extraction.iter_pdf_pages(pdf_bytes, "book.pdf", workers=2, pages_per_task=8))
+    serial = list(pdf_extraction.iter_pdf_pages(pdf_bytes, "book.pdf", workers=1))
+
+    assert [page.metadata for page in parallel] == [page.metadata for page in serial]
+    assert [page.page_content for page in parallel] == [page.page_content for page in serial]
+    assert shared_blocks() == before
+
+
+def test_stopping_early_frees_the_shared_block():
+    before = shared_blocks()
+    pages = pdf_extraction.iter_pdf_pages(blank_pdf(pdf_extraction.PDF_PARALLEL_MIN_PAGES), "book.pdf", workers=2, pages_per_task=8)
+    next(pages)
+    pages.close()
+    assert shared_blocks() == before
@@ -0,0 +1,34 @@
+from vector_registry import StudyIndex, VectorStoreRegistry
+
+
+class FakeCorpus:
+    documents = []
+    chunks = []
+
+
+def build_index():
+    return StudyIndex(vector_store=None, corpus=FakeCorpus(), approx_bytes=100)
+
+
+def test_release_of_an_invalidated_handle_leaves_the_rebuilt_entry_alone():
+    registry = VectorStoreRegistry()
+    stale = registry.acquire("doc-a", build_index)
+    registry.invalidate(lambda key: key == "doc-a")
+    fresh = registry.acquire("doc-a", build_index)
+
+    stale.release()
+    assert registry._entries["doc-a"].refs == 1
+
+    fresh.release()
+    assert registry._entries["doc-a"].refs == 0
+
+
+def test_rebuilt_entry_in_use_is_not_evicted_by_a_stale_release():
+    registry = VectorStoreRegistry(memory_budget_bytes=50)
+    stale = registry.acquire("doc-a", build_index)
+    registry.invalidate(lambda key: key == "doc-a")
+    fresh = registry.acquire("doc-a", build_index)
+
+    del stale  # Garbage collected: its finalizer runs now
+    assert "doc-a" in registry._entries
+    assert fresh.corpus is registry._entries["doc-a"].index.corpus
@@ -0,0 +1,171 @@
+import itertools
+import os
+import threading
+import time
+import weakref
+
+# --- Shared vector store registry configuration ---
+VECTOR_STORE_MEMORY_BUDGET_BYTES = int(os.getenv("STUDY_AI_VECTOR_STORE_BUDGET_MB", "2048")) * 1024 * 1024
+
+
+def estimate_index_bytes(chunks):
+    """Rough in-memory footprint of a selection: chunk and page text plus BM25 postings.
+
+    The vectors live in the persistent library collection and are not counted here.
+    """
+    text_bytes = sum(len(chunk.page_content) for chunk in chunks)
+    return len(chunks) * 512 + text_bytes * 4
+
+
+class StudyIndex:
+    """Everything a session needs to work with a selection of library documents."""
+
+    def __init__(self, vector_store, corpus, approx_bytes, lexical_index=None):
+        self.vector_store = vector_store
+        self.lexical_index = lexical_index
+        self.corpus = corpus
+        self.documents = corpus.documents
+        self.chunks = corpus.chunks
+        self.approx_bytes = approx_bytes
+
+
+class _Entry:
+    def __init__(self, index, generation):
+        self.index = index
+        self.generation = generation  # Tells a rebuilt entry apart from the one it replaced under the same key
+        self.refs = 0
+        self.last_used = time.time()
+
+
+class SharedVectorStore:
+    """Read-only view of a registry entry handed out to one session.
+
+    The reference is dropped when `release()` is called or when the handle is garbage
+    collected (e.g. the browser session that held it expires).
+    """
+
+    def __init__(self, registry, key, entry):
+        self.key = key
+        self._index = entry.index
+        self._finalizer = weakref.finalize(self, registry._release, key, entry.generation)
+
+    @property
+    def corpus(self):
+        return self._index.corpus
+
+    @property
+    def documents(self):
+        return self._index.documents
+
+    @property
+    def lexical_index(self):
+        return self._index.lexical_index
+
+    @property
+    def chunks(self):
+        return self._index.chunks
+
+    def as_retriever(self, **kwargs):
+        return self._index.vector_store.as_retriever(**kwargs)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return self._index.vector_store.similarity_search(query, k=k, **kwargs)
+
+    def release(self):
+        self._finalizer()
+
+
+class VectorStoreRegistry:
+    """Process-wide map of selection key -> built index, shared by every browser session.
+
+    Concurrent first requests for the same key build the index exactly once; the other
+    callers wait for it. Entries nobody holds are evicted, oldest first, once the
+    estimated memory of all entries exceeds the budget.
+    """
+
+    def __init__(self, memory_budget_bytes=VECTOR_STORE_MEMORY_BUDGET_BYTES):
+        self.memory_budget_bytes = memory_budget_bytes
+        # Re-entrant: a handle may be garbage collected (and release itself) while we hold the lock
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._build_locks = {}
+        self._generations = itertools.count()
+
+    def acquire(self, key, build_fn):
+        """Returns a SharedVectorStore for `key`, calling `build_fn()` -> StudyIndex if it isn't built yet."""
+        with self._lock:
+            handle = self._checkout(key)
+            if handle:
+                return handle
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+
+        with build_lock:
+            with self._lock:
+                handle = self._checkout(key)  # Another session may have finished building while we waited
+                if handle:
+                    return handle
+            index = build_fn()
+            with self._lock:
+                self._entries[key] = _Entry(index, next(self._generations))
+                self._build_locks.pop(key, None)
+                handle = self._checkout(key)
+                self._evict_idle()
+            return handle
+
+    def _checkout(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        entry.refs += 1
+        entry.last_used = time.time()
+        return SharedVectorStore(self, key, entry)
+
+    def _release(self, key, generation):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.generation != generation:
+                return  # The handle's entry was invalidated (and maybe rebuilt): nothing to count down
+            entry.refs = max(0, entry.refs - 1)
+            entry.last_used = time.time()
+            self._evict_idle()
+
+    def _evict_idle(self):
+        total = sum(entry.index.approx_bytes for entry in self._entries.values())
+        if total <= self.memory_budget_bytes:
+            return
+        idle = sorted((entry.last_used, key) for key, entry in self._entries.items() if entry.refs == 0)
+        for _, key in idle:
+            if total <= self.memory_budget_bytes:
+                break
+            entry = self._entries.pop(key)
+            total -= entry.index.approx_bytes
+
+    def invalidate(self, predicate):
+        """Drops entries whose key matches, e.g. selections containing a removed document.
+
+        Sessions still holding a handle keep their index until they release it.
+        """
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "in_use": sum(1 for entry in self._entries.values() if entry.refs),
+                "approx_bytes": sum(entry.index.approx_bytes for entry in self._entries.values()),
+            }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_vector_registry():
+    """Returns the registry shared by all sessions served by this process."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = VectorStoreRegistry()
+        return _registry